@@ -0,0 +1,32 @@
+import logging
+from typing import Optional
+
+from fastapi import APIRouter
+from pydantic import BaseModel, Field
+
+from services.collection_service import CollectionService
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/collections", tags=["集合管理"])
+
+class CollectionRequest(BaseModel):
+    collection_id: str = Field(..., description="集合ID，小写字母开头，只含小写字母、数字和下划线，最长32个字符")
+    description: Optional[str] = Field(None, description="集合说明")
+
+@router.get('')
+async def list_collections():
+    """获取集合列表"""
+    collection_service = CollectionService()
+    return await collection_service.list_collections()
+
+@router.post('')
+async def create_collection(request: CollectionRequest):
+    """创建集合（新建独立的分块分区及其索引）"""
+    collection_service = CollectionService()
+    return await collection_service.create_collection(request.collection_id, request.description)
+
+@router.delete('/{collection_id}')
+async def drop_collection(collection_id: str):
+    """删除集合及其全部文档（直接删除分区表）"""
+    collection_service = CollectionService()
+    return await collection_service.drop_collection(collection_id)
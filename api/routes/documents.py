@@ -1,8 +1,10 @@
 import logging
+from typing import Optional
 
 from fastapi import APIRouter, BackgroundTasks
 from pydantic import BaseModel, Field
 
+from models import DEFAULT_COLLECTION
 from services.document_service import DocumentService
 from services.import_service import ImportService
 
@@ -11,6 +13,10 @@ router = APIRouter(prefix="/documents", tags=["文档管理"])
 
 class ImportRequest(BaseModel):
     directory: str = Field(..., description="要导入的目录路径")
+    collection_id: str = Field(DEFAULT_COLLECTION, description="导入到的集合ID，不存在时自动创建")
+    defer_index: Optional[bool] = Field(
+        None, description="是否先删除向量索引、导入完成后重建；默认按分块数是否超过HNSW_DEFER_THRESHOLD自动决定"
+    )
 
 class ImportResponse(BaseModel):
     success: bool
@@ -23,31 +29,41 @@ class ImportResponse(BaseModel):
 async def import_directory(request: ImportRequest, background_tasks: BackgroundTasks):
     """递归导入目录下所有文档，分块、向量化并入库"""
     import_service = ImportService()
-    return await import_service.import_directory(request.directory, background_tasks)
+    return await import_service.import_directory(
+        request.directory, background_tasks, request.defer_index, request.collection_id
+    )
 
 @router.post('/sync')
 async def sync_directory(request: ImportRequest, background_tasks: BackgroundTasks):
     """增量同步目录 - 只处理新增或修改的文件"""
     import_service = ImportService()
-    return await import_service.sync_directory(request.directory, background_tasks)
+    return await import_service.sync_directory(request.directory, background_tasks, request.collection_id)
+
+@router.post('/rebuild_index')
+async def rebuild_index(background_tasks: BackgroundTasks, collection_id: Optional[str] = None):
+    """按当前HNSW构建参数重建向量索引，可只重建一个集合"""
+    import_service = ImportService()
+    return await import_service.rebuild_index(background_tasks, collection_id)
 
 @router.get('')
-async def list_documents(skip: int = 0, limit: int = 100, search: str = None):
-    """获取文档列表，支持搜索"""
+async def list_documents(skip: int = 0, limit: int = 100, search: str = None, cursor: Optional[str] = None,
+                         collection_id: Optional[str] = None):
+    """获取文档列表，支持搜索和按集合过滤；传入上一页返回的next_cursor获取下一页"""
     document_service = DocumentService()
-    return await document_service.list_documents(skip, limit, search)
+    return await document_service.list_documents(skip, limit, search, cursor, collection_id)
 
 @router.delete('/{document_id}')
-async def delete_document(document_id: str):
+async def delete_document(document_id: str, collection_id: str = DEFAULT_COLLECTION):
     """删除指定文档的所有分块"""
     document_service = DocumentService()
-    return await document_service.delete_document(document_id)
+    return await document_service.delete_document(document_id, collection_id)
 
 @router.get('/{document_id}/chunks')
-async def get_document_chunks(document_id: str, skip: int = 0, limit: int = 50):
-    """获取指定文档的所有分块"""
+async def get_document_chunks(document_id: str, skip: int = 0, limit: int = 50, cursor: Optional[str] = None,
+                              collection_id: str = DEFAULT_COLLECTION):
+    """获取指定文档的所有分块；传入上一页返回的next_cursor获取下一页"""
     document_service = DocumentService()
-    return await document_service.get_document_chunks(document_id, skip, limit)
+    return await document_service.get_document_chunks(document_id, skip, limit, cursor, collection_id)
 
 @router.post('/clear_all')
 async def clear_all_documents():
@@ -1,10 +1,11 @@
 import logging
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
-from config import QUESTION_MAX_LENGTH, SEARCH_DEFAULT_LIMIT
+from config import QUESTION_MAX_LENGTH, SEARCH_DEFAULT_LIMIT, QA_BATCH_SYNC_MAX, QA_BATCH_JOB_MAX
 from services.qa_service import QAService
 
 logger = logging.getLogger(__name__)
@@ -13,6 +14,13 @@ router = APIRouter(prefix="/qa", tags=["智能问答"])
 class QARequest(BaseModel):
     question: str = Field(..., description="用户问题", min_length=1, max_length=QUESTION_MAX_LENGTH)
     history: Optional[List[List[str]]] = Field(None, description="对话历史 [[user, assistant], ...]")
+    retrieval_mode: Optional[Literal['vector', 'lexical', 'hybrid']] = Field(
+        None, description="检索模式：vector(向量), lexical(全文), hybrid(RRF融合)，默认使用配置RETRIEVAL_MODE"
+    )
+    ef_search: Optional[int] = Field(
+        None, ge=1, le=1000, description="本次向量检索的HNSW候选列表大小，越大召回越高、越慢；默认使用配置HNSW_EF_SEARCH"
+    )
+    collections: Optional[List[str]] = Field(None, description="检索的集合ID列表，默认检索全部集合")
 
 class QAResponse(BaseModel):
     answer: str
@@ -20,21 +28,53 @@ class QAResponse(BaseModel):
 
 @router.post('', response_model=QAResponse)
 async def qa(request: QARequest):
-    """问答接口：向量召回+重排序+LLM生成"""
+    """问答接口：向量/全文混合召回+重排序+LLM生成"""
     qa_service = QAService()
     return await qa_service.answer_question(request)
 
+@router.post('/stream')
+async def qa_stream(request: QARequest):
+    """流式问答接口（SSE）：先推送参考来源，再逐段推送生成内容，最后推送耗时统计"""
+    qa_service = QAService()
+    return StreamingResponse(
+        qa_service.stream_answer(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post('/batch')
-async def batch_qa(questions: List[str]):
-    """批量问答接口"""
-    if len(questions) > 10:
-        raise HTTPException(status_code=400, detail="批量问答最多支持10个问题")
+async def batch_qa(questions: List[str], collections: Optional[List[str]] = Query(None)):
+    """批量问答接口：向量化、重排序和生成按批次合并执行"""
+    if len(questions) > QA_BATCH_SYNC_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"批量问答最多支持{QA_BATCH_SYNC_MAX}个问题，更多问题请使用 /qa/batch/jobs"
+        )
     
     qa_service = QAService()
-    return await qa_service.batch_answer(questions)
+    return await qa_service.batch_answer(questions, collections)
+
+@router.post('/batch/jobs')
+async def submit_batch_job(questions: List[str], background_tasks: BackgroundTasks,
+                           collections: Optional[List[str]] = Query(None)):
+    """提交异步批量问答任务，返回任务ID"""
+    if not questions:
+        raise HTTPException(status_code=400, detail="问题列表不能为空")
+    if len(questions) > QA_BATCH_JOB_MAX:
+        raise HTTPException(status_code=400, detail=f"单个批量任务最多支持{QA_BATCH_JOB_MAX}个问题")
+    
+    qa_service = QAService()
+    return await qa_service.submit_batch_job(questions, background_tasks, collections)
+
+@router.get('/batch/jobs/{job_id}')
+async def get_batch_job(job_id: str):
+    """查询批量问答任务进度，完成后返回全部结果"""
+    qa_service = QAService()
+    return await qa_service.get_batch_job(job_id)
 
 @router.get('/search')
-async def search_content(query: str, limit: int = SEARCH_DEFAULT_LIMIT):
-    """基于内容的文本搜索（非向量搜索）"""
+async def search_content(query: str, limit: int = SEARCH_DEFAULT_LIMIT, cursor: Optional[str] = None,
+                         collections: Optional[List[str]] = Query(None)):
+    """基于内容的文本搜索（非向量搜索），按相似度排序；传入上一页返回的next_cursor获取下一页"""
     qa_service = QAService()
-    return await qa_service.search_content(query, limit)
\ No newline at end of file
+    return await qa_service.search_content(query, limit, cursor, collections)
\ No newline at end of file
@@ -13,10 +13,10 @@ async def health_check():
     return {"status": "healthy", "timestamp": "2025-01-22"}
 
 @router.get('/stats')
-async def get_stats():
-    """获取系统统计信息"""
+async def get_stats(exact: bool = False):
+    """获取系统统计信息；exact=true 时绕过缓存精确计数（开销较大，勿用于高频监控）"""
     system_service = SystemService()
-    return await system_service.get_stats()
+    return await system_service.get_stats(exact)
 
 @router.get('/info')
 async def get_system_info():
@@ -28,4 +28,28 @@ async def get_system_info():
 async def get_model_status():
     """获取模型加载状态"""
     system_service = SystemService()
-    return await system_service.get_model_status()
\ No newline at end of file
+    return await system_service.get_model_status()
+
+@router.get('/cache_stats')
+async def get_cache_stats():
+    """获取缓存命中统计"""
+    system_service = SystemService()
+    return await system_service.get_cache_stats()
+
+@router.get('/executors')
+async def get_executor_stats():
+    """获取各阶段线程池的并发状态"""
+    system_service = SystemService()
+    return await system_service.get_executor_stats()
+
+@router.get('/db_pool')
+async def get_db_pool_stats():
+    """获取数据库连接池状态"""
+    system_service = SystemService()
+    return await system_service.get_db_pool_stats()
+
+@router.get('/workers')
+async def get_worker_memory():
+    """获取各worker进程的RSS/PSS内存占用"""
+    system_service = SystemService()
+    return await system_service.get_worker_memory()
\ No newline at end of file
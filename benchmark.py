@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+性能基准测试脚本
+
+用法:
+    python benchmark.py embedding [--directory DIR] [--limit N]
+    python benchmark.py rerank [--directory DIR] [--top-k K] [--repeat N]
+    python benchmark.py ttft [--max-length N] [--repeat N]
+    python benchmark.py scheduler [--model NAME] [--concurrency N] [--max-new-tokens N]
+    python benchmark.py prefix_cache [--model NAME] [--max-new-tokens N]
+    python benchmark.py prompt_lookup [--directory DIR] [--model NAME] [--max-new-tokens N]
+    python benchmark.py loadtest [--url URL] [--concurrency N] [--requests N]
+    python benchmark.py qa_batch [--questions FILE] [--limit N]
+    python benchmark.py search [--query Q ...] [--limit N] [--repeat N]
+    python benchmark.py quantization [--query Q ...] [--oversample N] [--build-indexes]
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+SAMPLE_SENTENCES = [
+    "员工差旅报销需在出差结束后十五个工作日内提交，并附上发票原件。",
+    "产品编号 QX-2031 的保修期为三年，期间免费提供上门维修服务。",
+    "根据合同第十二条规定，任何一方提前解约需提前三十日书面通知对方。",
+    "新员工入职培训包括信息安全、财务制度和企业文化三个模块。",
+    "The quarterly security audit covers access control, logging and backup policies.",
+    "数据中心机房温度应保持在十八至二十七摄氏度之间，湿度不超过百分之六十。",
+]
+
+
+def load_sample_texts(directory: str = None, limit: int = 512, seed: int = 42):
+    """加载测试语料：指定目录时解析真实文档分块，否则生成长度不一的合成文本"""
+    if directory:
+        from document_loader import parse_directory
+        texts = [chunk['content'] for chunk in parse_directory(directory)]
+    else:
+        rng = random.Random(seed)
+        texts = [
+            ''.join(rng.choice(SAMPLE_SENTENCES) for _ in range(rng.randint(1, 12)))
+            for _ in range(limit)
+        ]
+    return texts[:limit]
+
+
+def bench_embedding(args):
+    """测试不同批量大小下的向量化吞吐量"""
+    from embedding import get_embedding_model
+
+    texts = load_sample_texts(args.directory, args.limit)
+    if not texts:
+        print("❌ 没有可用的测试文本")
+        return
+
+    model = get_embedding_model()
+    model.get_embeddings(texts[:8], batch_size=8)  # 预热
+
+    print(f"📊 向量化吞吐量测试: {len(texts)} 个分块")
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        model.get_embeddings(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        print(f"   batch_size={batch_size:<3d} {len(texts) / elapsed:8.2f} chunks/sec  ({elapsed:.2f}秒)")
+
+
+def bench_rerank(args):
+    """对比逐条打分与批量打分的延迟，并校验分数一致性"""
+    from rerank import get_rerank_model
+
+    passages = load_sample_texts(args.directory, args.top_k)
+    if not passages:
+        print("❌ 没有可用的测试文本")
+        return
+    query = args.query
+
+    model = get_rerank_model()
+    model.compute_scores(query, passages[:2])  # 预热
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        loop_scores = [model.compute_score(query, passage) for passage in passages]
+    loop_elapsed = (time.perf_counter() - start) / args.repeat
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        batch_scores = model.compute_scores(query, passages, batch_size=args.batch_size)
+    batch_elapsed = (time.perf_counter() - start) / args.repeat
+
+    max_diff = max(abs(a - b) for a, b in zip(loop_scores, batch_scores))
+    print(f"📊 重排序测试: top_k={len(passages)}, batch_size={args.batch_size}, 重复 {args.repeat} 次")
+    print(f"   逐条打分: {loop_elapsed * 1000:8.1f} ms/问题")
+    print(f"   批量打分: {batch_elapsed * 1000:8.1f} ms/问题  (加速 {loop_elapsed / batch_elapsed:.2f}x)")
+    print(f"   最大分数差: {max_diff:.6f} {'✅' if max_diff <= args.tolerance else '❌'} (容差 {args.tolerance})")
+
+
+def build_sample_prompt(question: str, directory: str = None, top_n: int = 5):
+    """用测试语料拼出与问答接口结构一致的Prompt"""
+    context = '\n'.join(
+        f"{i}. {text}\n   出处：测试文档.txt，页码：1，段落：{i}"
+        for i, text in enumerate(load_sample_texts(directory, top_n), 1)
+    )
+    from prompts import QA_INSTRUCTION
+    return f"""{QA_INSTRUCTION}
+
+【历史对话】
+
+
+【参考资料】
+{context}
+
+【用户问题】
+{question}
+
+【你的回答】"""
+
+
+def bench_ttft(args):
+    """对比阻塞生成的总延迟与流式生成的首token延迟"""
+    from llm import get_llm_model
+
+    model = get_llm_model()
+    prompt = build_sample_prompt(args.query, args.directory)
+    prompt_length = model._prepare_inputs(prompt)['input_ids'].shape[1]
+    model.generate_answer(prompt, max_length=prompt_length + 8)  # 预热
+
+    blocking, ttft, streaming = [], [], []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        model.generate_answer(prompt, max_length=args.max_length)
+        blocking.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        first = None
+        for _ in model.stream_answer(prompt, max_length=args.max_length):
+            if first is None:
+                first = time.perf_counter() - start
+        ttft.append(first if first is not None else float('nan'))
+        streaming.append(time.perf_counter() - start)
+
+    print(f"📊 首token延迟测试: max_length={args.max_length}, 重复 {args.repeat} 次")
+    print(f"   阻塞生成（用户等待）: {sum(blocking) / len(blocking) * 1000:8.1f} ms")
+    print(f"   流式首token:          {sum(ttft) / len(ttft) * 1000:8.1f} ms")
+    print(f"   流式全部完成:         {sum(streaming) / len(streaming) * 1000:8.1f} ms")
+
+
+def _latency_summary(latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"p50 {statistics.median(ordered) * 1000:8.1f} ms, p95 {p95 * 1000:8.1f} ms"
+
+
+def bench_scheduler(args):
+    """并发请求下对比逐个generate与连续批处理的吞吐量和延迟"""
+    from llm import LLMModel
+    from llm_scheduler import GenerationScheduler
+
+    llm = LLMModel(model_name=args.model) if args.model else LLMModel()
+    questions = [f"{args.query}（第{i + 1}问）" for i in range(args.requests)]
+    prompts = [build_sample_prompt(q, args.directory, top_n=2) for q in questions]
+    max_lengths = [llm._prepare_inputs(p)['input_ids'].shape[1] + args.max_new_tokens for p in prompts]
+
+    def run_direct(i):
+        start = time.perf_counter()
+        answer = llm.generate_answer(prompts[i], max_length=max_lengths[i])
+        return time.perf_counter() - start, len(llm.tokenizer(answer)['input_ids'])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        direct = list(pool.map(run_direct, range(len(prompts))))
+    direct_elapsed = time.perf_counter() - start
+
+    scheduler = GenerationScheduler(llm, max_batch_size=args.concurrency)
+    scheduler.generate(prompts[0], max_length=max_lengths[0] - args.max_new_tokens + 4).result()  # 预热
+
+    start = time.perf_counter()
+    handles = [scheduler.generate(p, max_length=m) for p, m in zip(prompts, max_lengths)]
+    batched = [h.result() for h in handles]
+    batched_elapsed = time.perf_counter() - start
+
+    direct_tokens = sum(tokens for _, tokens in direct)
+    batched_tokens = sum(r['tokens'] for r in batched)
+    print(f"📊 连续批处理测试: {len(prompts)} 个请求, 并发 {args.concurrency}, max_new_tokens={args.max_new_tokens}")
+    print(f"   逐个generate: {direct_tokens / direct_elapsed:8.2f} tokens/sec  {_latency_summary([t for t, _ in direct])}")
+    print(f"   连续批处理:   {batched_tokens / batched_elapsed:8.2f} tokens/sec  {_latency_summary([r['latency'] for r in batched])}")
+    print(f"   解码步数: {scheduler.stats()['decode_steps']}")
+
+
+def bench_prefix_cache(args):
+    """回归校验：贪心解码下复用前缀KV缓存与完整prefill输出一致，并对比prefill耗时"""
+    import torch
+    from config import LLM_INPUT_MAX_LENGTH
+    from llm import LLMModel
+
+    llm = LLMModel(model_name=args.model) if args.model else LLMModel()
+    if llm._prefix_cache is None:
+        print("❌ 前缀KV缓存未启用（LLM_PREFIX_CACHE_ENABLED=false）")
+        sys.exit(1)
+
+    prompt = build_sample_prompt(args.query, args.directory)
+    inputs = llm._prepare_inputs(prompt)
+    prompt_length = inputs['input_ids'].shape[1]
+    full_ids = llm.tokenizer(llm._apply_template(prompt))['input_ids'][:LLM_INPUT_MAX_LENGTH]
+    aligned = full_ids == inputs['input_ids'][0].tolist()
+
+    def run(use_prefix_cache, max_new_tokens):
+        kwargs = llm._generation_kwargs(inputs, prompt_length + max_new_tokens, use_prefix_cache=use_prefix_cache)
+        kwargs.update(do_sample=False, temperature=None, top_p=None, top_k=None)
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs = llm.model.generate(**kwargs)
+        return outputs[0][prompt_length:].tolist(), time.perf_counter() - start
+
+    baseline, _ = run(False, args.max_new_tokens)
+    cached, _ = run(True, args.max_new_tokens)
+    identical = baseline == cached
+
+    full_prefill = min(run(False, 1)[1] for _ in range(args.repeat))
+    cached_prefill = min(run(True, 1)[1] for _ in range(args.repeat))
+
+    print(f"📊 前缀KV缓存测试: 前缀 {len(llm._prefix_ids)} 个token / Prompt {prompt_length} 个token")
+    print(f"   分词对齐: {'✅' if aligned else '❌'}")
+    print(f"   贪心解码输出一致: {'✅' if identical else '❌'} ({len(baseline)} 个token)")
+    print(f"   完整prefill: {full_prefill * 1000:8.1f} ms")
+    print(f"   复用前缀:    {cached_prefill * 1000:8.1f} ms")
+    if not (aligned and identical):
+        sys.exit(1)
+
+
+def bench_prompt_lookup(args):
+    """贪心解码下对比普通自回归与Prompt Lookup辅助解码的吞吐量和草稿接受率"""
+    import torch
+    from llm import LLMModel
+
+    llm = LLMModel(model_name=args.model) if args.model else LLMModel()
+    questions = [f"{args.query}（第{i + 1}问）" for i in range(args.requests)]
+    prompts = [build_sample_prompt(q, args.directory) for q in questions]
+
+    baseline_tokens = lookup_tokens = 0
+    baseline_time = lookup_time = 0.0
+    identical = 0
+    for prompt in prompts:
+        inputs = llm._prepare_inputs(prompt)
+        prompt_length = inputs['input_ids'].shape[1]
+
+        kwargs = llm._generation_kwargs(inputs, prompt_length + args.max_new_tokens)
+        kwargs.update(do_sample=False, temperature=None, top_p=None, top_k=None)
+        start = time.perf_counter()
+        with torch.no_grad():
+            baseline = llm.model.generate(**kwargs)[0][prompt_length:].tolist()
+        baseline_time += time.perf_counter() - start
+        baseline_tokens += len(baseline)
+
+        start = time.perf_counter()
+        generated = llm.generate_with_prompt_lookup(
+            inputs['input_ids'][0].tolist(), args.max_new_tokens, temperature=0,
+            num_draft_tokens=args.num_draft_tokens
+        )
+        lookup_time += time.perf_counter() - start
+        lookup_tokens += len(generated)
+        identical += generated == baseline
+
+    stats = llm.get_lookup_stats()
+    print(f"📊 Prompt Lookup解码测试: {len(prompts)} 个问题, max_new_tokens={args.max_new_tokens}")
+    print(f"   普通解码:        {baseline_tokens / baseline_time:8.2f} tokens/sec")
+    print(f"   Prompt Lookup:   {lookup_tokens / lookup_time:8.2f} tokens/sec  (加速 {(lookup_tokens / lookup_time) / (baseline_tokens / baseline_time):.2f}x)")
+    print(f"   草稿接受率: {stats['acceptance_ratio']:.2%}，平均每次前向 {stats['tokens_per_step']} 个token")
+    print(f"   贪心输出一致: {identical}/{len(prompts)}")
+
+
+def _http_request(url: str, payload: dict = None, timeout: float = 600):
+    """发送HTTP请求并返回耗时（秒）"""
+    import json
+    import urllib.request
+
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def bench_loadtest(args):
+    """并发问答压测期间持续探测健康检查接口，验证事件循环不被阻塞"""
+    import threading
+
+    url = args.url.rstrip('/')
+    stop = threading.Event()
+    health = []
+
+    def probe():
+        while not stop.is_set():
+            try:
+                health.append(_http_request(f"{url}/system/health", timeout=30))
+            except Exception as e:
+                print(f"⚠️ 健康检查失败: {e}")
+            time.sleep(args.probe_interval)
+
+    def ask(i):
+        return _http_request(f"{url}/qa", {"question": f"{args.query}（第{i + 1}问）"})
+
+    prober = threading.Thread(target=probe, daemon=True)
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        qa = list(pool.map(ask, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    prober.join()
+
+    print(f"📊 压测: {args.requests} 个问答请求, 并发 {args.concurrency}, 总耗时 {elapsed:.1f}秒")
+    print(f"   问答延迟:     {_latency_summary(qa)}")
+    if health:
+        print(f"   健康检查延迟: {_latency_summary(health)}, max {max(health) * 1000:8.1f} ms ({len(health)} 次)")
+
+
+def bench_qa_batch(args):
+    """对比逐个调用answer_question与批量流水线的问答吞吐量（需要已导入文档的数据库）"""
+    import asyncio
+    from api.routes.qa import QARequest
+    from services.qa_service import QAService
+
+    if args.questions:
+        with open(args.questions, 'r', encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = [sentence[:20] + "？" for sentence in SAMPLE_SENTENCES]
+    questions = (questions * (args.limit // len(questions) + 1))[:args.limit]
+    service = QAService()
+
+    async def sequential():
+        for question in questions:
+            await service.answer_question(QARequest(question=question, history=[]))
+
+    asyncio.run(service.batch_answer(questions[:2]))  # 预热
+
+    print(f"📊 批量问答吞吐量: {len(questions)} 个问题")
+    for name, run in (("逐个问答", sequential), ("批量流水线", lambda: service.batch_answer(questions))):
+        start = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        print(f"   {name:<6s} {len(questions) / elapsed * 60:8.1f} questions/min  ({elapsed:.1f}秒)")
+
+
+def bench_search(args):
+    """对比原顺序扫描ILIKE与trigram索引加速的相似度排序搜索（需要已导入文档的数据库）"""
+    from sqlalchemy import text
+    from db import SessionLocal
+    from models import DocumentChunk
+    from services.qa_service import QAService
+
+    service = QAService()
+
+    def legacy(session, query):
+        session.query(DocumentChunk).filter(DocumentChunk.content.ilike(f'%{query}%')).limit(args.limit).all()
+
+    def indexed(session, query):
+        service._search_content(session, query, args.limit)
+
+    print(f"📊 内容搜索: {len(args.query)} 个查询 x {args.repeat} 次, limit={args.limit}")
+    for name, search, seqscan in (("原ILIKE(顺序扫描)", legacy, True), ("trigram索引+排序", indexed, False)):
+        session = SessionLocal()
+        try:
+            if seqscan:
+                # 事务内关闭索引扫描，模拟未建trigram索引时的执行计划
+                session.execute(text("SET LOCAL enable_bitmapscan = off"))
+                session.execute(text("SET LOCAL enable_indexscan = off"))
+            latencies = []
+            for query in args.query:
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    search(session, query)
+                    latencies.append(time.perf_counter() - start)
+            print(f"   {name:<14s} {_latency_summary(latencies)}")
+        finally:
+            session.rollback()
+            session.close()
+
+
+def bench_quantization(args):
+    """对比全精度、halfvec、二值量化三种向量索引的recall@k与检索延迟（需要已导入文档的数据库）"""
+    from sqlalchemy import text
+    from config import TOP_K
+    from db import SessionLocal, engine, partition_name, vector_index_ddl, vector_index_name, VECTOR_INDEXES
+    from embedding import get_query_embeddings
+    from services.qa_service import QAService
+
+    if args.build_indexes:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for mode in VECTOR_INDEXES:
+                print(f"🔧 创建 {mode} 索引（已存在则跳过）...")
+                conn.execute(text(vector_index_ddl(args.collection, mode)))
+    with engine.connect() as conn:
+        existing = {row[0] for row in conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :table"
+        ), {"table": partition_name(args.collection)})}
+
+    service = QAService()
+    questions = args.query
+    q_embs = get_query_embeddings(questions)
+    collections = [args.collection]
+    session = SessionLocal()
+    try:
+        # 关闭索引扫描得到精确最近邻作为基准
+        session.execute(text("SET LOCAL enable_indexscan = off"))
+        session.execute(text("SET LOCAL enable_bitmapscan = off"))
+        truth = [
+            {doc['meta']['chunk_id'] for doc in service._retrieve(session, q_emb, storage='full', collections=collections)}
+            for q_emb in q_embs
+        ]
+        session.rollback()
+
+        print(f"📊 向量检索: {len(questions)} 个查询, k={TOP_K}, 量化模式过采样 {args.oversample} 倍")
+        for mode in VECTOR_INDEXES:
+            index_name = vector_index_name(args.collection, mode)
+            if index_name not in existing:
+                print(f"   {mode:<8s} 跳过：索引 {index_name} 不存在（使用 --build-indexes 创建）")
+                continue
+            latencies, recalls = [], []
+            for q_emb, expected in zip(q_embs, truth):
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    docs = service._retrieve(session, q_emb, storage=mode, oversample=args.oversample,
+                                             collections=collections)
+                    latencies.append(time.perf_counter() - start)
+                found = {doc['meta']['chunk_id'] for doc in docs}
+                recalls.append(len(found & expected) / len(expected) if expected else 1.0)
+            session.rollback()
+            print(f"   {mode:<8s} recall@{TOP_K} {statistics.mean(recalls):.3f}  {_latency_summary(latencies)}")
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="企业RAG应用性能基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    embedding_parser = subparsers.add_parser("embedding", help="向量化批量吞吐量")
+    embedding_parser.add_argument("--directory", help="用于测试的文档目录，默认使用合成文本")
+    embedding_parser.add_argument("--limit", type=int, default=512, help="测试分块数量")
+    embedding_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    embedding_parser.set_defaults(func=bench_embedding)
+
+    rerank_parser = subparsers.add_parser("rerank", help="重排序逐条与批量打分对比")
+    rerank_parser.add_argument("--directory", help="用于测试的文档目录，默认使用合成文本")
+    rerank_parser.add_argument("--query", default="出差报销需要在多少天内提交？")
+    rerank_parser.add_argument("--top-k", type=int, default=10, help="每个问题的候选文档块数量")
+    rerank_parser.add_argument("--batch-size", type=int, default=None, help="微批大小，默认读取RERANK_BATCH_SIZE")
+    rerank_parser.add_argument("--repeat", type=int, default=5)
+    rerank_parser.add_argument("--tolerance", type=float, default=1e-2, help="分数一致性容差（float16推理）")
+    rerank_parser.set_defaults(func=bench_rerank)
+
+    ttft_parser = subparsers.add_parser("ttft", help="流式生成首token延迟")
+    ttft_parser.add_argument("--directory", help="用于拼接参考资料的文档目录，默认使用合成文本")
+    ttft_parser.add_argument("--query", default="出差报销需要在多少天内提交？")
+    ttft_parser.add_argument("--max-length", type=int, default=1024, help="生成总长度上限（含输入）")
+    ttft_parser.add_argument("--repeat", type=int, default=3)
+    ttft_parser.set_defaults(func=bench_ttft)
+
+    scheduler_parser = subparsers.add_parser("scheduler", help="LLM连续批处理吞吐量与延迟")
+    scheduler_parser.add_argument("--model", help="测试用模型，默认使用LLM_MODEL，可指定小模型快速验证")
+    scheduler_parser.add_argument("--directory", help="用于拼接参考资料的文档目录，默认使用合成文本")
+    scheduler_parser.add_argument("--query", default="出差报销需要在多少天内提交？")
+    scheduler_parser.add_argument("--requests", type=int, default=16, help="请求总数")
+    scheduler_parser.add_argument("--concurrency", type=int, default=8, help="并发数（同时也是批次上限）")
+    scheduler_parser.add_argument("--max-new-tokens", type=int, default=64)
+    scheduler_parser.set_defaults(func=bench_scheduler)
+
+    prefix_parser = subparsers.add_parser("prefix_cache", help="前缀KV缓存一致性校验与prefill耗时")
+    prefix_parser.add_argument("--model", help="测试用模型，默认使用LLM_MODEL")
+    prefix_parser.add_argument("--directory", help="用于拼接参考资料的文档目录，默认使用合成文本")
+    prefix_parser.add_argument("--query", default="出差报销需要在多少天内提交？")
+    prefix_parser.add_argument("--max-new-tokens", type=int, default=64)
+    prefix_parser.add_argument("--repeat", type=int, default=3)
+    prefix_parser.set_defaults(func=bench_prefix_cache)
+
+    lookup_parser = subparsers.add_parser("prompt_lookup", help="Prompt Lookup辅助解码吞吐量与接受率")
+    lookup_parser.add_argument("--model", help="测试用模型，默认使用LLM_MODEL")
+    lookup_parser.add_argument("--directory", help="用于拼接参考资料的文档目录，建议使用本地真实语料")
+    lookup_parser.add_argument("--query", default="出差报销需要在多少天内提交？")
+    lookup_parser.add_argument("--requests", type=int, default=5, help="测试问题数")
+    lookup_parser.add_argument("--max-new-tokens", type=int, default=128)
+    lookup_parser.add_argument("--num-draft-tokens", type=int, default=None, help="每步草稿token数，默认读取配置")
+    lookup_parser.set_defaults(func=bench_prompt_lookup)
+
+    loadtest_parser = subparsers.add_parser("loadtest", help="并发问答时健康检查接口的响应性")
+    loadtest_parser.add_argument("--url", default="http://localhost:8000", help="已启动的服务地址")
+    loadtest_parser.add_argument("--query", default="出差报销需要在多少天内提交？")
+    loadtest_parser.add_argument("--requests", type=int, default=16)
+    loadtest_parser.add_argument("--concurrency", type=int, default=8)
+    loadtest_parser.add_argument("--probe-interval", type=float, default=0.1, help="健康检查探测间隔（秒）")
+    loadtest_parser.set_defaults(func=bench_loadtest)
+
+    batch_parser = subparsers.add_parser("qa_batch", help="逐个问答与批量流水线的吞吐量对比")
+    batch_parser.add_argument("--questions", help="问题文件，每行一个问题；默认使用内置示例")
+    batch_parser.add_argument("--limit", type=int, default=32, help="问题数")
+    batch_parser.set_defaults(func=bench_qa_batch)
+
+    search_parser = subparsers.add_parser("search", help="顺序扫描与trigram索引的内容搜索延迟对比")
+    search_parser.add_argument("--query", nargs="+", default=["报销", "QX-2031", "信息安全"])
+    search_parser.add_argument("--limit", type=int, default=20)
+    search_parser.add_argument("--repeat", type=int, default=5)
+    search_parser.set_defaults(func=bench_search)
+
+    quant_parser = subparsers.add_parser("quantization", help="全精度/halfvec/二值量化索引的召回率与延迟对比")
+    quant_parser.add_argument("--query", nargs="+", default=[s[:20] for s in SAMPLE_SENTENCES])
+    quant_parser.add_argument("--oversample", type=int, default=4, help="量化模式首轮召回倍数")
+    quant_parser.add_argument("--repeat", type=int, default=5)
+    quant_parser.add_argument("--build-indexes", action="store_true", help="先创建三种模式的向量索引")
+    quant_parser.add_argument("--collection", default="default", help="测试的集合ID")
+    quant_parser.set_defaults(func=bench_quantization)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
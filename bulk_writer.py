@@ -0,0 +1,265 @@
+import io
+import json
+import logging
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from config import COPY_BATCH_BYTES
+from db import engine
+from document_loader import file_fingerprint
+from lexical import lexical_text
+from local_index import update_local_index
+from models import EMBEDDING_DIM, DEFAULT_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_COPY_TRAILER = struct.pack('>h', -1)
+
+# 暂存表与documents_chunk列一一对应，lexical列在插入时转为tsvector；ON COMMIT DELETE ROWS保证事务间互不可见
+_STAGE_DDL = f"""
+CREATE TEMP TABLE IF NOT EXISTS chunk_copy_stage (
+    ord integer,
+    document_id varchar,
+    version integer,
+    document_name varchar,
+    document_path varchar,
+    page_num integer,
+    paragraph_num integer,
+    chunk_index integer,
+    content text,
+    embedding vector({EMBEDDING_DIM}),
+    lexical text,
+    extra_metadata json
+) ON COMMIT DELETE ROWS
+"""
+_STAGE_COLUMNS = ('ord', 'document_id', 'version', 'document_name', 'document_path', 'page_num',
+                  'paragraph_num', 'chunk_index', 'content', 'embedding', 'lexical', 'extra_metadata')
+_COPY_SQL = f"COPY chunk_copy_stage ({', '.join(_STAGE_COLUMNS)}) FROM STDIN WITH (FORMAT binary)"
+_INSERT_SQL = """
+INSERT INTO documents_chunk (collection_id, document_id, version, document_name, document_path, page_num, paragraph_num,
+                             chunk_index, content, embedding, content_tsv, extra_metadata)
+SELECT %s, document_id, version, document_name, document_path, page_num, paragraph_num,
+       chunk_index, content, embedding, to_tsvector('simple', lexical), extra_metadata
+FROM chunk_copy_stage ORDER BY ord
+RETURNING id, document_id, chunk_index
+"""
+_MANIFEST_INSERT = """
+INSERT INTO documents (collection_id, document_id, document_name, document_path, content_hash, file_size, mtime,
+                       chunk_count, status, version, created_at, updated_at)
+VALUES (%(collection_id)s, %(document_id)s, %(document_name)s, %(document_path)s, %(content_hash)s, %(file_size)s, %(mtime)s,
+        %(chunk_count)s, %(status)s, %(version)s, now(), now())
+"""
+# 文档清单与分块同一事务写入；导入同一文档的剩余分块时累加分块数
+_MANIFEST_SQL = _MANIFEST_INSERT + """
+ON CONFLICT (collection_id, document_id) DO UPDATE SET
+    chunk_count = CASE WHEN documents.status = 'ready' THEN documents.chunk_count ELSE 0 END + EXCLUDED.chunk_count,
+    content_hash = EXCLUDED.content_hash, file_size = EXCLUDED.file_size, mtime = EXCLUDED.mtime,
+    status = EXCLUDED.status, updated_at = now()
+"""
+
+_PendingDocument = namedtuple('_PendingDocument', 'chunks embeddings rows replace_document_id manifest')
+
+
+def _text(value) -> bytes:
+    if value is None:
+        return struct.pack('>i', -1)
+    data = str(value).encode('utf-8')
+    return struct.pack('>i', len(data)) + data
+
+def _int4(value) -> bytes:
+    if value is None:
+        return struct.pack('>i', -1)
+    return struct.pack('>ii', 4, int(value))
+
+def _vector(value) -> bytes:
+    """pgvector二进制格式：int16维度 + int16保留位 + 大端float4数组"""
+    data = np.asarray(value, dtype='>f4')
+    return struct.pack('>ihh', 4 + data.nbytes, len(data), 0) + data.tobytes()
+
+
+class ChunkCopyWriter:
+    """以 COPY ... FROM STDIN (FORMAT binary) 批量写入一个集合的分块
+
+    以文档为单位缓冲，缓冲区编码后超过 COPY_BATCH_BYTES 时整批写入：
+    先COPY进临时暂存表，再 INSERT ... SELECT 到 documents_chunk 并生成tsvector，
+    同一事务内把被替换的旧版本标记为retired并维护 documents 清单，旧版本分块由
+    db.collect_retired_versions 在后台分批删除。整批失败时逐个文档单独重试，
+    一个文档的分块要么全部写入、要么全部回滚。
+    """
+
+    def __init__(self, collection_id: str = DEFAULT_COLLECTION, batch_bytes: int = COPY_BATCH_BYTES):
+        self.collection_id = collection_id
+        self.batch_bytes = batch_bytes
+        self._pending = []
+        self._pending_bytes = 0
+        self.documents = 0
+        self.chunks = 0
+        self.failed_documents = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+
+    @staticmethod
+    def _encode(chunks: list, embeddings, version: int) -> list:
+        """按暂存表列顺序编码每个分块的字段（不含字段数和ord，写入时补上）"""
+        rows = []
+        for chunk, embedding in zip(chunks, embeddings):
+            meta = chunk['meta']
+            rows.append(b''.join((
+                _text(meta['document_id']),
+                _int4(version),
+                _text(meta['document_name']),
+                _text(meta['document_path']),
+                _int4(meta.get('page_num')),
+                _int4(meta.get('paragraph_num')),
+                _int4(chunk['chunk_index']),
+                _text(chunk['content']),
+                _vector(embedding),
+                _text(lexical_text(chunk['content'])),
+                _text(json.dumps(meta, ensure_ascii=False))
+            )))
+        return rows
+
+    def _manifest(self, chunks: list, version: int, status: str = 'ready') -> dict:
+        meta = chunks[0]['meta']
+        try:
+            fingerprint = file_fingerprint(meta['document_path'])
+        except OSError:
+            fingerprint = {"content_hash": None, "file_size": None, "mtime": None}
+        return {
+            "collection_id": self.collection_id, "document_id": meta['document_id'], "document_name": meta['document_name'],
+            "document_path": meta['document_path'], "chunk_count": len(chunks),
+            "status": status, "version": version, **fingerprint
+        }
+
+    def add_document(self, chunks: list, embeddings, replace_document_id: str = None, version: int = 1):
+        """缓冲一个文档的全部分块；replace_document_id 为同一事务内要切换掉的旧版本文档ID"""
+        if not chunks and not replace_document_id:
+            return
+        rows = self._encode(chunks, embeddings, version)
+        manifest = self._manifest(chunks, version) if chunks else None
+        self._pending.append(_PendingDocument(
+            chunks, np.asarray(embeddings, dtype=np.float32), rows, replace_document_id, manifest
+        ))
+        self._pending_bytes += sum(len(row) for row in rows)
+        if self._pending_bytes >= self.batch_bytes:
+            self.flush()
+
+    def flush(self):
+        """写入缓冲区中的全部文档"""
+        pending, self._pending, self._pending_bytes = self._pending, [], 0
+        if not pending:
+            return
+        try:
+            self._write(pending)
+        except Exception as e:
+            if len(pending) == 1:
+                self._fail(pending[0], e)
+                return
+            logger.warning(f"批量写入 {len(pending)} 个文档失败，逐个文档重试: {e}")
+            for document in pending:
+                try:
+                    self._write([document])
+                except Exception as document_error:
+                    self._fail(document, document_error)
+
+    def _fail(self, document: _PendingDocument, error: Exception):
+        """记录写入失败；新文档在清单中标记为failed，下次同步时重试，被替换的旧版本保持不变"""
+        self.failed_documents += 1
+        path = document.manifest['document_path'] if document.manifest else document.replace_document_id
+        logger.error(f"写入文档失败 {path}: {error}")
+        if document.manifest is None or document.replace_document_id:
+            return
+        conn = engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                _MANIFEST_INSERT + "ON CONFLICT (collection_id, document_id) DO NOTHING",
+                {**document.manifest, "chunk_count": 0, "status": 'failed'}
+            )
+            conn.commit()
+        except Exception as manifest_error:
+            conn.rollback()
+            logger.error(f"记录失败文档清单失败: {manifest_error}")
+        finally:
+            conn.close()
+
+    def _write(self, documents: list):
+        """在一个事务内COPY写入新版本并切走旧版本，提交后同步本地向量索引"""
+        buffer = io.BytesIO()
+        buffer.write(_COPY_HEADER)
+        field_count = struct.pack('>h', len(_STAGE_COLUMNS))
+        position = 0
+        for document in documents:
+            for row in document.rows:
+                buffer.write(field_count + _int4(position) + row)
+                position += 1
+        buffer.write(_COPY_TRAILER)
+        buffer.seek(0)
+
+        replaced = [document.replace_document_id for document in documents if document.replace_document_id]
+        # 文档ID未变（重试上次失败的写入）时只能原地替换，其余旧版本保留到后台回收
+        written = {document.manifest['document_id'] for document in documents if document.manifest}
+        in_place = [document_id for document_id in replaced if document_id in written]
+        conn = engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            removed_ids = []
+            if in_place:
+                cursor.execute(
+                    "DELETE FROM documents_chunk WHERE collection_id = %s AND document_id = ANY(%s) RETURNING id",
+                    (self.collection_id, in_place)
+                )
+                removed_ids = [row[0] for row in cursor.fetchall()]
+            if replaced:
+                # 旧版本标记为retired即从检索中切走，与新版本分块在同一事务提交，读者只会看到其中一个版本
+                cursor.execute("""
+                    UPDATE documents SET status = 'retired', updated_at = now()
+                    WHERE collection_id = %s AND document_id = ANY(%s) AND NOT (document_id = ANY(%s)) AND status = 'ready'
+                    RETURNING document_id
+                """, (self.collection_id, replaced, in_place))
+                retired = [row[0] for row in cursor.fetchall()]
+                if retired:
+                    cursor.execute(
+                        "SELECT id FROM documents_chunk WHERE collection_id = %s AND document_id = ANY(%s)",
+                        (self.collection_id, retired)
+                    )
+                    removed_ids += [row[0] for row in cursor.fetchall()]
+                cursor.execute(
+                    "DELETE FROM documents WHERE collection_id = %s AND document_id = ANY(%s) AND status <> 'retired'",
+                    (self.collection_id, replaced)
+                )
+            inserted = []
+            if position:
+                cursor.execute(_STAGE_DDL)
+                cursor.copy_expert(_COPY_SQL, buffer)
+                cursor.execute(_INSERT_SQL, (self.collection_id,))
+                inserted = cursor.fetchall()
+            manifests = [document.manifest for document in documents if document.manifest]
+            if manifests:
+                cursor.executemany(_MANIFEST_SQL, manifests)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        # RETURNING不保证顺序，按 (document_id, chunk_index) 对应回向量
+        ids = {(document_id, chunk_index): chunk_id for chunk_id, document_id, chunk_index in inserted}
+        added_ids, added_vectors = [], []
+        for document in documents:
+            for chunk, embedding in zip(document.chunks, document.embeddings):
+                added_ids.append(ids[(chunk['meta']['document_id'], chunk['chunk_index'])])
+                added_vectors.append(embedding)
+        update_local_index(self.collection_id, added_ids, added_vectors, removed_ids)
+        self.documents += len(documents)
+        self.chunks += position
@@ -18,6 +18,31 @@ PG_USER = os.getenv('PG_USER', 'postgres')          # 数据库用户名
 PG_PASSWORD = os.getenv('PG_PASSWORD', 'postgres')  # 数据库密码
 PG_DB = os.getenv('PG_DB', 'rag')                   # 数据库名
 PG_URL = f'postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}?client_encoding=utf8'  # SQLAlchemy连接URL
+PG_ASYNC_URL = f'postgresql+asyncpg://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}'  # 异步引擎连接URL(asyncpg)
+DB_ASYNC_ENABLED = os.getenv('DB_ASYNC_ENABLED', 'false').lower() == 'true'  # 问答和文档接口是否使用异步引擎
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 20))                # 连接池常驻连接数
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))          # 连接池允许的额外溢出连接数
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))        # 获取连接的最长等待时间(秒)
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))        # 连接最长存活时间(秒)，超过后重建
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 100))  # asyncpg预编译语句缓存大小，经pgbouncer事务模式连接时设为0
+PG_REPLICA_URLS = [url.strip() for url in os.getenv('PG_REPLICA_URLS', '').split(',') if url.strip()]  # 只读副本连接URL(psycopg2)，逗号分隔，为空时全部走主库
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))          # 副本允许的最大复制延迟(秒)，超过后读请求回落主库
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))  # 副本健康与延迟检查间隔(秒)
+
+# ===================== 向量索引配置 =====================
+HNSW_M = int(os.getenv('HNSW_M', 16))                                  # HNSW每个节点的最大连接数
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 64))      # HNSW构建时的候选列表大小
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 40))                  # 默认查询候选列表大小，越大召回越高、越慢
+HNSW_BUILD_MAINTENANCE_WORK_MEM = os.getenv('HNSW_BUILD_MAINTENANCE_WORK_MEM', '2GB')  # 重建索引时的maintenance_work_mem
+HNSW_BUILD_PARALLEL_WORKERS = int(os.getenv('HNSW_BUILD_PARALLEL_WORKERS', 4))          # 重建索引时的并行worker数
+HNSW_DEFER_THRESHOLD = int(os.getenv('HNSW_DEFER_THRESHOLD', 50000))   # 单次导入分块数超过该值时先删索引、导入后重建
+PG_PREWARM_ENABLED = os.getenv('PG_PREWARM_ENABLED', 'false').lower() == 'true'  # 启动时用pg_prewarm预热向量索引
+VECTOR_STORAGE_MODE = os.getenv('VECTOR_STORAGE_MODE', 'full')       # 向量索引模式：full(float32), halfvec(float16), binary(二值量化)
+VECTOR_OVERSAMPLE = int(os.getenv('VECTOR_OVERSAMPLE', 4))             # 量化模式下首轮召回 TOP_K*倍数 个候选，再用全精度向量重打分
+LOCAL_INDEX_ENABLED = os.getenv('LOCAL_INDEX_ENABLED', 'false').lower() == 'true'  # 向量检索是否走进程内内存映射索引
+LOCAL_INDEX_DIR = os.getenv('LOCAL_INDEX_DIR', './cache/ann')          # 本地向量索引文件目录
+LOCAL_INDEX_NLIST = int(os.getenv('LOCAL_INDEX_NLIST', 0))             # IVF簇数，0表示按分块数的平方根自动确定
+LOCAL_INDEX_NPROBE = int(os.getenv('LOCAL_INDEX_NPROBE', 16))          # 每次检索扫描的IVF簇数，越大召回越高、越慢
 
 # ===================== 模型配置 =====================
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'Qwen/Qwen3-Embedding-0.6B')  # 向量化模型名称
@@ -36,6 +61,9 @@ TOP_K = int(os.getenv('TOP_K', 10))                      # 检索时召回Top-K
 TOP_N = int(os.getenv('TOP_N', 5))                       # 重排序后选取Top-N文档块注入Prompt
 HISTORY_ROUNDS = int(os.getenv('HISTORY_ROUNDS', 5))     # 多轮对话拼接的最大轮数
 MAX_HISTORY_TOKENS = int(os.getenv('MAX_HISTORY_TOKENS', 800))  # 多轮对话拼接的最大token数
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')        # 默认检索模式：vector(向量), lexical(全文), hybrid(两者RRF融合)
+LEXICAL_TOP_K = int(os.getenv('LEXICAL_TOP_K', TOP_K))         # 全文检索召回数
+RRF_K = int(os.getenv('RRF_K', 60))                              # RRF融合常数，越大排名靠后的结果权重越高
 SUPPORTED_EXTS = [         # 支持的文档扩展名
     '.txt', '.pdf', '.docx', '.xlsx', '.md', '.png', '.jpg', '.jpeg'
 ]
@@ -45,6 +73,8 @@ APP_HOST = os.getenv('APP_HOST', '0.0.0.0')
 APP_PORT = int(os.getenv('APP_PORT', 8000))
 DEBUG = os.getenv('DEBUG', 'false').lower() == 'true'
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+APP_WORKERS = int(os.getenv('APP_WORKERS', 1))                  # 服务进程数，大于1时主进程预加载模型后fork出worker共享权重
+WORKER_TORCH_THREADS = int(os.getenv('WORKER_TORCH_THREADS', 0))  # 每个worker的推理线程数，0表示按CPU核数平均分配
 
 # ===================== 模型推理配置 =====================
 EMBEDDING_MAX_LENGTH = int(os.getenv('EMBEDDING_MAX_LENGTH', 512))    # 向量化模型最大输入长度
@@ -52,13 +82,50 @@ RERANK_MAX_LENGTH = int(os.getenv('RERANK_MAX_LENGTH', 512))          # 重排
 LLM_INPUT_MAX_LENGTH = int(os.getenv('LLM_INPUT_MAX_LENGTH', 1024))   # LLM输入最大长度
 LLM_OUTPUT_MAX_LENGTH = int(os.getenv('LLM_OUTPUT_MAX_LENGTH', 2048)) # LLM输出最大长度
 LLM_TEMPERATURE = float(os.getenv('LLM_TEMPERATURE', 0.7))            # LLM生成温度
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 32))     # 向量化批量大小
+RERANK_BATCH_SIZE = int(os.getenv('RERANK_BATCH_SIZE', 16))           # 重排序微批大小
+LLM_SCHEDULER_ENABLED = os.getenv('LLM_SCHEDULER_ENABLED', 'false').lower() == 'true'  # 是否启用LLM连续批处理
+LLM_MAX_BATCH_SIZE = int(os.getenv('LLM_MAX_BATCH_SIZE', 8))          # 连续批处理最大并发序列数
+LLM_PREFIX_CACHE_ENABLED = os.getenv('LLM_PREFIX_CACHE_ENABLED', 'true').lower() == 'true'  # 是否复用固定指令前缀的KV缓存
+LLM_PROMPT_LOOKUP_ENABLED = os.getenv('LLM_PROMPT_LOOKUP_ENABLED', 'false').lower() == 'true'  # 是否启用Prompt Lookup辅助解码
+LLM_PROMPT_LOOKUP_NUM_TOKENS = int(os.getenv('LLM_PROMPT_LOOKUP_NUM_TOKENS', 10))  # 每步最多草稿token数
+LLM_PROMPT_LOOKUP_MAX_NGRAM = int(os.getenv('LLM_PROMPT_LOOKUP_MAX_NGRAM', 3))     # 草稿匹配的最大n-gram长度
+
+# ===================== 并发配置 =====================
+# 各阶段专用线程池的线程数，即该阶段的最大并发；启用连续批处理时生成阶段默认与批次上限一致
+EMBEDDING_WORKERS = int(os.getenv('EMBEDDING_WORKERS', 2))            # 向量化并发数
+DB_WORKERS = int(os.getenv('DB_WORKERS', 8))                          # 数据库查询并发数
+RERANK_WORKERS = int(os.getenv('RERANK_WORKERS', 1))                  # 重排序并发数
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', LLM_MAX_BATCH_SIZE if LLM_SCHEDULER_ENABLED else 1))  # LLM生成并发数
+
+# ===================== 缓存配置 =====================
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'  # 是否启用持久化向量缓存
+EMBEDDING_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', './cache/embeddings')            # 向量缓存目录
+EMBEDDING_CACHE_MAX_MB = int(os.getenv('EMBEDDING_CACHE_MAX_MB', 2048))                 # 向量缓存磁盘上限(MB)
+QUERY_CACHE_ENABLED = os.getenv('QUERY_CACHE_ENABLED', 'true').lower() == 'true'          # 是否启用问题向量缓存
+QUERY_CACHE_MAX_SIZE = int(os.getenv('QUERY_CACHE_MAX_SIZE', 1024))                      # 问题向量缓存最大条数
+QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', 3600))                                # 问题向量缓存过期时间(秒)
+QUERY_CACHE_BACKEND = os.getenv('QUERY_CACHE_BACKEND', 'memory')                         # 缓存后端：memory(进程内), sqlite(多进程共享)
+QUERY_CACHE_SQLITE_PATH = os.getenv('QUERY_CACHE_SQLITE_PATH', './cache/query_cache.db') # sqlite共享缓存文件路径
+TOKEN_STORE_ENABLED = os.getenv('TOKEN_STORE_ENABLED', 'true').lower() == 'true'          # 是否预存分块token ID
+TOKEN_STORE_DIR = os.getenv('TOKEN_STORE_DIR', './cache/tokens')                         # 分块token ID存储目录
 
 # ===================== API配置 =====================
 QUESTION_MAX_LENGTH = int(os.getenv('QUESTION_MAX_LENGTH', 1000))     # 用户问题最大长度
 DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 100))          # 默认分页大小
 SEARCH_DEFAULT_LIMIT = int(os.getenv('SEARCH_DEFAULT_LIMIT', 20))     # 搜索默认限制
 CHUNKS_PAGE_SIZE = int(os.getenv('CHUNKS_PAGE_SIZE', 50))             # 文档分块分页大小
+MAX_PAGE_OFFSET = int(os.getenv('MAX_PAGE_OFFSET', 1000))             # 列表接口skip上限，更深的分页使用游标
+STATS_MODE = os.getenv('STATS_MODE', 'counter')                       # 统计来源：counter(增量计数), approximate(文档数取计数，分块数取pg_class估算)
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', 5))              # 统计信息缓存时间(秒)
 BATCH_COMMIT_SIZE = int(os.getenv('BATCH_COMMIT_SIZE', 10))           # 批量提交大小
+COPY_BATCH_BYTES = int(os.getenv('COPY_BATCH_BYTES', 32 * 1024 * 1024))  # 导入时单次COPY写入的最大字节数
+VERSION_GC_BATCH_SIZE = int(os.getenv('VERSION_GC_BATCH_SIZE', 1000))  # 回收旧版本文档时每批删除的分块数
+VERSION_GC_PAUSE = float(os.getenv('VERSION_GC_PAUSE', 0.1))          # 回收旧版本时批次间暂停秒数
+QA_BATCH_SYNC_MAX = int(os.getenv('QA_BATCH_SYNC_MAX', 32))           # 同步批量问答最多问题数，更多时走异步任务
+QA_BATCH_JOB_MAX = int(os.getenv('QA_BATCH_JOB_MAX', 1000))           # 异步批量问答任务最多问题数
+QA_BATCH_CHUNK_SIZE = int(os.getenv('QA_BATCH_CHUNK_SIZE', 32))       # 批量问答流水线每轮处理的问题数
+QA_BATCH_JOB_RETAIN = int(os.getenv('QA_BATCH_JOB_RETAIN', 100))      # 数据库中保留的批量任务数
 
 # ===================== 系统配置 =====================
 LOG_FILE_NAME = os.getenv('LOG_FILE_NAME', 'rag_app.log')            # 日志文件名
@@ -1,54 +1,706 @@
 import logging
+import os
+import re
+import threading
+import time
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, OperationalError, TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
-from config import PG_URL
-from models import Base
+from config import (
+    PG_URL, PG_ASYNC_URL, DB_ASYNC_ENABLED, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_STATEMENT_CACHE_SIZE,
+    PG_REPLICA_URLS, DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL,
+    HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_BUILD_MAINTENANCE_WORK_MEM, HNSW_BUILD_PARALLEL_WORKERS,
+    VECTOR_STORAGE_MODE, VERSION_GC_BATCH_SIZE, VERSION_GC_PAUSE
+)
+from executors import run_in_stage
+from models import Base, EMBEDDING_DIM, DEFAULT_COLLECTION, chunk_id_seq
 
 logger = logging.getLogger(__name__)
 
-# 创建引擎时添加编码参数
-engine = create_engine(
-    PG_URL, 
-    echo=False, 
-    pool_pre_ping=True,
-    connect_args={
-        "client_encoding": "utf8",
-        "options": "-c client_encoding=utf8"
-    }
+
+class PoolMetrics:
+    """连接池取连接的等待统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def begin(self):
+        with self._lock:
+            self.waiting += 1
+
+    def end(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            self.waiting -= 1
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "waiting": self.waiting,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 2) if self.checkouts else 0,
+                "max_wait_ms": round(self.max_wait * 1000, 2)
+            }
+
+
+def _timed_pool(pool_class, metrics: PoolMetrics):
+    """为连接池类加上取连接耗时统计（包含排队等待和新建连接的时间）"""
+    class TimedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            metrics.begin()
+            try:
+                connection = super()._do_get()
+            except PoolTimeoutError:
+                metrics.end(time.perf_counter() - start, timed_out=True)
+                raise
+            except Exception:
+                metrics.end(time.perf_counter() - start)
+                raise
+            metrics.end(time.perf_counter() - start)
+            return connection
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+
+_pool_args = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True
 )
+
+def _create_sync_engine(url: str, metrics: PoolMetrics):
+    return create_engine(
+        url,
+        echo=False,
+        poolclass=_timed_pool(QueuePool, metrics),
+        connect_args={
+            "client_encoding": "utf8",
+            "options": "-c client_encoding=utf8"
+        },
+        **_pool_args
+    )
+
+def _create_async_session_factory(url: str, metrics: PoolMetrics):
+    """创建asyncpg异步引擎及会话工厂，返回 (引擎, 会话工厂)"""
+    from pgvector.asyncpg import register_vector
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    async_engine = create_async_engine(
+        url,
+        echo=False,
+        poolclass=_timed_pool(AsyncAdaptedQueuePool, metrics),
+        connect_args={
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE
+        },
+        **_pool_args
+    )
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _register_vector(dbapi_connection, connection_record):
+        dbapi_connection.run_async(register_vector)
+
+    return async_engine, async_sessionmaker(async_engine, autocommit=False, autoflush=False, expire_on_commit=False)
+
+# 同步引擎：后台导入任务以及未启用异步引擎时的接口使用
+sync_pool_metrics = PoolMetrics()
+engine = _create_sync_engine(PG_URL, sync_pool_metrics)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步引擎：首次使用时创建
+async_pool_metrics = PoolMetrics()
+_async_engine = None
+_async_session_factory = None
+_async_lock = threading.Lock()
+
+def get_async_session_factory():
+    """获取asyncpg异步会话工厂"""
+    global _async_engine, _async_session_factory
+    with _async_lock:
+        if _async_session_factory is None:
+            _async_engine, _async_session_factory = _create_async_session_factory(PG_ASYNC_URL, async_pool_metrics)
+            logger.info(f"异步数据库引擎已创建，连接池: {DB_POOL_SIZE}+{DB_MAX_OVERFLOW}")
+        return _async_session_factory
+
+
+# 副本复制延迟：WAL已全部回放时为0，否则为距最后一次回放事务的秒数；在主库上执行时为0
+_REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+class Replica:
+    """一个只读副本：独立的同步/异步连接池，以及后台检查得到的可用状态和复制延迟"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.metrics = PoolMetrics()
+        self.engine = _create_sync_engine(url, self.metrics)
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.async_metrics = PoolMetrics()
+        self._async_engine = None
+        self._async_session_factory = None
+        self._async_lock = threading.Lock()
+        # 首次检查通过前不使用，读请求走主库
+        self.healthy = False
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+
+    def get_async_session_factory(self):
+        with self._async_lock:
+            if self._async_session_factory is None:
+                async_url = make_url(self.url).set(drivername='postgresql+asyncpg', query={})
+                self._async_engine, self._async_session_factory = _create_async_session_factory(
+                    async_url.render_as_string(hide_password=False), self.async_metrics
+                )
+            return self._async_session_factory
+
+    def check(self):
+        """查询复制延迟，连接失败或延迟超过 DB_REPLICA_MAX_LAG 时标记为不可用"""
+        try:
+            with self.engine.connect() as conn:
+                self.lag = float(conn.execute(text(_REPLICA_LAG_SQL)).scalar())
+            self.error = None
+            healthy = self.lag <= DB_REPLICA_MAX_LAG
+        except Exception as e:
+            self.lag = None
+            self.error = str(e)
+            healthy = False
+        if healthy != self.healthy:
+            if healthy:
+                logger.info(f"只读副本 {self.name} 恢复可用 (延迟 {self.lag:.1f}秒)")
+            else:
+                logger.warning(f"只读副本 {self.name} 不可用，读请求回落主库: "
+                               f"{self.error or f'延迟 {self.lag:.1f}秒 > {DB_REPLICA_MAX_LAG}秒'}")
+        self.healthy = healthy
+        self.checked_at = time.time()
+
+    def mark_down(self, error: Exception):
+        """查询时连接出错，在下次检查前不再路由到该副本"""
+        if self.healthy:
+            logger.warning(f"只读副本 {self.name} 查询失败，读请求回落主库: {error}")
+        self.healthy = False
+        self.error = str(error)
+
+    def status(self) -> dict:
+        return {
+            "url": self.name,
+            "healthy": self.healthy,
+            "lag_seconds": round(self.lag, 3) if self.lag is not None else None,
+            "error": self.error,
+            "checked_at": self.checked_at,
+            "sync": _pool_status(self.engine.pool, self.metrics),
+            "async": _pool_status(self._async_engine.pool, self.async_metrics) if self._async_engine else None
+        }
+
+    async def dispose(self):
+        if self._async_engine is not None:
+            await self._async_engine.dispose()
+        self.engine.dispose()
+
+
+replicas = [Replica(url) for url in PG_REPLICA_URLS]
+_replica_cursor = 0
+_replica_lock = threading.Lock()
+_replica_checker_pid = None
+
+def _check_replicas():
+    while True:
+        for replica in replicas:
+            replica.check()
+        time.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+def _ensure_replica_checker():
+    """每个进程首次使用副本时启动后台检查线程（线程不会随fork复制到worker进程）"""
+    global _replica_checker_pid
+    if _replica_checker_pid == os.getpid():
+        return
+    with _replica_lock:
+        if _replica_checker_pid != os.getpid():
+            _replica_checker_pid = os.getpid()
+            threading.Thread(target=_check_replicas, name="replica-check", daemon=True).start()
+
+def pick_replica():
+    """在可用副本间轮询选择一个，没有配置或全部不可用时返回None"""
+    global _replica_cursor
+    if not replicas:
+        return None
+    _ensure_replica_checker()
+    with _replica_lock:
+        for _ in range(len(replicas)):
+            replica = replicas[_replica_cursor % len(replicas)]
+            _replica_cursor += 1
+            if replica.healthy:
+                return replica
+    return None
+
+def _run_with_session(session_factory, func, *args, **kwargs):
+    session = session_factory()
+    try:
+        return func(session, *args, **kwargs)
+    finally:
+        session.close()
+
+async def run_in_session(func, *args, **kwargs):
+    """执行一次数据库操作，func的第一个参数为同步Session
+    
+    启用异步引擎时通过AsyncSession.run_sync在asyncpg连接上执行，不占用线程；
+    否则在db线程池中使用同步会话执行。会话在调用结束后关闭，提交与回滚由func自行负责。
+    """
+    if DB_ASYNC_ENABLED:
+        async with get_async_session_factory()() as session:
+            return await session.run_sync(func, *args, **kwargs)
+    return await run_in_stage('db', _run_with_session, SessionLocal, func, *args, **kwargs)
+
+async def run_in_replica(func, *args, **kwargs):
+    """在只读副本上执行一次只读操作，用法同 run_in_session
+    
+    在复制延迟不超过 DB_REPLICA_MAX_LAG 的副本间轮询；未配置副本、全部不可用或副本连接出错时在主库执行。
+    func 不应把数据库异常转换为HTTPException，否则副本故障无法被识别，异常处理放在调用方。
+    """
+    replica = pick_replica()
+    if replica is None:
+        return await run_in_session(func, *args, **kwargs)
+    try:
+        if DB_ASYNC_ENABLED:
+            async with replica.get_async_session_factory()() as session:
+                return await session.run_sync(func, *args, **kwargs)
+        return await run_in_stage('db', _run_with_session, replica.session_factory, func, *args, **kwargs)
+    except DBAPIError as e:
+        # 连接断开、副本重启或回放冲突取消查询时回落主库；SQL本身的错误在主库上同样会失败，直接抛出
+        if not (isinstance(e, OperationalError) or e.connection_invalidated):
+            raise
+        replica.mark_down(e)
+        return await run_in_session(func, *args, **kwargs)
+
+def _pool_status(pool, metrics: PoolMetrics) -> dict:
+    return {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": pool.overflow(),
+        **metrics.stats()
+    }
+
+def pool_stats() -> dict:
+    """同步/异步连接池的占用情况与取连接等待统计，以及各只读副本的状态"""
+    return {
+        "sync": _pool_status(engine.pool, sync_pool_metrics),
+        "async": _pool_status(_async_engine.pool, async_pool_metrics) if _async_engine else None,
+        "replicas": [replica.status() for replica in replicas],
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT
+    }
+
+async def dispose_engines():
+    """释放所有连接池中的连接"""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    engine.dispose()
+    for replica in replicas:
+        await replica.dispose()
+
+# 各存储模式的向量索引：(索引名, 索引表达式及操作符类)，每个集合分区上单独建索引，索引名加集合ID后缀
+# halfvec/binary 模式只为量化后的表达式建索引，全精度向量仍保存在表中用于重打分
+VECTOR_INDEXES = {
+    'full': ('idx_embedding_cosine', 'embedding vector_cosine_ops'),
+    'halfvec': ('idx_embedding_halfvec', f'(embedding::halfvec({EMBEDDING_DIM})) halfvec_cosine_ops'),
+    'binary': ('idx_embedding_bit', f'(binary_quantize(embedding)::bit({EMBEDDING_DIM})) bit_hamming_ops'),
+}
+
+# 子串搜索使用的trigram索引：(索引名, 列)，同样按分区创建
+TRIGRAM_INDEXES = [
+    ('idx_content_trgm', 'content'),
+]
+# 已不再使用的分块trigram索引：文档名搜索改查 documents 清单表，分区上的索引只会拖慢写入
+_DROPPED_TRIGRAM_INDEXES = ['idx_document_name_trgm']
+
+_COLLECTION_ID_PATTERN = re.compile(r'^[a-z][a-z0-9_]{0,31}$')
+
+def validate_collection_id(collection_id: str) -> str:
+    """集合ID会拼进分区表名和索引名，只允许小写字母开头的小写字母、数字和下划线"""
+    if not isinstance(collection_id, str) or not _COLLECTION_ID_PATTERN.match(collection_id):
+        raise ValueError(f"无效的集合ID: {collection_id}")
+    return collection_id
+
+def partition_name(collection_id: str) -> str:
+    return f"documents_chunk_{validate_collection_id(collection_id)}"
+
+def vector_index_name(collection_id: str, mode: str = VECTOR_STORAGE_MODE) -> str:
+    return f"{VECTOR_INDEXES[mode][0]}_{validate_collection_id(collection_id)}"
+
+def vector_index_ddl(collection_id: str, mode: str = VECTOR_STORAGE_MODE) -> str:
+    _, expression = VECTOR_INDEXES[mode]
+    return f"""
+        CREATE INDEX IF NOT EXISTS {vector_index_name(collection_id, mode)}
+        ON {partition_name(collection_id)}
+        USING hnsw ({expression})
+        WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})
+    """
+
+def list_collections(conn=None) -> list:
+    """返回所有集合ID"""
+    if conn is None:
+        with engine.connect() as conn:
+            return list_collections(conn)
+    return [row[0] for row in conn.execute(text("SELECT collection_id FROM collections ORDER BY collection_id"))]
+
+def create_collection(collection_id: str, description: str = None) -> bool:
+    """创建集合及其分区、向量索引和trigram索引，集合已存在时返回False
+    
+    新分区为空表，建索引无需并发方式；之后写入该集合只维护该分区自己的HNSW图。
+    """
+    partition = partition_name(collection_id)
+    with engine.connect() as conn:
+        created = conn.execute(text("""
+            INSERT INTO collections (collection_id, description, created_at)
+            VALUES (:id, :description, now())
+            ON CONFLICT (collection_id) DO NOTHING
+        """), {"id": collection_id, "description": description}).rowcount
+        if conn.execute(text("SELECT to_regclass(:name)"), {"name": partition}).scalar() is None:
+            conn.execute(text(f"""
+                CREATE TABLE {partition}
+                PARTITION OF documents_chunk FOR VALUES IN ('{collection_id}')
+            """))
+            conn.execute(text(vector_index_ddl(collection_id)))
+            for index_name, column in TRIGRAM_INDEXES:
+                conn.execute(text(f"""
+                    CREATE INDEX {index_name}_{collection_id}
+                    ON {partition}
+                    USING gin ({column} gin_trgm_ops)
+                """))
+        conn.commit()
+    if created:
+        logger.info(f"已创建集合 {collection_id} (分区 {partition})")
+    return bool(created)
+
+def drop_collection(collection_id: str) -> bool:
+    """删除集合：直接删除其分区表，与数据量无关；同时删除该集合的文档清单"""
+    partition = partition_name(collection_id)
+    with engine.connect() as conn:
+        deleted = conn.execute(
+            text("DELETE FROM collections WHERE collection_id = :id"), {"id": collection_id}
+        ).rowcount
+        conn.execute(text(f"DROP TABLE IF EXISTS {partition}"))
+        conn.execute(text("DELETE FROM documents WHERE collection_id = :id"), {"id": collection_id})
+        conn.commit()
+    if deleted:
+        logger.info(f"已删除集合 {collection_id} (分区 {partition})")
+    return bool(deleted)
+
+def _detach_legacy_chunk_table(conn) -> bool:
+    """早于集合功能创建的普通分块表改名为默认集合的分区，等待分区父表创建后挂载
+    
+    现有索引加集合ID后缀改名，挂载时与父表定义相同的索引直接复用；主键改为 (collection_id, id)，挂载时重建。
+    """
+    kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('documents_chunk')")).scalar()
+    if kind != 'r':
+        return False
+    legacy = partition_name(DEFAULT_COLLECTION)
+    logger.info(f"正在将分块表迁移为按集合分区的表，现有数据归入默认集合 {DEFAULT_COLLECTION}...")
+    conn.execute(text(f"ALTER TABLE documents_chunk RENAME TO {legacy}"))
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": legacy}).scalar()
+    if sequence:
+        # 序列改由分区父表共用，删除默认集合时不能随分区一起删除
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+        if sequence.split('.')[-1] != chunk_id_seq.name:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO {chunk_id_seq.name}"))
+    for (index_name,) in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), {"table": legacy}).fetchall():
+        if index_name == 'documents_chunk_pkey':
+            conn.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT documents_chunk_pkey"))
+        else:
+            conn.execute(text(f"ALTER INDEX {index_name} RENAME TO {index_name}_{DEFAULT_COLLECTION}"))
+    conn.execute(text(f"ALTER TABLE {legacy} ADD COLUMN IF NOT EXISTS content_tsv tsvector"))
+    conn.execute(text(f"ALTER TABLE {legacy} ADD COLUMN collection_id varchar NOT NULL DEFAULT '{DEFAULT_COLLECTION}'"))
+    return True
+
+def _migrate_documents_manifest(conn):
+    """早于集合功能创建的文档清单表补充collection_id列并改为 (collection_id, document_id) 主键"""
+    columns = conn.execute(text("""
+        SELECT count(*) FROM information_schema.key_column_usage
+        WHERE table_name = 'documents' AND constraint_name = 'documents_pkey'
+    """)).scalar()
+    if columns != 1:
+        return
+    conn.execute(text(f"ALTER TABLE documents ADD COLUMN IF NOT EXISTS collection_id varchar NOT NULL DEFAULT '{DEFAULT_COLLECTION}'"))
+    conn.execute(text("ALTER TABLE documents DROP CONSTRAINT documents_pkey"))
+    conn.execute(text("ALTER TABLE documents ADD PRIMARY KEY (collection_id, document_id)"))
+
 def init_db():
     """初始化数据库，创建表和索引"""
     try:
-        # 创建pgvector扩展
+        # 创建pgvector和pg_trgm扩展，并把旧版普通分块表改名待挂载
         with engine.connect() as conn:
             conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            legacy = _detach_legacy_chunk_table(conn)
             conn.commit()
         
-        # 创建表
+        # 创建表（documents_chunk 为按 collection_id 列表分区的父表）
         Base.metadata.create_all(bind=engine)
         
-        # 创建向量索引
         with engine.connect() as conn:
-            # 检查索引是否存在
-            result = conn.execute(text("""
-                SELECT indexname FROM pg_indexes 
-                WHERE tablename = 'documents_chunk' 
-                AND indexname = 'idx_embedding_cosine'
+            _migrate_documents_manifest(conn)
+            # 清单表早于版本切换功能创建时补建待回收文档的部分索引
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_documents_retired ON documents (collection_id, document_id)
+                WHERE status = 'retired'
             """))
-            
-            if not result.fetchone():
-                conn.execute(text("""
-                    CREATE INDEX idx_embedding_cosine 
-                    ON documents_chunk 
-                    USING hnsw (embedding vector_cosine_ops)
+            # 键集分页索引改为 (created_at, document_id)：旧版单列索引同名无法被 create_all 更新，换名重建
+            conn.execute(text("DROP INDEX IF EXISTS idx_documents_created_at"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_documents_created_document ON documents (created_at, document_id)"))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_documents_name_trgm ON documents
+                USING gin (document_name gin_trgm_ops)
+            """))
+            if legacy:
+                # 挂载时为旧表建立新主键（及旧表缺少的父表索引），数据量大时耗时较长，只在迁移时执行一次
+                conn.execute(text(f"""
+                    ALTER TABLE documents_chunk ATTACH PARTITION {partition_name(DEFAULT_COLLECTION)}
+                    FOR VALUES IN ('{DEFAULT_COLLECTION}')
                 """))
-                logger.info("创建向量索引成功")
+                conn.execute(text(f"SELECT setval('{chunk_id_seq.name}', greatest((SELECT max(id) FROM documents_chunk), 1))"))
+                logger.info("分块表迁移为分区表完成")
+            conn.commit()
+        
+        # 默认集合及各集合分区的向量索引（切换存储模式或删除索引后补建）
+        create_collection(DEFAULT_COLLECTION)
+        with engine.connect() as conn:
+            for collection_id in list_collections(conn):
+                index_name = vector_index_name(collection_id)
+                exists = conn.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = :name"), {"name": index_name}).fetchone()
+                if not exists:
+                    conn.execute(text(vector_index_ddl(collection_id)))
+                    logger.info(f"创建向量索引成功 ({index_name})")
             conn.commit()
+        
+        _create_trigram_indexes()
+        backfill_documents()
+        _create_stats_counter()
             
     except Exception as e:
         logger.error(f"初始化数据库失败: {e}")
-        raise 
\ No newline at end of file
+        raise 
+
+def _collection_targets(collection_id: str = None) -> list:
+    return [collection_id] if collection_id else list_collections()
+
+def drop_vector_index(collection_id: str = DEFAULT_COLLECTION):
+    """删除一个集合的向量索引，大批量导入前调用，避免每行写入都维护HNSW图；其他集合的索引不受影响"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP INDEX IF EXISTS {vector_index_name(collection_id)}"))
+    logger.info(f"已删除集合 {collection_id} 的向量索引，导入完成后重建")
+
+def rebuild_vector_index(collection_id: str = None):
+    """按当前存储模式和HNSW参数重建向量索引，使用更大的maintenance_work_mem和并行构建
+    
+    collection_id 为空时逐个重建所有集合分区的索引。其他存储模式的向量索引一并删除，
+    切换到量化模式后全精度HNSW索引不再占用内存。
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT set_config('maintenance_work_mem', :mem, false)"),
+                     {"mem": HNSW_BUILD_MAINTENANCE_WORK_MEM})
+        conn.execute(text("SELECT set_config('max_parallel_maintenance_workers', :workers, false)"),
+                     {"workers": str(HNSW_BUILD_PARALLEL_WORKERS)})
+        try:
+            for target in _collection_targets(collection_id):
+                start = time.perf_counter()
+                for mode in VECTOR_INDEXES:
+                    conn.execute(text(f"DROP INDEX IF EXISTS {vector_index_name(target, mode)}"))
+                conn.execute(text(vector_index_ddl(target)))
+                logger.info(f"向量索引 {vector_index_name(target)} 重建完成 (m={HNSW_M}, ef_construction={HNSW_EF_CONSTRUCTION})，"
+                            f"耗时 {time.perf_counter() - start:.1f}秒")
+        finally:
+            # 会话级参数会随连接回到连接池，恢复默认值
+            conn.execute(text("RESET maintenance_work_mem"))
+            conn.execute(text("RESET max_parallel_maintenance_workers"))
+
+def prewarm_vector_index():
+    """用pg_prewarm将各集合的向量索引读入shared_buffers，首次查询不必从磁盘加载"""
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_prewarm"))
+            blocks = sum(
+                conn.execute(text("SELECT pg_prewarm(:name)"), {"name": vector_index_name(collection_id)}).scalar()
+                for collection_id in list_collections(conn)
+            )
+        logger.info(f"向量索引预热完成，共 {blocks} 个数据块")
+    except Exception as e:
+        logger.warning(f"向量索引预热失败: {e}")
+
+def _create_trigram_indexes():
+    """为各集合分区并发创建pg_trgm GIN索引，建索引期间不阻塞分块表的读写
+    
+    分区父表不支持 CREATE INDEX CONCURRENTLY，因此逐个分区创建；并发建索引不能在事务中执行，
+    使用自动提交连接；上次并发创建中断留下的无效索引先删除再重建。
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for collection_id in list_collections(conn):
+            for base_name in _DROPPED_TRIGRAM_INDEXES:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {base_name}_{collection_id}"))
+            for base_name, column in TRIGRAM_INDEXES:
+                index_name = f"{base_name}_{collection_id}"
+                valid = conn.execute(text("""
+                    SELECT i.indisvalid FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE c.relname = :name
+                """), {"name": index_name}).scalar()
+                if valid:
+                    continue
+                if valid is False:
+                    logger.warning(f"索引 {index_name} 上次创建未完成，正在重建")
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+                logger.info(f"正在并发创建trigram索引 {index_name}...")
+                conn.execute(text(f"""
+                    CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name}
+                    ON {partition_name(collection_id)}
+                    USING gin ({column} gin_trgm_ops)
+                """))
+                logger.info(f"创建trigram索引 {index_name} 成功")
+
+def backfill_documents() -> int:
+    """文档清单表为空而分块表有数据时（清单表上线前导入的数据），按分块聚合生成清单"""
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT EXISTS (SELECT 1 FROM documents)")).scalar():
+            return 0
+        result = conn.execute(text("""
+            INSERT INTO documents (collection_id, document_id, document_name, document_path, chunk_count, status, version, created_at, updated_at)
+            SELECT collection_id, document_id, min(document_name), min(document_path), count(*), 'ready', max(version), min(created_at), now()
+            FROM documents_chunk
+            GROUP BY collection_id, document_id
+            ON CONFLICT (collection_id, document_id) DO NOTHING
+        """))
+        conn.commit()
+    if result.rowcount:
+        logger.info(f"已根据历史分块生成 {result.rowcount} 条文档清单记录")
+    return result.rowcount
+
+# documents 行的增删改（仅status为ready的文档计入）同步增减 corpus_stats 计数
+_STATS_TRIGGER_DDL = """
+CREATE OR REPLACE FUNCTION documents_stats_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'ready' THEN
+        UPDATE corpus_stats SET total_documents = total_documents - 1,
+                                total_chunks = total_chunks - OLD.chunk_count, updated_at = now()
+        WHERE id = 1;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'ready' THEN
+        UPDATE corpus_stats SET total_documents = total_documents + 1,
+                                total_chunks = total_chunks + NEW.chunk_count, updated_at = now()
+        WHERE id = 1;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+def _create_stats_counter():
+    """创建计数触发器，首次创建时按文档清单初始化计数"""
+    with engine.connect() as conn:
+        conn.execute(text(_STATS_TRIGGER_DDL))
+        conn.execute(text("DROP TRIGGER IF EXISTS trg_documents_stats ON documents"))
+        conn.execute(text("""
+            CREATE TRIGGER trg_documents_stats
+            AFTER INSERT OR DELETE OR UPDATE OF chunk_count, status ON documents
+            FOR EACH ROW EXECUTE FUNCTION documents_stats_trigger()
+        """))
+        conn.execute(text("""
+            INSERT INTO corpus_stats (id, total_documents, total_chunks, updated_at)
+            SELECT 1, count(*), coalesce(sum(chunk_count), 0), now() FROM documents WHERE status = 'ready'
+            ON CONFLICT (id) DO NOTHING
+        """))
+        conn.commit()
+
+def backfill_lexical_index(batch_size: int = 500) -> int:
+    """为缺少全文检索列的历史分块补全content_tsv，返回处理的分块数"""
+    from lexical import lexical_text
+    total = 0
+    with engine.connect() as conn:
+        while True:
+            rows = conn.execute(text("""
+                SELECT collection_id, id, content FROM documents_chunk
+                WHERE content_tsv IS NULL
+                LIMIT :limit
+            """), {"limit": batch_size}).fetchall()
+            if not rows:
+                break
+            conn.execute(
+                text("""
+                    UPDATE documents_chunk SET content_tsv = to_tsvector('simple', :terms)
+                    WHERE collection_id = :collection_id AND id = :id
+                """),
+                [{"collection_id": row.collection_id, "id": row.id, "terms": lexical_text(row.content)} for row in rows]
+            )
+            conn.commit()
+            total += len(rows)
+            logger.info(f"已补全 {total} 个分块的全文检索列")
+    return total
+
+_version_gc_lock = threading.Lock()
+
+def collect_retired_versions(batch_size: int = VERSION_GC_BATCH_SIZE, pause: float = VERSION_GC_PAUSE) -> int:
+    """回收同步时被新版本替换的旧版本分块，返回删除的分块数
+    
+    旧版本在切换时只标记为retired，检索已将其排除；这里每个事务最多删除 batch_size 个分块，
+    批次间暂停 pause 秒，大规模重新同步也不会长时间持有锁或阻塞检索。分块删完后再删除清单记录。
+    同一进程内已有回收在进行时直接返回。
+    """
+    if not _version_gc_lock.acquire(blocking=False):
+        return 0
+    total = 0
+    try:
+        with engine.connect() as conn:
+            retired = conn.execute(text(
+                "SELECT collection_id, document_id FROM documents WHERE status = 'retired'"
+            )).fetchall()
+            conn.commit()
+            for collection_id, document_id in retired:
+                params = {"collection_id": collection_id, "document_id": document_id, "limit": batch_size}
+                while True:
+                    deleted = conn.execute(text("""
+                        DELETE FROM documents_chunk
+                        WHERE collection_id = :collection_id AND id IN (
+                            SELECT id FROM documents_chunk
+                            WHERE collection_id = :collection_id AND document_id = :document_id
+                            LIMIT :limit
+                        )
+                    """), params).rowcount
+                    conn.commit()
+                    total += deleted
+                    if deleted < batch_size:
+                        break
+                    time.sleep(pause)
+                conn.execute(text("""
+                    DELETE FROM documents
+                    WHERE collection_id = :collection_id AND document_id = :document_id AND status = 'retired'
+                """), params)
+                conn.commit()
+        if retired:
+            logger.info(f"已回收 {len(retired)} 个旧版本文档，共删除 {total} 个分块")
+    finally:
+        _version_gc_lock.release()
+    return total
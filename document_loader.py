@@ -88,6 +88,15 @@ def generate_document_id(file_path: str) -> str:
     content = f"{file_path}_{stat.st_mtime}_{stat.st_size}"
     return hashlib.md5(content.encode()).hexdigest()
 
+def file_fingerprint(file_path: str) -> Dict[str, Any]:
+    """文件清单信息：内容SHA-256、大小和修改时间"""
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return {"content_hash": digest.hexdigest(), "file_size": stat.st_size, "mtime": stat.st_mtime}
+
 def create_chunks_with_metadata(text: str, file_path: str, page_paragraphs: List[Dict] = None) -> List[Dict[str, Any]]:
     """创建带有页码和段落号的分块"""
     if not text.strip():
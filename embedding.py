@@ -1,15 +1,21 @@
+import numpy as np
 import torch
 from transformers import AutoTokenizer, AutoModel
 
-from config import EMBEDDING_MODEL, DEVICE, MODEL_CACHE_DIR, EMBEDDING_MAX_LENGTH, HF_ENDPOINT
+from config import (
+    EMBEDDING_MODEL, DEVICE, MODEL_CACHE_DIR, EMBEDDING_MAX_LENGTH, HF_ENDPOINT, EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_MB,
+    QUERY_CACHE_ENABLED, QUERY_CACHE_MAX_SIZE, QUERY_CACHE_TTL, QUERY_CACHE_BACKEND, QUERY_CACHE_SQLITE_PATH
+)
 
 
 class EmbeddingModel:
     def __init__(self, model_name=None):
         if model_name is None:
             model_name = EMBEDDING_MODEL
+        self.model_name = model_name
         self.tokenizer = AutoTokenizer.from_pretrained(
-            model_name, 
+            model_name,
             cache_dir=MODEL_CACHE_DIR,
             mirror=HF_ENDPOINT if HF_ENDPOINT != 'https://huggingface.co' else None
         )
@@ -18,28 +24,70 @@ class EmbeddingModel:
         if DEVICE == "auto":
             from config import MAX_MEMORY_GB
             max_memory = {0: f"{MAX_MEMORY_GB}GB"} if torch.cuda.is_available() else None
-        
+
         self.model = AutoModel.from_pretrained(
-            model_name, 
-            torch_dtype=torch.float16, 
+            model_name,
+            torch_dtype=torch.float16,
             device_map=DEVICE if DEVICE != "auto" else "auto",
             max_memory=max_memory,
             cache_dir=MODEL_CACHE_DIR,
             mirror=HF_ENDPOINT if HF_ENDPOINT != 'https://huggingface.co' else None
         )
         self.model.eval()
-    
+        self.dimension = self.model.config.hidden_size
+
+    @staticmethod
+    def _mean_pool(last_hidden_state, attention_mask):
+        """按attention mask做平均池化，padding位置不参与计算"""
+        mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+        summed = (last_hidden_state * mask).sum(dim=1)
+        counts = mask.sum(dim=1).clamp(min=1)
+        return summed / counts
+
+    def tokenize(self, texts):
+        """分词并按最大长度截断，返回每条文本的token ID列表"""
+        return self.tokenizer(list(texts), truncation=True, max_length=EMBEDDING_MAX_LENGTH)['input_ids']
+
+    def get_embeddings(self, texts, batch_size=None, input_ids=None):
+        """批量获取文本向量，返回形状为 (len(texts), dim) 的连续float32数组
+
+        先按token长度排序再分桶，每个桶内只padding到桶内最长序列，减少无效计算。
+        input_ids 为预先分好的token ID时跳过分词。
+        """
+        if batch_size is None:
+            batch_size = EMBEDDING_BATCH_SIZE
+        texts = list(texts)
+        result = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if not texts:
+            return result
+
+        if input_ids is None:
+            input_ids = self.tokenize(texts)
+        input_ids = [np.asarray(ids).tolist() for ids in input_ids]
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            batch = self.tokenizer.pad(
+                {'input_ids': [input_ids[i] for i in bucket]},
+                padding=True,
+                return_tensors="pt"
+            ).to(self.model.device)
+            with torch.no_grad():
+                outputs = self.model(**batch)
+                pooled = self._mean_pool(outputs.last_hidden_state, batch['attention_mask'])
+            result[bucket] = pooled.float().cpu().numpy()
+
+        return np.ascontiguousarray(result)
+
     def get_embedding(self, text: str):
         """获取文本的向量表示"""
-        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=EMBEDDING_MAX_LENGTH)
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            # 使用CLS token的输出或者平均池化
-            embeddings = outputs.last_hidden_state.mean(dim=1)
-            return embeddings.cpu().numpy().flatten().tolist()
+        return self.get_embeddings([text], batch_size=1)[0].tolist()
 
 # 全局模型实例
 _embedding_model = None
+_embedding_cache = None
+_query_cache = None
 
 def get_embedding_model():
     global _embedding_model
@@ -47,7 +95,89 @@ def get_embedding_model():
         _embedding_model = EmbeddingModel()
     return _embedding_model
 
+def get_embedding_cache():
+    """获取持久化向量缓存，未启用时返回None"""
+    global _embedding_cache
+    if _embedding_cache is None and EMBEDDING_CACHE_ENABLED:
+        from embedding_cache import EmbeddingCache
+        _embedding_cache = EmbeddingCache(
+            EMBEDDING_CACHE_DIR,
+            EMBEDDING_MODEL,
+            EMBEDDING_MAX_LENGTH,
+            get_embedding_model().dimension,
+            EMBEDDING_CACHE_MAX_MB
+        )
+    return _embedding_cache
+
+def get_query_cache():
+    """获取问题向量缓存，未启用时返回None"""
+    global _query_cache
+    if _query_cache is None and QUERY_CACHE_ENABLED:
+        from query_cache import QueryEmbeddingCache
+        _query_cache = QueryEmbeddingCache(
+            max_size=QUERY_CACHE_MAX_SIZE,
+            ttl=QUERY_CACHE_TTL,
+            backend=QUERY_CACHE_BACKEND,
+            sqlite_path=QUERY_CACHE_SQLITE_PATH
+        )
+    return _query_cache
+
+def get_query_embedding(question: str):
+    """获取问题向量，重复或仅标点/空白不同的问题直接复用缓存结果"""
+    cache = get_query_cache()
+    if cache is None:
+        return get_embedding(question)
+    vector = cache.get(question)
+    if vector is None:
+        vector = get_embedding(question)
+        cache.put(question, vector)
+    return vector
+
+def get_query_embeddings(questions: list):
+    """批量获取问题向量，缓存未命中的问题合并为一次前向计算"""
+    cache = get_query_cache()
+    vectors = [cache.get(q) if cache else None for q in questions]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        embedded = get_embeddings([questions[i] for i in missing], use_token_store=False, use_cache=False)
+        for i, vector in zip(missing, embedded):
+            vectors[i] = vector.tolist()
+            if cache:
+                cache.put(questions[i], vectors[i])
+    return vectors
+
 def get_embedding(text: str):
-    """获取文本向量"""
+    """获取单条文本（问题）的向量，不读写分块向量缓存"""
+    return get_embeddings([text], batch_size=1, use_token_store=False, use_cache=False)[0].tolist()
+
+def get_embeddings(texts, batch_size=None, use_token_store=True, use_cache=True):
+    """批量获取文本向量，优先读取持久化缓存，只对未命中的文本做前向计算
+
+    use_token_store 和 use_cache 控制是否读写分块token存储和分块向量缓存，
+    问题文本等一次性输入应关闭，避免挤出分块的缓存条目（问题向量由查询缓存负责）。
+    """
     model = get_embedding_model()
-    return model.get_embedding(text) 
\ No newline at end of file
+    cache = get_embedding_cache() if use_cache else None
+    texts = list(texts)
+    if cache is None:
+        return _embed_uncached(model, texts, batch_size, use_token_store)
+
+    result = np.empty((len(texts), model.dimension), dtype=np.float32)
+    cached = cache.get_many(texts)
+    for i, vector in cached.items():
+        result[i] = vector
+
+    missing = [i for i in range(len(texts)) if i not in cached]
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        vectors = _embed_uncached(model, missing_texts, batch_size, use_token_store)
+        result[missing] = vectors
+        cache.put_many(missing_texts, vectors)
+    return result
+
+def _embed_uncached(model, texts, batch_size=None, use_token_store=True):
+    """对缓存未命中的文本做前向计算，分词结果优先从token存储读取"""
+    from token_store import get_token_store
+    store = get_token_store('embedding', model.model_name, EMBEDDING_MAX_LENGTH, model.tokenizer) if use_token_store else None
+    input_ids = store.lookup_or_tokenize(texts, model.tokenize) if store else None
+    return model.get_embeddings(texts, batch_size=batch_size, input_ids=input_ids)
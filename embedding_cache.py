@@ -0,0 +1,196 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows下只做进程内加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 32  # sha256摘要字节数
+FLUSH_INTERVAL = 5.0  # 两次msync之间的最短间隔(秒)，共享映射对其他进程立即可见，刷盘只为持久化
+
+
+class EmbeddingCache:
+    """基于内容寻址的持久化向量缓存
+
+    同一 (模型名, 最大输入长度) 共用一个缓存目录，目录内以分块文本的sha256摘要为键。
+    向量保存在内存映射文件中，键索引为定长摘要数组，容量由磁盘大小上限换算，
+    写满后按最近最少使用(LRU)批量淘汰。
+
+    多个进程（prefork worker、后台导入）共享同一组文件：读写都持有目录下的文件锁，
+    写入方递增 generation.bin 中的写入代数，其他进程发现代数变化后从映射文件重建键索引和空闲槽位，
+    命中时再核对槽位中的键，避免按过期索引读到其他文本的向量。
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, max_length: int, dimension: int, max_mb: int):
+        namespace = re.sub(r'[^0-9A-Za-z._-]', '_', f"{model_name}_{max_length}")
+        self.path = os.path.join(cache_dir, namespace)
+        self.dimension = dimension
+        self.capacity = max(1, max_mb * 1024 * 1024 // (dimension * 4 + KEY_SIZE + 8))
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._open()
+
+    def _open(self):
+        """打开（或新建）缓存文件并在内存中重建键索引"""
+        os.makedirs(self.path, exist_ok=True)
+        meta = {'dimension': self.dimension, 'capacity': self.capacity}
+        meta_path = os.path.join(self.path, 'meta.json')
+        files = {
+            'keys': os.path.join(self.path, 'keys.bin'),
+            'last_used': os.path.join(self.path, 'last_used.bin'),
+            'vectors': os.path.join(self.path, 'vectors.bin'),
+            'generation': os.path.join(self.path, 'generation.bin'),
+        }
+
+        with self._locked():
+            reuse = os.path.exists(meta_path) and all(os.path.exists(p) for p in files.values())
+            if reuse:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    if json.load(f) != meta:
+                        logger.warning(f"向量缓存配置已变化，重建缓存: {self.path}")
+                        reuse = False
+
+            mode = 'r+' if reuse else 'w+'
+            self._keys = np.memmap(files['keys'], dtype=np.uint8, mode=mode, shape=(self.capacity, KEY_SIZE))
+            self._last_used = np.memmap(files['last_used'], dtype=np.int64, mode=mode, shape=(self.capacity,))
+            self._vectors = np.memmap(files['vectors'], dtype=np.float32, mode=mode, shape=(self.capacity, self.dimension))
+            self._generation = np.memmap(files['generation'], dtype=np.int64, mode=mode, shape=(1,))
+            if not reuse:
+                self._generation[0] += 1
+                self._flush()
+                with open(meta_path, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f)
+            self._load_index()
+        logger.info(f"向量缓存已加载: {self.path}，{len(self._index)}/{self.capacity} 条")
+
+    @contextmanager
+    def _locked(self):
+        """进程内线程锁 + 缓存目录上的跨进程文件锁"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.path, 'lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        """从映射文件重建键索引、空闲槽位和时钟，需持有锁"""
+        # last_used为0表示空槽位
+        occupied = np.nonzero(self._last_used)[0]
+        self._index = {bytes(self._keys[slot]): int(slot) for slot in occupied}
+        self._free = np.nonzero(self._last_used == 0)[0][::-1].tolist()
+        self._clock = int(self._last_used.max()) if len(occupied) else 0
+        self._seen_generation = int(self._generation[0])
+
+    def _sync(self):
+        """其他进程写入过缓存时重新加载索引，需持有锁"""
+        if int(self._generation[0]) != self._seen_generation:
+            self._load_index()
+
+    def _slot(self, key: bytes):
+        """按索引查找槽位并核对槽位中的键，需持有锁"""
+        slot = self._index.get(key)
+        if slot is None:
+            return None
+        if self._last_used[slot] == 0 or bytes(self._keys[slot]) != key:
+            self._index.pop(key, None)
+            return None
+        return slot
+
+    @staticmethod
+    def make_key(text: str) -> bytes:
+        """计算分块文本的内容摘要"""
+        return hashlib.sha256(text.encode('utf-8')).digest()
+
+    def get_many(self, texts: list) -> dict:
+        """批量查询缓存，返回 {输入下标: 向量}"""
+        keys = [self.make_key(text) for text in texts]
+        found = {}
+        with self._locked():
+            self._sync()
+            for i, key in enumerate(keys):
+                slot = self._slot(key)
+                if slot is None:
+                    continue
+                self._clock += 1
+                self._last_used[slot] = self._clock
+                found[i] = np.array(self._vectors[slot])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, texts: list, vectors):
+        """批量写入缓存"""
+        keys = [self.make_key(text) for text in texts]
+        with self._locked():
+            self._sync()
+            for key, vector in zip(keys, vectors):
+                slot = self._slot(key)
+                if slot is None:
+                    slot = self._allocate()
+                    # 先作废槽位再改写键和向量，保证进程崩溃时不会留下半写的有效槽位
+                    self._last_used[slot] = 0
+                    self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                    self._index[key] = slot
+                self._vectors[slot] = vector
+                self._clock += 1
+                self._last_used[slot] = self._clock
+            self._generation[0] += 1
+            self._seen_generation = int(self._generation[0])
+            if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+                self._flush()
+
+    def _allocate(self) -> int:
+        if not self._free:
+            self._evict()
+        return self._free.pop()
+
+    def _evict(self):
+        """淘汰最久未使用的约10%槽位，摊薄每次淘汰的扫描开销"""
+        count = max(1, self.capacity // 10)
+        victims = np.argpartition(self._last_used, count - 1)[:count]
+        for slot in victims:
+            self._index.pop(bytes(self._keys[slot]), None)
+            self._last_used[slot] = 0
+            self._free.append(int(slot))
+        self.evictions += count
+
+    def _flush(self):
+        self._vectors.flush()
+        self._keys.flush()
+        self._last_used.flush()
+        self._generation.flush()
+        self._last_flush = time.monotonic()
+
+    def stats(self) -> dict:
+        """缓存命中统计（条目数为本进程最近一次同步时的值）"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": True,
+                "path": self.path,
+                "entries": len(self._index),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0,
+                "evictions": self.evictions
+            }
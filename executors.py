@@ -0,0 +1,108 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import EMBEDDING_WORKERS, DB_WORKERS, RERANK_WORKERS, GENERATION_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# 各阶段的线程数上限：模型推理阶段线程数即为该阶段的最大并发
+STAGE_WORKERS = {
+    'embedding': EMBEDDING_WORKERS,
+    'db': DB_WORKERS,
+    'rerank': RERANK_WORKERS,
+    'generation': GENERATION_WORKERS,
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+_in_flight = {stage: 0 for stage in STAGE_WORKERS}
+_END = object()
+
+
+def get_executor(stage: str) -> ThreadPoolExecutor:
+    """获取指定阶段的专用线程池"""
+    if stage not in STAGE_WORKERS:
+        raise ValueError(f"未知的执行阶段: {stage}")
+    with _executors_lock:
+        executor = _executors.get(stage)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS[stage], thread_name_prefix=f"rag-{stage}")
+            _executors[stage] = executor
+        return executor
+
+
+def _track(stage: str, delta: int):
+    with _executors_lock:
+        _in_flight[stage] += delta
+
+
+async def run_in_stage(stage: str, func, *args, **kwargs):
+    """在指定阶段的线程池中执行同步函数，避免阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    _track(stage, 1)
+    try:
+        return await loop.run_in_executor(get_executor(stage), functools.partial(func, *args, **kwargs))
+    finally:
+        _track(stage, -1)
+
+
+async def iterate_in_stage(stage: str, func, *args, **kwargs):
+    """在指定阶段的线程池中消费同步生成器，逐项交给事件循环
+
+    整个迭代过程占用该阶段的一个线程，因此同样受并发上限约束；
+    调用方提前退出时会在下一项产出后关闭源生成器。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def produce():
+        iterator = None
+        try:
+            # 源函数可能在返回迭代器之前就抛出异常（如模型加载失败），同样要通知消费方
+            iterator = iter(func(*args, **kwargs))
+            for item in iterator:
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+                if stop.is_set():
+                    break
+            loop.call_soon_threadsafe(queue.put_nowait, (_END, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (_END, e))
+        finally:
+            if iterator is not None and hasattr(iterator, 'close'):
+                iterator.close()
+
+    _track(stage, 1)
+    future = loop.run_in_executor(get_executor(stage), produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        future.add_done_callback(lambda _: _track(stage, -1))
+
+
+def executor_stats() -> dict:
+    """各阶段线程池的并发上限与当前在途任务数"""
+    with _executors_lock:
+        return {
+            stage: {"max_workers": workers, "in_flight": _in_flight[stage]}
+            for stage, workers in STAGE_WORKERS.items()
+        }
+
+
+def shutdown_executors():
+    """关闭所有线程池"""
+    with _executors_lock:
+        for stage, executor in _executors.items():
+            executor.shutdown(wait=False, cancel_futures=True)
+            logger.info(f"已关闭 {stage} 线程池")
+        _executors.clear()
@@ -15,7 +15,7 @@ os.environ['PGCLIENTENCODING'] = 'UTF8'
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
-from db import init_db
+from db import init_db, backfill_lexical_index
 from config import PG_URL
 
 logging.basicConfig(level=logging.INFO)
@@ -30,13 +30,26 @@ def main():
         # 初始化数据库
         init_db()
         
+        # 为历史分块补全全文检索列
+        backfilled = backfill_lexical_index()
+        if backfilled:
+            logger.info(f"已为 {backfilled} 个历史分块补全全文检索列")
+        
         logger.info("✅ 数据库初始化完成！")
         logger.info("📋 创建的表:")
-        logger.info("  - documents_chunk (文档分块表)")
+        logger.info("  - documents_chunk (文档分块表，按collection_id分区，每个集合一个分区 documents_chunk_<集合ID>)")
+        logger.info("  - collections (集合表)")
+        logger.info("  - qa_batch_jobs (异步批量问答任务表)")
+        logger.info("  - documents (文档清单表)")
         logger.info("📊 创建的索引:")
         logger.info("  - idx_document_version (文档ID和版本复合索引)")
         logger.info("  - idx_created_at (创建时间索引)")
-        logger.info("  - idx_embedding_cosine (向量余弦相似度索引)")
+        logger.info("  - idx_document_chunk_index (文档ID和分块序号复合索引)")
+        logger.info("  - idx_documents_created_document (文档清单创建时间和文档ID复合索引)")
+        logger.info("  - idx_embedding_cosine_<集合ID> (各分区的向量余弦相似度索引)")
+        logger.info("  - idx_content_tsv (全文检索GIN索引)")
+        logger.info("  - idx_content_trgm_<集合ID> (各分区的内容子串搜索trigram索引)")
+        logger.info("  - idx_documents_name_trgm (文档清单名称子串搜索trigram索引)")
         
     except Exception as e:
         logger.error(f"❌ 数据库初始化失败: {e}")
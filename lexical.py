@@ -0,0 +1,29 @@
+import re
+
+# 英文/数字按整词（允许 - _ . / 连接，如产品编号 QX-2031、条款号 3.2.1），
+# 中日韩文字按字符二元组切分，单字的连续段保留单字
+_TOKEN_RE = re.compile(r'[0-9a-z]+(?:[-_./][0-9a-z]+)*|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+
+def lexical_terms(text: str) -> list:
+    """将文本切分为全文检索词项"""
+    terms = []
+    for run in _TOKEN_RE.findall((text or '').lower()):
+        if run[0].isascii():
+            terms.append(run)
+        elif len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def lexical_text(text: str) -> str:
+    """分块入库时写入 to_tsvector('simple', ...) 的空格分隔词项"""
+    return ' '.join(lexical_terms(text))
+
+
+def lexical_query(text: str) -> str:
+    """构造 to_tsquery('simple', ...) 的查询串，词项之间取并集；无可用词项时返回空串"""
+    terms = dict.fromkeys(lexical_terms(text))
+    return ' | '.join(f"'{term}'" for term in terms)
@@ -1,8 +1,17 @@
+import copy
+import logging
+import threading
+
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, BatchEncoding, StoppingCriteria, StoppingCriteriaList,
+    TextIteratorStreamer
+)
 
 from config import LLM_MODEL, DEVICE, MODEL_CACHE_DIR, HF_ENDPOINT
 
+logger = logging.getLogger(__name__)
+
 
 class LLMModel:
     def __init__(self, model_name=None):
@@ -32,46 +41,123 @@ class LLMModel:
         # 设置pad_token
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
+        
+        self._lookup_stats_lock = threading.Lock()
+        self.lookup_stats = {
+            'requests': 0, 'generated_tokens': 0, 'verify_steps': 0, 'drafted_tokens': 0, 'accepted_tokens': 0
+        }
+        self._prefix_text = None
+        self._prefix_ids = None
+        self._prefix_cache = None
+        from config import LLM_PREFIX_CACHE_ENABLED
+        if LLM_PREFIX_CACHE_ENABLED:
+            self._init_prefix_cache()
     
-    def generate_answer(self, prompt: str, max_length=None, temperature=None):
-        """生成回答"""
-        # 使用配置中的默认值
-        from config import LLM_INPUT_MAX_LENGTH, LLM_OUTPUT_MAX_LENGTH, LLM_TEMPERATURE
-        if max_length is None:
-            max_length = LLM_OUTPUT_MAX_LENGTH
-        if temperature is None:
-            temperature = LLM_TEMPERATURE
-            
-        # 构造对话格式
+    def _apply_template(self, prompt: str) -> str:
+        """应用聊天模板（无模板的模型直接使用原始Prompt）"""
+        if not self.tokenizer.chat_template:
+            return prompt
         messages = [
             {"role": "user", "content": prompt}
         ]
-        
-        # 应用聊天模板
-        text = self.tokenizer.apply_chat_template(
+        return self.tokenizer.apply_chat_template(
             messages,
             tokenize=False,
             add_generation_prompt=True
         )
+    
+    def _init_prefix_cache(self):
+        """预先计算固定指令前缀（聊天模板头 + 问答指令）的KV缓存
+        
+        前缀截止在指令后的空行处，换行是分词边界，单独编码前缀和剩余部分拼接后
+        与整体编码结果一致。
+        """
+        from prompts import QA_INSTRUCTION
+        templated = self._apply_template(QA_INSTRUCTION + "\n\n")
+        prefix_text = templated[:templated.index(QA_INSTRUCTION) + len(QA_INSTRUCTION) + 2]
+        inputs = self.tokenizer(prefix_text, return_tensors="pt").to(self.model.device)
+        with torch.no_grad():
+            outputs = self.model(**inputs, use_cache=True)
+        self._prefix_text = prefix_text
+        self._prefix_ids = inputs['input_ids'][0].tolist()
+        self._prefix_cache = outputs.past_key_values
+        logger.info(f"指令前缀KV缓存已就绪: {len(self._prefix_ids)} 个token")
+    
+    def _prefix_cache_for(self, input_ids: list):
+        """输入以固定前缀开头时返回前缀KV缓存的副本及其长度，否则返回 (None, 0)
+        
+        generate会在传入的缓存上原地追加，每个请求必须使用独立副本，避免污染共享缓存。
+        """
+        if self._prefix_cache is None:
+            return None, 0
+        length = len(self._prefix_ids)
+        if len(input_ids) <= length or input_ids[:length] != self._prefix_ids:
+            return None, 0
+        return copy.deepcopy(self._prefix_cache), length
+    
+    def _prepare_inputs(self, prompt: str):
+        """应用聊天模板并编码输入"""
+        from config import LLM_INPUT_MAX_LENGTH
+        
+        text = self._apply_template(prompt)
+        
+        # 以固定前缀开头时复用前缀的token ID，保证与前缀KV缓存逐token对齐
+        if self._prefix_text and text.startswith(self._prefix_text):
+            suffix_ids = self.tokenizer(text[len(self._prefix_text):], add_special_tokens=False)['input_ids']
+            input_ids = (self._prefix_ids + suffix_ids)[:LLM_INPUT_MAX_LENGTH]
+            return BatchEncoding({
+                'input_ids': torch.tensor([input_ids]),
+                'attention_mask': torch.ones((1, len(input_ids)), dtype=torch.long)
+            }).to(self.model.device)
         
         # 编码输入
-        inputs = self.tokenizer(
+        return self.tokenizer(
             text,
             return_tensors="pt",
             truncation=True,
             max_length=LLM_INPUT_MAX_LENGTH
+        ).to(self.model.device)
+    
+    def _generation_kwargs(self, inputs, max_length=None, temperature=None, use_prefix_cache=True):
+        """构造generate参数，输入命中固定前缀时附带前缀KV缓存副本"""
+        # 使用配置中的默认值
+        from config import LLM_OUTPUT_MAX_LENGTH, LLM_TEMPERATURE
+        if max_length is None:
+            max_length = LLM_OUTPUT_MAX_LENGTH
+        if temperature is None:
+            temperature = LLM_TEMPERATURE
+        
+        kwargs = dict(
+            **inputs,
+            max_new_tokens=max_length - inputs['input_ids'].shape[1],
+            temperature=temperature,
+            do_sample=True,
+            pad_token_id=self.tokenizer.eos_token_id,
+            eos_token_id=self.tokenizer.eos_token_id
         )
+        if use_prefix_cache:
+            past_key_values, _ = self._prefix_cache_for(inputs['input_ids'][0].tolist())
+            if past_key_values is not None:
+                kwargs['past_key_values'] = past_key_values
+        return kwargs
+    
+    def generate_answer(self, prompt: str, max_length=None, temperature=None):
+        """生成回答"""
+        from config import LLM_PROMPT_LOOKUP_ENABLED
+        inputs = self._prepare_inputs(prompt)
+        
+        if LLM_PROMPT_LOOKUP_ENABLED:
+            kwargs = self._generation_kwargs(inputs, max_length, temperature, use_prefix_cache=False)
+            tokens = self.generate_with_prompt_lookup(
+                inputs['input_ids'][0].tolist(),
+                kwargs['max_new_tokens'],
+                kwargs['temperature']
+            )
+            return self.tokenizer.decode(tokens, skip_special_tokens=True).strip()
         
         # 生成回答
         with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=max_length - inputs['input_ids'].shape[1],
-                temperature=temperature,
-                do_sample=True,
-                pad_token_id=self.tokenizer.eos_token_id,
-                eos_token_id=self.tokenizer.eos_token_id
-            )
+            outputs = self.model.generate(**self._generation_kwargs(inputs, max_length, temperature))
         
         # 解码输出
         response = self.tokenizer.decode(
@@ -80,9 +166,207 @@ class LLMModel:
         )
         
         return response.strip()
+    
+    def generate_batch(self, prompts: list, max_length=None, temperature=None):
+        """批量生成回答：各Prompt左侧padding到相同长度后整批调用一次generate"""
+        encoded = [self._prepare_inputs(prompt)['input_ids'][0].tolist() for prompt in prompts]
+        width = max(len(ids) for ids in encoded)
+        pad_id = self.tokenizer.pad_token_id
+        inputs = {
+            'input_ids': torch.tensor(
+                [[pad_id] * (width - len(ids)) + ids for ids in encoded], device=self.model.device
+            ),
+            'attention_mask': torch.tensor(
+                [[0] * (width - len(ids)) + [1] * len(ids) for ids in encoded], device=self.model.device
+            )
+        }
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **self._generation_kwargs(inputs, max_length, temperature, use_prefix_cache=False)
+            )
+        return [self.tokenizer.decode(row[width:], skip_special_tokens=True).strip() for row in outputs]
+    
+    def generate_with_prompt_lookup(self, input_ids: list, max_new_tokens: int, temperature=None,
+                                    num_draft_tokens=None, max_ngram=None):
+        """Prompt Lookup辅助解码，返回新生成的token ID列表
+        
+        以已有序列末尾的n-gram在Prompt及已生成内容中查找上一次出现的位置，把其后的token
+        作为草稿，与当前token一起做一次前向计算验证；逐位采样结果与草稿一致的部分直接接受，
+        第一个不一致的位置使用采样结果，无需额外的草稿模型。
+        """
+        from config import LLM_PROMPT_LOOKUP_NUM_TOKENS, LLM_PROMPT_LOOKUP_MAX_NGRAM
+        num_draft_tokens = num_draft_tokens or LLM_PROMPT_LOOKUP_NUM_TOKENS
+        max_ngram = max_ngram or LLM_PROMPT_LOOKUP_MAX_NGRAM
+        eos_token_id = self.tokenizer.eos_token_id
+        top_k = getattr(self.model.generation_config, 'top_k', None)
+        top_p = getattr(self.model.generation_config, 'top_p', None)
+        device = self.model.device
+        
+        ids = list(input_ids)
+        index = _NgramIndex(max_ngram)
+        generated = []
+        drafted = accepted = steps = 0
+        
+        with torch.no_grad():
+            past_key_values, cached = self._prefix_cache_for(ids)
+            outputs = self.model(
+                input_ids=torch.tensor([ids[cached:]], device=device),
+                attention_mask=torch.ones((1, len(ids)), dtype=torch.long, device=device),
+                past_key_values=past_key_values,
+                use_cache=True
+            )
+            past_key_values = outputs.past_key_values
+            next_token = sample_token(outputs.logits[0, -1], temperature, top_k, top_p)
+            
+            while True:
+                ids.append(next_token)
+                generated.append(next_token)
+                if next_token == eos_token_id or len(generated) >= max_new_tokens:
+                    break
+                
+                index.update(ids)
+                draft = index.lookup(ids, min(num_draft_tokens, max_new_tokens - len(generated)))
+                feed = [next_token] + draft
+                outputs = self.model(
+                    input_ids=torch.tensor([feed], device=device),
+                    attention_mask=torch.ones((1, len(ids) + len(draft)), dtype=torch.long, device=device),
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+                past_key_values = outputs.past_key_values
+                steps += 1
+                drafted += len(draft)
+                
+                # 逐位验证草稿：第i个位置的输出决定草稿第i个token是否被接受
+                for i, draft_token in enumerate(draft):
+                    token = sample_token(outputs.logits[0, i], temperature, top_k, top_p)
+                    if token != draft_token:
+                        next_token = token
+                        break
+                    accepted += 1
+                    ids.append(token)
+                    generated.append(token)
+                    if token == eos_token_id or len(generated) >= max_new_tokens:
+                        break
+                else:
+                    next_token = sample_token(outputs.logits[0, len(draft)], temperature, top_k, top_p)
+                
+                if generated[-1] == eos_token_id or len(generated) >= max_new_tokens:
+                    break
+                # 丢弃未被接受的草稿在KV缓存中的位置
+                past_key_values = _crop_cache(past_key_values, len(ids))
+        
+        with self._lookup_stats_lock:
+            self.lookup_stats['requests'] += 1
+            self.lookup_stats['generated_tokens'] += len(generated)
+            self.lookup_stats['verify_steps'] += steps
+            self.lookup_stats['drafted_tokens'] += drafted
+            self.lookup_stats['accepted_tokens'] += accepted
+        return generated
+    
+    def get_lookup_stats(self) -> dict:
+        """Prompt Lookup解码统计"""
+        with self._lookup_stats_lock:
+            stats = dict(self.lookup_stats)
+        stats['acceptance_ratio'] = round(stats['accepted_tokens'] / stats['drafted_tokens'], 4) if stats['drafted_tokens'] else 0
+        stats['tokens_per_step'] = round(stats['generated_tokens'] / (stats['verify_steps'] + stats['requests']), 2) if stats['requests'] else 0
+        return stats
+    
+    def stream_answer(self, prompt: str, max_length=None, temperature=None):
+        """流式生成回答：generate在后台线程执行，逐段产出解码后的文本
+        
+        调用方提前关闭生成器（如客户端断开）时会通知后台线程停止生成。
+        """
+        inputs = self._prepare_inputs(prompt)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop_event = threading.Event()
+        kwargs = self._generation_kwargs(inputs, max_length, temperature)
+        kwargs['streamer'] = streamer
+        kwargs['stopping_criteria'] = StoppingCriteriaList([_StopOnEvent(stop_event)])
+        
+        thread = threading.Thread(target=self._generate_in_background, args=(kwargs, streamer), daemon=True)
+        thread.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            stop_event.set()
+            thread.join()
+    
+    def _generate_in_background(self, kwargs, streamer):
+        # no_grad是线程局部状态，需要在生成线程内设置
+        try:
+            with torch.no_grad():
+                self.model.generate(**kwargs)
+        except Exception as e:
+            logger.error(f"流式生成失败: {e}")
+            streamer.end()
+
+
+class _StopOnEvent(StoppingCriteria):
+    """事件被设置后在下一个token边界停止生成"""
+    
+    def __init__(self, event: threading.Event):
+        self.event = event
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class _NgramIndex:
+    """增量维护的n-gram位置索引，记录每个n-gram最近一次出现的结束位置"""
+    
+    def __init__(self, max_ngram: int):
+        self.max_ngram = max_ngram
+        self.positions = {}
+        self.indexed = 0
+    
+    def update(self, ids: list):
+        # 末尾位置暂不入索引，查找时才能命中此前的出现位置
+        for end in range(self.indexed, len(ids) - 1):
+            for n in range(1, min(self.max_ngram, end + 1) + 1):
+                self.positions[tuple(ids[end - n + 1:end + 1])] = end
+        self.indexed = max(self.indexed, len(ids) - 1)
+    
+    def lookup(self, ids: list, num_tokens: int) -> list:
+        """优先用最长的n-gram匹配，返回匹配位置之后的草稿token"""
+        if num_tokens <= 0:
+            return []
+        for n in range(min(self.max_ngram, len(ids)), 0, -1):
+            end = self.positions.get(tuple(ids[-n:]))
+            if end is not None:
+                return ids[end + 1:end + 1 + num_tokens]
+        return []
+
+
+def _crop_cache(past_key_values, length: int):
+    """将KV缓存截断到指定长度"""
+    if hasattr(past_key_values, 'crop'):
+        past_key_values.crop(length)
+        return past_key_values
+    return tuple(tuple(t[:, :, :length] for t in layer) for layer in past_key_values)
+
+
+def sample_token(logits, temperature=None, top_k=None, top_p=None) -> int:
+    """按温度、top_k、top_p采样下一个token；温度为空或0时贪心解码"""
+    logits = logits.float()
+    if not temperature or temperature <= 0:
+        return int(torch.argmax(logits))
+    logits = logits / temperature
+    if top_k:
+        kth = torch.topk(logits, min(top_k, logits.numel())).values[-1]
+        logits = logits.masked_fill(logits < kth, float('-inf'))
+    if top_p and top_p < 1.0:
+        sorted_logits, sorted_idx = torch.sort(logits, descending=True)
+        probs = torch.softmax(sorted_logits, dim=-1)
+        remove = probs.cumsum(dim=-1) - probs > top_p
+        logits = logits.masked_fill(remove.scatter(0, sorted_idx, remove), float('-inf'))
+    return int(torch.multinomial(torch.softmax(logits, dim=-1), 1))
 
 # 全局模型实例
 _llm_model = None
+_generation_scheduler = None
 
 def get_llm_model():
     global _llm_model
@@ -90,7 +374,43 @@ def get_llm_model():
         _llm_model = LLMModel()
     return _llm_model
 
+def get_generation_scheduler():
+    """获取连续批处理调度器"""
+    global _generation_scheduler
+    if _generation_scheduler is None:
+        from llm_scheduler import GenerationScheduler
+        _generation_scheduler = GenerationScheduler(get_llm_model())
+    return _generation_scheduler
+
 def generate_answer(prompt: str):
     """生成回答"""
+    from config import LLM_SCHEDULER_ENABLED
+    if LLM_SCHEDULER_ENABLED:
+        return get_generation_scheduler().generate(prompt).result()['text']
+    model = get_llm_model()
+    return model.generate_answer(prompt)
+
+def generate_answers(prompts: list):
+    """批量生成回答：启用连续批处理时整批提交给调度器，否则按长度排序后分批padding生成"""
+    from config import LLM_SCHEDULER_ENABLED, LLM_MAX_BATCH_SIZE
+    if LLM_SCHEDULER_ENABLED:
+        scheduler = get_generation_scheduler()
+        handles = [scheduler.generate(prompt) for prompt in prompts]
+        return [handle.result()['text'] for handle in handles]
+    
+    model = get_llm_model()
+    answers = [None] * len(prompts)
+    order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+    for start in range(0, len(order), LLM_MAX_BATCH_SIZE):
+        bucket = order[start:start + LLM_MAX_BATCH_SIZE]
+        for i, answer in zip(bucket, model.generate_batch([prompts[i] for i in bucket])):
+            answers[i] = answer
+    return answers
+
+def stream_answer(prompt: str):
+    """流式生成回答"""
+    from config import LLM_SCHEDULER_ENABLED
+    if LLM_SCHEDULER_ENABLED:
+        return iter(get_generation_scheduler().generate(prompt, stream=True))
     model = get_llm_model()
-    return model.generate_answer(prompt) 
\ No newline at end of file
+    return model.stream_answer(prompt)
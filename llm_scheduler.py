@@ -0,0 +1,306 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+
+from llm import sample_token
+
+logger = logging.getLogger(__name__)
+
+_STREAM_END = object()
+
+
+def _as_cache(past_key_values):
+    """模型返回旧版元组格式的KV缓存时转换一次为DynamicCache，之后批次一直在其上原地更新"""
+    if isinstance(past_key_values, (tuple, list)):
+        from transformers import DynamicCache
+        return DynamicCache.from_legacy_cache(tuple(past_key_values))
+    return past_key_values
+
+
+def _layers(cache) -> list:
+    """DynamicCache各层的 (key, value) 张量，形状 (batch, heads, seq, head_dim)"""
+    if hasattr(cache, 'layers'):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def _set_layers(cache, tensors: list):
+    """原地替换DynamicCache各层的key/value张量"""
+    if hasattr(cache, 'layers'):
+        for layer, (key, value) in zip(cache.layers, tensors):
+            layer.keys, layer.values = key, value
+        return
+    for i, (key, value) in enumerate(tensors):
+        cache.key_cache[i], cache.value_cache[i] = key, value
+
+
+def _left_pad(tensor, length: int):
+    """在序列维(dim=2)左侧补零到指定长度"""
+    return F.pad(tensor, (0, 0, length - tensor.shape[2], 0))
+
+
+class GenerationHandle:
+    """单个生成请求的句柄
+
+    future 返回完整结果；以 stream=True 提交时可直接迭代得到增量文本，
+    迭代中途退出会在下一个token边界结束该请求。
+    """
+
+    def __init__(self, input_ids: list, max_new_tokens: int, temperature: float, stream: bool = False):
+        self.input_ids = input_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.future = Future()
+        self.generated = []
+        self.position = 0
+        self.cancelled = False
+        self.submitted_at = time.perf_counter()
+        self.first_token_at = None
+        self._queue = queue.Queue() if stream else None
+        self._emitted = ''
+
+    def result(self, timeout=None) -> dict:
+        return self.future.result(timeout)
+
+    def __iter__(self):
+        if self._queue is None:
+            raise RuntimeError("该请求未开启流式输出")
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.cancelled = True
+
+
+class GenerationScheduler:
+    """LLM连续批处理调度器
+
+    后台线程维护一个正在解码的批次：新请求单独prefill后在token边界并入批次
+    （KV缓存左侧补齐到相同长度），每步对整批做一次前向计算，
+    生成结束的序列随即退出批次，空出的位置留给排队中的请求。
+    """
+
+    def __init__(self, llm, max_batch_size: int = None):
+        from config import LLM_MAX_BATCH_SIZE
+        self.llm = llm
+        self.model = llm.model
+        self.tokenizer = llm.tokenizer
+        self.max_batch_size = max_batch_size or LLM_MAX_BATCH_SIZE
+        self.device = self.model.device
+
+        eos = getattr(self.model.generation_config, 'eos_token_id', None)
+        eos = eos if isinstance(eos, (list, tuple)) else [eos]
+        self.eos_token_ids = {t for t in eos + [self.tokenizer.eos_token_id] if t is not None}
+        self.top_k = getattr(self.model.generation_config, 'top_k', None)
+        self.top_p = getattr(self.model.generation_config, 'top_p', None)
+
+        self._waiting = queue.Queue()
+        self._active = []
+        self._cache = None  # 整个批次的DynamicCache，合并/裁剪直接替换各层的KV张量
+        self._mask = None   # (batch, seq)，左侧padding位置为0
+        self._stats_lock = threading.Lock()
+        self.completed = 0
+        self.generated_tokens = 0
+        self.decode_steps = 0
+
+        self._thread = threading.Thread(target=self._loop, name='llm-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, input_ids: list, max_new_tokens: int, temperature: float, stream: bool = False) -> GenerationHandle:
+        """提交已编码的请求"""
+        handle = GenerationHandle(list(input_ids), max_new_tokens, temperature, stream)
+        if max_new_tokens <= 0:
+            self._finish(handle)
+        else:
+            self._waiting.put(handle)
+        return handle
+
+    def generate(self, prompt: str, max_length=None, temperature=None, stream: bool = False) -> GenerationHandle:
+        """按LLMModel相同的模板和参数编码Prompt后提交"""
+        inputs = self.llm._prepare_inputs(prompt)
+        kwargs = self.llm._generation_kwargs(inputs, max_length, temperature, use_prefix_cache=False)
+        return self.submit(
+            inputs['input_ids'][0].tolist(),
+            kwargs['max_new_tokens'],
+            kwargs['temperature'],
+            stream=stream
+        )
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "active": len(self._active),
+                "waiting": self._waiting.qsize(),
+                "completed": self.completed,
+                "generated_tokens": self.generated_tokens,
+                "decode_steps": self.decode_steps
+            }
+
+    def _loop(self):
+        with torch.no_grad():
+            while True:
+                try:
+                    self._admit()
+                    if self._active:
+                        self._decode_step()
+                except Exception as e:
+                    logger.error(f"批量生成失败: {e}")
+                    self._fail_active(e)
+
+    def _admit(self):
+        """在token边界接纳排队中的请求；批次为空时阻塞等待"""
+        while len(self._active) < self.max_batch_size:
+            try:
+                handle = self._waiting.get(block=not self._active)
+            except queue.Empty:
+                return
+            if handle.cancelled:
+                self._finish(handle)
+                continue
+            try:
+                self._prefill(handle)
+            except Exception as e:
+                logger.error(f"预填充失败: {e}")
+                self._fail(handle, e)
+
+    def _prefill(self, handle: GenerationHandle):
+        input_ids = torch.tensor([handle.input_ids], device=self.device)
+        # 命中固定指令前缀时只需对剩余部分做prefill
+        past_key_values, cached = self.llm._prefix_cache_for(handle.input_ids)
+        outputs = self.model(
+            input_ids=input_ids[:, cached:],
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=past_key_values,
+            use_cache=True
+        )
+        handle.position = input_ids.shape[1]
+        if self._emit(handle, self._sample(outputs.logits[0, -1], handle.temperature)):
+            return
+        self._merge(_as_cache(outputs.past_key_values), input_ids.shape[1])
+        self._active.append(handle)
+
+    def _merge(self, past, length: int):
+        """将单条序列的KV缓存并入批次，较短的一方在左侧补齐"""
+        mask = torch.ones((1, length), dtype=torch.long, device=self.device)
+        if self._cache is None:
+            self._cache = past
+            self._mask = mask
+            return
+        target = max(self._mask.shape[1], length)
+        _set_layers(self._cache, [
+            tuple(torch.cat([_left_pad(a, target), _left_pad(b, target)], dim=0) for a, b in zip(batch_layer, new_layer))
+            for batch_layer, new_layer in zip(_layers(self._cache), _layers(past))
+        ])
+        self._mask = torch.cat([
+            F.pad(self._mask, (target - self._mask.shape[1], 0)),
+            F.pad(mask, (target - length, 0))
+        ], dim=0)
+
+    def _decode_step(self):
+        input_ids = torch.tensor([[h.generated[-1]] for h in self._active], device=self.device)
+        position_ids = torch.tensor([[h.position] for h in self._active], device=self.device)
+        attention_mask = F.pad(self._mask, (0, 1), value=1)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=self._cache,
+            use_cache=True
+        )
+        # DynamicCache在前向计算中原地追加本步的KV
+        self._cache = _as_cache(outputs.past_key_values)
+        self._mask = attention_mask
+
+        finished = []
+        for row, handle in enumerate(self._active):
+            handle.position += 1
+            if self._emit(handle, self._sample(outputs.logits[row, -1], handle.temperature)):
+                finished.append(row)
+        if finished:
+            self._retire(finished)
+        with self._stats_lock:
+            self.decode_steps += 1
+
+    def _retire(self, rows: list):
+        """移除已结束的序列，并裁掉所有行都是padding的左侧列"""
+        removed = set(rows)
+        keep = [i for i in range(len(self._active)) if i not in removed]
+        self._active = [self._active[i] for i in keep]
+        if not keep:
+            self._cache = None
+            self._mask = None
+            return
+        index = torch.tensor(keep, device=self.device)
+        self._mask = self._mask.index_select(0, index)
+        first = int(torch.nonzero(self._mask.any(dim=0))[0])
+        self._mask = self._mask[:, first:]
+        _set_layers(self._cache, [
+            tuple(t.index_select(0, index)[:, :, first:] for t in layer) for layer in _layers(self._cache)
+        ])
+
+    def _sample(self, logits, temperature) -> int:
+        return sample_token(logits, temperature, self.top_k, self.top_p)
+
+    def _emit(self, handle: GenerationHandle, token: int) -> bool:
+        """记录新token并推送增量文本，返回该请求是否结束"""
+        handle.generated.append(token)
+        if handle.first_token_at is None:
+            handle.first_token_at = time.perf_counter()
+        if handle._queue is not None:
+            self._push_text(handle)
+        done = (
+            token in self.eos_token_ids
+            or len(handle.generated) >= handle.max_new_tokens
+            or handle.cancelled
+        )
+        if done:
+            self._finish(handle)
+        return done
+
+    def _push_text(self, handle: GenerationHandle):
+        text = self.tokenizer.decode(handle.generated, skip_special_tokens=True)
+        # 末尾是不完整的多字节字符时等下一个token再推送
+        if len(text) > len(handle._emitted) and not text.endswith('\ufffd'):
+            handle._queue.put(text[len(handle._emitted):])
+            handle._emitted = text
+
+    def _finish(self, handle: GenerationHandle):
+        now = time.perf_counter()
+        text = self.tokenizer.decode(handle.generated, skip_special_tokens=True)
+        if handle._queue is not None:
+            if len(text) > len(handle._emitted):
+                handle._queue.put(text[len(handle._emitted):])
+            handle._queue.put(_STREAM_END)
+        with self._stats_lock:
+            self.completed += 1
+            self.generated_tokens += len(handle.generated)
+        handle.future.set_result({
+            "text": text.strip(),
+            "tokens": len(handle.generated),
+            "latency": now - handle.submitted_at,
+            "ttft": handle.first_token_at - handle.submitted_at if handle.first_token_at else None
+        })
+
+    def _fail(self, handle: GenerationHandle, error: Exception):
+        if handle._queue is not None:
+            handle._queue.put(error)
+        if not handle.future.done():
+            handle.future.set_exception(error)
+
+    def _fail_active(self, error: Exception):
+        for handle in self._active:
+            self._fail(handle, error)
+        self._active = []
+        self._cache = None
+        self._mask = None
@@ -0,0 +1,363 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows下只做进程内加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LOCAL_INDEX_FORMAT = 1  # 存储格式版本，格式变化时递增
+_SCAN_BLOCK_ROWS = 65536  # 打分时每次转换为float32的行数，控制临时内存
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class LocalVectorIndex:
+    """进程内向量索引，镜像 documents_chunk 的向量，按 chunk id 寻址
+
+    目录中 vectors.f16 顺序存放归一化后的float16向量，ids.i8 为对应的 chunk id
+    （删除后置为-1），lists.i4 为每行所属的IVF簇，centroids.npy 为簇中心，
+    meta.json 记录行数和版本号。多个worker以只读方式映射同一组文件，共享操作系统
+    页缓存；写入方持文件锁追加或标记删除，读取方发现版本号变化后重新映射。
+    """
+
+    def __init__(self, index_dir: str, dim: int, model_name: str, nlist: int = 0, nprobe: int = 16):
+        self.path = index_dir
+        self.dim = dim
+        self.model_name = model_name
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._meta_mtime = None
+        self._version = None
+        self._count = 0
+        self._vectors = None
+        self._ids = None
+        self._centroids = None
+        self._order = None
+        self._bounds = None
+        self.searches = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _write_lock(self):
+        """进程内线程锁 + 跨进程文件锁，保证同一时间只有一个写入方"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._file('lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        try:
+            with open(self._file('meta.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        expected = {'format': LOCAL_INDEX_FORMAT, 'dim': self.dim, 'model': self.model_name}
+        if any(meta.get(key) != value for key, value in expected.items()):
+            return None
+        return meta
+
+    def _write_meta(self, count: int, version: int):
+        tmp_path = self._file('meta.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'format': LOCAL_INDEX_FORMAT, 'dim': self.dim, 'model': self.model_name,
+                'count': count, 'version': version
+            }, f)
+        os.replace(tmp_path, self._file('meta.json'))
+
+    def _refresh(self):
+        """meta.json 有变化时重新映射文件并重建倒排表"""
+        try:
+            mtime = os.stat(self._file('meta.json')).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._meta_mtime:
+            return
+        meta = self._read_meta()
+        self._meta_mtime = mtime
+        if meta is None or meta['count'] == 0:
+            self._version, self._count = (meta or {}).get('version'), 0
+            self._vectors = self._ids = self._centroids = self._order = self._bounds = None
+            return
+        if meta['version'] == self._version:
+            return
+
+        count = meta['count']
+        self._vectors = np.memmap(self._file('vectors.f16'), dtype=np.float16, mode='r', shape=(count, self.dim))
+        self._ids = np.memmap(self._file('ids.i8'), dtype='<i8', mode='r', shape=(count,))
+        self._centroids = None
+        self._order = self._bounds = None
+        if os.path.exists(self._file('centroids.npy')):
+            self._centroids = np.load(self._file('centroids.npy'))
+            lists = np.fromfile(self._file('lists.i4'), dtype='<i4', count=count)
+            self._order = np.argsort(lists, kind='stable')
+            self._bounds = np.searchsorted(lists[self._order], np.arange(len(self._centroids) + 1))
+        self._count = count
+        self._version = meta['version']
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            self._refresh()
+            return self._count > 0
+
+    def search(self, query, k: int) -> list:
+        """返回余弦距离最近的k个分块 [(chunk_id, distance), ...]"""
+        with self._lock:
+            self._refresh()
+            vectors, ids, count = self._vectors, self._ids, self._count
+            centroids, order, bounds = self._centroids, self._order, self._bounds
+            self.searches += 1
+        if not count:
+            return []
+
+        q = _normalize(query)
+        if centroids is not None and self.nprobe < len(centroids):
+            probe = np.argpartition(-(centroids @ q), self.nprobe)[:self.nprobe]
+            rows = np.concatenate([order[bounds[c]:bounds[c + 1]] for c in probe])
+            rows.sort()
+        else:
+            rows = np.arange(count)
+        if not len(rows):
+            return []
+
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), _SCAN_BLOCK_ROWS):
+            block = rows[start:start + _SCAN_BLOCK_ROWS]
+            scores[start:start + len(block)] = vectors[block].astype(np.float32) @ q
+        chunk_ids = ids[rows]
+        scores[chunk_ids < 0] = -np.inf
+
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(chunk_ids[i]), float(1 - scores[i])) for i in top if scores[i] > -np.inf]
+
+    def _assign(self, vectors, centroids):
+        return np.argmax(vectors @ centroids.T, axis=1).astype('<i4')
+
+    def add(self, chunk_ids: list, vectors):
+        """追加新分块的向量"""
+        if not len(chunk_ids):
+            return
+        vectors = _normalize(vectors)
+        with self._write_lock():
+            meta = self._read_meta()
+            count, version = (meta['count'], meta['version']) if meta else (0, 0)
+            mode = 'r+b' if count else 'w+b'
+            with open(self._file('vectors.f16'), mode) as f:
+                f.seek(count * self.dim * 2)
+                f.write(vectors.astype('<f2').tobytes())
+            with open(self._file('ids.i8'), mode) as f:
+                f.seek(count * 8)
+                f.write(np.asarray(chunk_ids, dtype='<i8').tobytes())
+            if count and os.path.exists(self._file('centroids.npy')):
+                with open(self._file('lists.i4'), 'r+b') as f:
+                    f.seek(count * 4)
+                    f.write(self._assign(vectors, np.load(self._file('centroids.npy'))).tobytes())
+            self._write_meta(count + len(chunk_ids), version + 1)
+
+    def remove(self, chunk_ids: list):
+        """标记删除分块，对应行在检索时被跳过"""
+        if not len(chunk_ids):
+            return
+        with self._write_lock():
+            meta = self._read_meta()
+            if not meta or not meta['count']:
+                return
+            ids = np.memmap(self._file('ids.i8'), dtype='<i8', mode='r+', shape=(meta['count'],))
+            rows = np.flatnonzero(np.isin(ids, np.asarray(chunk_ids, dtype='<i8')))
+            ids[rows] = -1
+            ids.flush()
+            del ids
+            self._write_meta(meta['count'], meta['version'] + 1)
+
+    def clear(self):
+        with self._write_lock():
+            meta = self._read_meta()
+            for name in ('vectors.f16', 'ids.i8', 'lists.i4', 'centroids.npy'):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            self._write_meta(0, (meta['version'] if meta else 0) + 1)
+
+    def build(self, rows):
+        """从 (chunk_id, 向量) 迭代器全量重建，写入临时文件后原子替换"""
+        start = time.perf_counter()
+        with self._write_lock():
+            meta = self._read_meta()
+            count = 0
+            with open(self._file('vectors.f16.tmp'), 'wb') as vf, open(self._file('ids.i8.tmp'), 'wb') as idf:
+                batch_ids, batch_vectors = [], []
+                for chunk_id, vector in rows:
+                    batch_ids.append(chunk_id)
+                    batch_vectors.append(vector)
+                    if len(batch_ids) >= 4096:
+                        vf.write(_normalize(batch_vectors).astype('<f2').tobytes())
+                        idf.write(np.asarray(batch_ids, dtype='<i8').tobytes())
+                        count += len(batch_ids)
+                        batch_ids, batch_vectors = [], []
+                if batch_ids:
+                    vf.write(_normalize(batch_vectors).astype('<f2').tobytes())
+                    idf.write(np.asarray(batch_ids, dtype='<i8').tobytes())
+                    count += len(batch_ids)
+
+            centroids = None
+            if count:
+                vectors = np.memmap(self._file('vectors.f16.tmp'), dtype=np.float16, mode='r', shape=(count, self.dim))
+                centroids = self._train(vectors)
+                if centroids is not None:
+                    with open(self._file('lists.i4.tmp'), 'wb') as f:
+                        for block in range(0, count, _SCAN_BLOCK_ROWS):
+                            f.write(self._assign(vectors[block:block + _SCAN_BLOCK_ROWS].astype(np.float32), centroids).tobytes())
+                del vectors
+
+            for name in ('lists.i4', 'centroids.npy'):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            os.replace(self._file('vectors.f16.tmp'), self._file('vectors.f16'))
+            os.replace(self._file('ids.i8.tmp'), self._file('ids.i8'))
+            if centroids is not None:
+                os.replace(self._file('lists.i4.tmp'), self._file('lists.i4'))
+                np.save(self._file('centroids.npy'), centroids)
+            self._write_meta(count, (meta['version'] if meta else 0) + 1)
+        logger.info(f"本地向量索引构建完成: {count} 个分块，"
+                    f"{len(centroids) if centroids is not None else 0} 个IVF簇，耗时 {time.perf_counter() - start:.1f}秒")
+        return count
+
+    def _train(self, vectors, iterations: int = 10, seed: int = 42):
+        """球面k-means训练IVF簇中心；数据量不足时返回None（检索退化为全量扫描）"""
+        count = len(vectors)
+        nlist = self.nlist or int(np.sqrt(count))
+        if nlist < 2 or count < nlist * 39:
+            return None
+        rng = np.random.default_rng(seed)
+        sample = vectors[np.sort(rng.choice(count, size=min(count, nlist * 256), replace=False))].astype(np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assign = self._assign(sample, centroids)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        return centroids
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            deleted = int((self._ids < 0).sum()) if self._count else 0
+            return {
+                "enabled": True,
+                "entries": self._count - deleted,
+                "deleted": deleted,
+                "nlist": len(self._centroids) if self._centroids is not None else 0,
+                "nprobe": self.nprobe,
+                "version": self._version,
+                "searches": self.searches
+            }
+
+
+# 全局实例：每个集合一个索引，存放在 LOCAL_INDEX_DIR/<集合ID> 下
+_local_indexes = {}
+_local_index_lock = threading.Lock()
+
+def get_local_index(collection_id: str = None):
+    """获取集合的本地向量索引，未启用时返回None"""
+    from config import LOCAL_INDEX_ENABLED, LOCAL_INDEX_DIR, LOCAL_INDEX_NLIST, LOCAL_INDEX_NPROBE, EMBEDDING_MODEL
+    from models import EMBEDDING_DIM, DEFAULT_COLLECTION
+    if not LOCAL_INDEX_ENABLED:
+        return None
+    collection_id = collection_id or DEFAULT_COLLECTION
+    with _local_index_lock:
+        if collection_id not in _local_indexes:
+            _local_indexes[collection_id] = LocalVectorIndex(
+                os.path.join(LOCAL_INDEX_DIR, collection_id), EMBEDDING_DIM, EMBEDDING_MODEL,
+                nlist=LOCAL_INDEX_NLIST, nprobe=LOCAL_INDEX_NPROBE
+            )
+        return _local_indexes[collection_id]
+
+def local_indexes(collection_ids: list = None) -> dict:
+    """返回 {集合ID: 本地索引}；未指定集合时返回磁盘上已有的全部集合索引"""
+    from config import LOCAL_INDEX_ENABLED, LOCAL_INDEX_DIR
+    if not LOCAL_INDEX_ENABLED:
+        return {}
+    if collection_ids is None:
+        collection_ids = sorted(
+            name for name in os.listdir(LOCAL_INDEX_DIR) if os.path.isdir(os.path.join(LOCAL_INDEX_DIR, name))
+        ) if os.path.isdir(LOCAL_INDEX_DIR) else []
+    return {collection_id: get_local_index(collection_id) for collection_id in collection_ids}
+
+def search_local_indexes(query, k: int, collection_ids: list = None) -> list:
+    """在多个集合的本地索引中检索，合并后返回距离最近的k个 [(集合ID, chunk_id, distance)]"""
+    hits = [
+        (collection_id, chunk_id, distance)
+        for collection_id, index in local_indexes(collection_ids).items()
+        for chunk_id, distance in index.search(query, k)
+    ]
+    return sorted(hits, key=lambda hit: hit[2])[:k]
+
+def rebuild_local_index(collection_id: str = None):
+    """从 documents_chunk 全量重建本地向量索引，未指定集合时逐个重建所有集合"""
+    from db import SessionLocal, list_collections
+    from models import DocumentChunk, active_chunks
+    if get_local_index() is None:
+        return 0
+    total = 0
+    for target in ([collection_id] if collection_id else list_collections()):
+        session = SessionLocal()
+        try:
+            rows = session.query(DocumentChunk.id, DocumentChunk.embedding).filter(
+                DocumentChunk.collection_id == target, active_chunks()
+            ).order_by(DocumentChunk.id).yield_per(2000)
+            total += get_local_index(target).build((row.id, row.embedding) for row in rows)
+        finally:
+            session.close()
+    return total
+
+def ensure_local_index():
+    """启用本地索引时，为尚未构建本地索引的集合从数据库构建"""
+    if get_local_index() is None:
+        return
+    from db import list_collections
+    for collection_id in list_collections():
+        if get_local_index(collection_id)._read_meta() is None:
+            rebuild_local_index(collection_id)
+
+def update_local_index(collection_id: str, added_ids=(), added_vectors=(), removed_ids=()):
+    """分块写入或删除提交后同步集合的本地索引；失败只记录日志，可通过重建恢复"""
+    index = get_local_index(collection_id)
+    if index is None:
+        return
+    try:
+        index.remove(list(removed_ids))
+        index.add(list(added_ids), added_vectors)
+    except Exception as e:
+        logger.error(f"更新集合 {collection_id} 的本地向量索引失败，请重建索引: {e}")
+
+def clear_local_index(collection_id: str = None):
+    """清空本地索引，未指定集合时清空全部集合"""
+    for index in local_indexes([collection_id] if collection_id else None).values():
+        index.clear()
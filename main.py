@@ -1,4 +1,5 @@
 import logging
+import threading
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -6,6 +7,7 @@ from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 
 # 导入路由
+from api.routes.collections import router as collections_router
 from api.routes.documents import router as documents_router
 from api.routes.qa import router as qa_router
 from api.routes.system import router as system_router
@@ -39,6 +41,7 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # 注册路由
+app.include_router(collections_router)
 app.include_router(documents_router)
 app.include_router(qa_router)
 app.include_router(system_router)
@@ -46,10 +49,27 @@ app.include_router(system_router)
 # 初始化数据库和模型
 @app.on_event("startup")
 async def startup_event():
+    from prefork import models_preloaded
+    if models_preloaded():
+        logger.info("数据库和模型已由主进程初始化，worker直接复用共享权重")
+        return
+    
     logger.info("正在初始化数据库...")
     init_db()
     logger.info("数据库初始化完成")
     
+    from config import PG_PREWARM_ENABLED
+    if PG_PREWARM_ENABLED:
+        from db import prewarm_vector_index
+        prewarm_vector_index()
+    
+    from local_index import ensure_local_index
+    ensure_local_index()
+    
+    # 回收上次同步中断后遗留的旧版本分块，后台执行不阻塞启动
+    from db import collect_retired_versions
+    threading.Thread(target=collect_retired_versions, name="version-gc", daemon=True).start()
+    
     # 预加载模型
     logger.info("正在预加载模型...")
     try:
@@ -74,6 +94,13 @@ async def startup_event():
         logger.error(f"模型预加载失败: {e}")
         # 不抛出异常，允许程序继续运行
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    from db import dispose_engines
+    from executors import shutdown_executors
+    shutdown_executors()
+    await dispose_engines()
+
 @app.get("/")
 async def root():
     """返回Web界面"""
@@ -1,14 +1,31 @@
 from pgvector.sqlalchemy import Vector
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Index
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, DateTime, JSON, Index, Sequence, select, text, tuple_
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 
 Base = declarative_base()
 
+EMBEDDING_DIM = 1024  # Qwen3-Embedding-0.6B实际输出1024维向量
+DEFAULT_COLLECTION = 'default'  # 未指定集合时使用的集合ID
+
+# 各分区共用一个序列，分块ID在所有集合中唯一
+chunk_id_seq = Sequence('documents_chunk_id_seq')
+
+class Collection(Base):
+    """知识库集合，每个集合对应 documents_chunk 的一个列表分区及其独立的向量索引"""
+    __tablename__ = 'collections'
+    
+    collection_id = Column(String(32), primary_key=True)  # 小写字母开头，仅含小写字母、数字和下划线
+    description = Column(String)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
 class DocumentChunk(Base):
     __tablename__ = 'documents_chunk'
     
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    collection_id = Column(String, primary_key=True, server_default=DEFAULT_COLLECTION)  # 分区键
+    id = Column(Integer, chunk_id_seq, server_default=chunk_id_seq.next_value(), primary_key=True)
     document_id = Column(String, nullable=False, index=True)  # 文档唯一标识
     version = Column(Integer, default=1, nullable=False)
     document_name = Column(String, nullable=False)
@@ -17,7 +34,8 @@ class DocumentChunk(Base):
     paragraph_num = Column(Integer)
     chunk_index = Column(Integer, nullable=False)
     content = Column(Text, nullable=False)
-    embedding = Column(Vector(1024), nullable=False)  # Qwen3-Embedding-0.6B实际输出1024维向量
+    embedding = Column(Vector(EMBEDDING_DIM), nullable=False)
+    content_tsv = deferred(Column(TSVECTOR))  # 全文检索词项（中文按字符二元组切分），见lexical.py
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     extra_metadata = Column(JSON)
     
@@ -25,5 +43,64 @@ class DocumentChunk(Base):
     __table_args__ = (
         Index('idx_document_version', 'document_id', 'version'),
         Index('idx_created_at', 'created_at'),
-        # 向量索引需要在数据库中手动创建
-    ) 
\ No newline at end of file
+        Index('idx_document_chunk_index', 'document_id', 'chunk_index'),  # 分块列表键集分页
+        Index('idx_content_tsv', 'content_tsv', postgresql_using='gin'),
+        # 向量索引和trigram索引按分区单独创建，见 db.create_collection
+        {'postgresql_partition_by': 'LIST (collection_id)'}
+    ) 
+
+class Document(Base):
+    """文档清单：每个导入的文件一行，与分块在同一事务中写入和删除"""
+    __tablename__ = 'documents'
+    
+    collection_id = Column(String, primary_key=True, server_default=DEFAULT_COLLECTION)
+    document_id = Column(String, primary_key=True)  # 与documents_chunk.document_id一致
+    document_name = Column(String, nullable=False)
+    document_path = Column(String, nullable=False, index=True)
+    content_hash = Column(String(64))          # 文件内容SHA-256
+    file_size = Column(BigInteger)             # 文件大小(字节)
+    mtime = Column(Float)                      # 文件修改时间(时间戳)
+    chunk_count = Column(Integer, default=0, nullable=False)
+    status = Column(String(16), default='ready', nullable=False)  # ready(已入库), failed(写入失败，下次同步重试), retired(已被新版本替换，等待回收分块)
+    version = Column(Integer, default=1, nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index('idx_documents_created_document', 'created_at', 'document_id'),  # 文档列表键集分页
+        Index('idx_documents_retired', 'collection_id', 'document_id',
+              postgresql_where=text("status = 'retired'")),                # 检索时排除待回收的旧版本
+        Index('idx_documents_name_trgm', 'document_name', postgresql_using='gin',
+              postgresql_ops={'document_name': 'gin_trgm_ops'}),           # 文档列表按名称子串搜索
+    )
+
+def active_chunks():
+    """排除已被新版本替换、等待后台回收的旧版本分块的过滤条件"""
+    retired = select(Document.collection_id, Document.document_id).where(Document.status == 'retired')
+    return tuple_(DocumentChunk.collection_id, DocumentChunk.document_id).not_in(retired)
+
+class BatchJob(Base):
+    """异步批量问答任务，保存在数据库中，任一worker进程都能查询其他进程受理的任务"""
+    __tablename__ = 'qa_batch_jobs'
+    
+    job_id = Column(String(32), primary_key=True)
+    status = Column(String(16), nullable=False)         # pending, running, completed, failed
+    total = Column(Integer, nullable=False)
+    completed = Column(Integer, default=0, nullable=False)
+    error = Column(Text)
+    results = Column(JSON)
+    created_at = Column(Float, nullable=False)          # 提交时间(时间戳)
+    finished_at = Column(Float)                         # 完成时间(时间戳)
+    
+    __table_args__ = (
+        Index('idx_qa_batch_jobs_created_at', 'created_at'),  # 按提交顺序淘汰旧任务
+    )
+
+class CorpusStats(Base):
+    """全库计数（单行），由 documents 表上的触发器在写入和删除的同一事务中增量维护"""
+    __tablename__ = 'corpus_stats'
+    
+    id = Column(Integer, primary_key=True)
+    total_documents = Column(BigInteger, default=0, nullable=False)
+    total_chunks = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), nullable=False)
@@ -0,0 +1,145 @@
+"""
+多进程服务：主进程预加载模型后fork出多个worker
+
+模型权重在fork之前加载，worker进程通过写时复制共享同一份物理内存页，
+推理过程只读不写权重，因此内存占用不随worker数线性增长。
+仅支持CPU推理：CUDA上下文无法跨fork使用。
+"""
+import gc
+import logging
+import os
+import signal
+import socket
+
+logger = logging.getLogger(__name__)
+
+_master_pid = None
+
+
+def models_preloaded() -> bool:
+    """当前进程是否为预加载模型后fork出的worker"""
+    return _master_pid is not None and os.getpid() != _master_pid
+
+
+def worker_pids() -> list:
+    """prefork模式下返回所有worker进程的PID，否则返回当前进程"""
+    if not models_preloaded():
+        return [os.getpid()]
+    import psutil
+    try:
+        return sorted(child.pid for child in psutil.Process(_master_pid).children())
+    except psutil.NoSuchProcess:
+        return [os.getpid()]
+
+
+def master_pid():
+    return _master_pid
+
+
+def _preload():
+    """在主进程中初始化数据库并加载全部模型"""
+    from db import init_db, engine
+    from embedding import get_embedding_model
+    from llm import get_llm_model
+    from rerank import get_rerank_model
+
+    init_db()
+    from config import PG_PREWARM_ENABLED
+    if PG_PREWARM_ENABLED:
+        from db import prewarm_vector_index
+        prewarm_vector_index()
+    from local_index import ensure_local_index
+    ensure_local_index()
+    # 回收上次同步中断后遗留的旧版本分块，只在主进程执行一次，worker不再重复
+    from db import collect_retired_versions
+    collect_retired_versions()
+    # 连接不能跨进程复用，fork前清空连接池
+    engine.dispose()
+
+    logger.info("主进程正在预加载模型...")
+    get_embedding_model()
+    get_llm_model()
+    get_rerank_model()
+    logger.info("模型预加载完成")
+
+
+def _run_worker(app, sock, threads: int):
+    import torch
+    import uvicorn
+    from config import DEBUG
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+
+    config = uvicorn.Config(app, log_level="info" if not DEBUG else "debug")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(host: str, port: int, workers: int):
+    """预加载模型并以 workers 个进程共享同一个监听socket提供服务"""
+    global _master_pid
+    import torch
+    from config import DEVICE, WORKER_TORCH_THREADS
+
+    if DEVICE != 'cpu' and torch.cuda.is_available():
+        raise RuntimeError("多进程共享权重仅支持CPU推理（DEVICE=cpu），GPU部署请使用单进程配合连续批处理")
+
+    from main import app
+
+    # 预加载阶段只用单线程，避免在主进程中启动OpenMP线程池导致fork后的worker死锁
+    torch.set_num_threads(1)
+    _preload()
+
+    threads = WORKER_TORCH_THREADS or max(1, (os.cpu_count() or 1) // workers)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    _master_pid = os.getpid()
+    # 冻结已有对象，避免worker中的垃圾回收改写对象头引发整页复制
+    gc.collect()
+    gc.freeze()
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app, sock, threads)
+            finally:
+                os._exit(0)
+        children.add(pid)
+        logger.info(f"worker {pid} 已启动（推理线程数 {threads}）")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logger.error(f"worker {pid} 异常退出(status={status})，正在重启")
+            spawn()
+
+    sock.close()
+    logger.info("所有worker已退出")
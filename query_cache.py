@@ -0,0 +1,134 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TRAILING_PUNCTUATION = '?？.。!！~～ '
+
+
+def normalize_query(text: str) -> str:
+    """规范化问题文本：全半角统一、大小写统一、合并空白并去掉句末标点"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+class QueryEmbeddingCache:
+    """问题向量缓存（LRU + TTL，线程安全）
+
+    进程内使用OrderedDict做LRU；backend为sqlite时额外写入本地sqlite文件，
+    使同一台机器上的多个worker进程共享缓存结果。
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600, backend: str = 'memory', sqlite_path: str = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self._db = None
+        if backend == 'sqlite':
+            self._open_sqlite(sqlite_path)
+        elif backend != 'memory':
+            raise ValueError(f"不支持的问题向量缓存后端: {backend}")
+        self.backend = backend
+
+    def _open_sqlite(self, sqlite_path: str):
+        directory = os.path.dirname(sqlite_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(sqlite_path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS query_embedding (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    def get(self, text: str):
+        """查询缓存，未命中或已过期时返回None"""
+        key = normalize_query(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector, expires_at FROM query_embedding WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+                if row:
+                    vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                    self._store_local(key, vector, row[1])
+                    self.hits += 1
+                    self.shared_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector):
+        """写入缓存"""
+        key = normalize_query(text)
+        expires_at = time.time() + self.ttl
+        vector = list(vector)
+        with self._lock:
+            self._store_local(key, vector, expires_at)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO query_embedding (key, vector, expires_at) VALUES (?, ?, ?)",
+                        (key, np.asarray(vector, dtype=np.float32).tobytes(), expires_at)
+                    )
+                    self._trim_sqlite()
+                except sqlite3.Error as e:
+                    logger.warning(f"写入共享问题向量缓存失败: {e}")
+
+    def _store_local(self, key: str, vector, expires_at: float):
+        self._entries[key] = (expires_at, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _trim_sqlite(self):
+        """清理过期条目，并按过期时间淘汰超出容量的部分"""
+        self._db.execute("DELETE FROM query_embedding WHERE expires_at <= ?", (time.time(),))
+        self._db.execute("""
+            DELETE FROM query_embedding WHERE key IN (
+                SELECT key FROM query_embedding ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_size,))
+
+    def stats(self) -> dict:
+        """缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": True,
+                "backend": self.backend,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0
+            }
@@ -1,13 +1,14 @@
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
-from config import RERANK_MODEL, DEVICE, MODEL_CACHE_DIR, RERANK_MAX_LENGTH, HF_ENDPOINT
+from config import RERANK_MODEL, DEVICE, MODEL_CACHE_DIR, RERANK_MAX_LENGTH, HF_ENDPOINT, RERANK_BATCH_SIZE
 
 
 class RerankModel:
     def __init__(self, model_name=None):
         if model_name is None:
             model_name = RERANK_MODEL
+        self.model_name = model_name
         self.tokenizer = AutoTokenizer.from_pretrained(
             model_name,
             cache_dir=MODEL_CACHE_DIR,
@@ -28,6 +29,12 @@ class RerankModel:
             mirror=HF_ENDPOINT if HF_ENDPOINT != 'https://huggingface.co' else None
         )
         self.model.eval()
+        
+        # 批量打分需要padding，序列分类模型依赖pad_token_id定位每条序列的末尾
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        if self.model.config.pad_token_id is None:
+            self.model.config.pad_token_id = self.tokenizer.pad_token_id
     
     def compute_score(self, query: str, passage: str):
         """计算query和passage的相关性分数"""
@@ -43,20 +50,105 @@ class RerankModel:
             score = torch.sigmoid(outputs.logits)[:, 1].item()
             return score
     
-    def rerank(self, query: str, docs: list):
-        """对文档进行重排序"""
-        scored_docs = []
-        for doc in docs:
-            score = self.compute_score(query, doc['content'])
-            scored_docs.append({
+    def tokenize_passages(self, passages: list):
+        """对passage分词（不加特殊token），结果可预先存入token存储"""
+        return self.tokenizer(
+            list(passages),
+            add_special_tokens=False,
+            truncation=True,
+            max_length=RERANK_MAX_LENGTH
+        )['input_ids']
+    
+    def _passage_ids(self, passages: list):
+        """读取passage的token ID，优先使用导入时预存的结果"""
+        from token_store import get_token_store
+        store = get_token_store('rerank', self.model_name, RERANK_MAX_LENGTH, self.tokenizer)
+        if store is None:
+            return self.tokenize_passages(passages)
+        return store.lookup_or_tokenize(passages, self.tokenize_passages)
+    
+    def _build_pairs(self, query: str, passage_ids: list):
+        """将query与已分词的passage拼装成模型输入，只截断passage"""
+        # 超长问题先截到一半长度，保证只截断passage时仍能放下
+        query_ids = self.tokenizer(query, add_special_tokens=False)['input_ids'][:RERANK_MAX_LENGTH // 2]
+        return [
+            self.tokenizer.prepare_for_model(
+                query_ids,
+                [int(t) for t in ids],
+                add_special_tokens=True,
+                truncation='only_second',
+                max_length=RERANK_MAX_LENGTH
+            ) for ids in passage_ids
+        ]
+    
+    def _score_pairs(self, pairs: list, batch_size=None):
+        """按长度排序后分成微批打分，每个微批只做一次padding后的前向计算"""
+        if batch_size is None:
+            batch_size = RERANK_BATCH_SIZE
+        scores = [0.0] * len(pairs)
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i]['input_ids']))
+        
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            inputs = self.tokenizer.pad(
+                [pairs[i] for i in bucket],
+                padding=True,
+                return_tensors="pt"
+            ).to(self.model.device)
+            with torch.no_grad():
+                outputs = self.model(**inputs)
+                batch_scores = torch.sigmoid(outputs.logits.float())[:, 1].cpu().tolist()
+            for i, score in zip(bucket, batch_scores):
+                scores[i] = score
+        
+        return scores
+    
+    def compute_scores(self, query: str, passages: list, batch_size=None):
+        """批量计算query与多个passage的相关性分数
+
+        query只分词一次，passage的token ID从token存储读取，直接拼装成 (query, passage)
+        对，只截断passage；按长度排序后分成微批，每个微批只做一次padding后的前向计算。
+        """
+        return self._score_pairs(self._build_pairs(query, self._passage_ids(passages)), batch_size)
+    
+    def compute_scores_many(self, queries: list, passages_list: list, batch_size=None):
+        """多个问题各自的候选passage合并成一个打分池，跨问题按长度分桶，返回每个问题的分数列表"""
+        all_passages = [p for passages in passages_list for p in passages]
+        all_ids = self._passage_ids(all_passages) if all_passages else []
+        pairs, bounds = [], []
+        for query, passages in zip(queries, passages_list):
+            start = len(pairs)
+            pairs.extend(self._build_pairs(query, all_ids[start:start + len(passages)]))
+            bounds.append((start, len(pairs)))
+        scores = self._score_pairs(pairs, batch_size)
+        return [scores[start:end] for start, end in bounds]
+    
+    @staticmethod
+    def _sort_scored(docs: list, scores: list):
+        scored_docs = [
+            {
                 'content': doc['content'],
                 'meta': doc['meta'],
                 'score': score
-            })
+            } for doc, score in zip(docs, scores)
+        ]
         
         # 按分数降序排列
         scored_docs.sort(key=lambda x: x['score'], reverse=True)
         return scored_docs
+    
+    def rerank(self, query: str, docs: list):
+        """对文档进行重排序"""
+        if not docs:
+            return []
+        return self._sort_scored(docs, self.compute_scores(query, [doc['content'] for doc in docs]))
+    
+    def rerank_many(self, queries: list, docs_list: list):
+        """对多个问题的候选文档一起打分后分别重排序"""
+        scores_list = self.compute_scores_many(
+            queries, [[doc['content'] for doc in docs] for docs in docs_list]
+        )
+        return [self._sort_scored(docs, scores) for docs, scores in zip(docs_list, scores_list)]
 
 # 全局模型实例
 _rerank_model = None
@@ -70,4 +162,17 @@ def get_rerank_model():
 def rerank(query: str, docs: list):
     """重排序文档"""
     model = get_rerank_model()
-    return model.rerank(query, docs) 
\ No newline at end of file
+    return model.rerank(query, docs)
+
+def rerank_many(queries: list, docs_list: list):
+    """批量重排序：所有问题的 (问题, 文档) 对共用微批"""
+    model = get_rerank_model()
+    return model.rerank_many(queries, docs_list)
+
+def pretokenize_passages(passages: list):
+    """导入时预先对分块分词并写入token存储，问答时重排序无需重复分词"""
+    from token_store import get_token_store
+    model = get_rerank_model()
+    store = get_token_store('rerank', model.model_name, RERANK_MAX_LENGTH, model.tokenizer)
+    if store is not None:
+        store.lookup_or_tokenize(list(passages), model.tokenize_passages)
@@ -13,7 +13,7 @@ import uvicorn
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
-from config import APP_HOST, APP_PORT, DEBUG
+from config import APP_HOST, APP_PORT, APP_WORKERS, DEBUG
 
 if __name__ == "__main__":
     print("🚀 启动企业RAG知识库应用...")
@@ -21,6 +21,13 @@ if __name__ == "__main__":
     print(f"📖 API文档: http://{APP_HOST}:{APP_PORT}/docs")
     print(f"🔧 调试模式: {'开启' if DEBUG else '关闭'}")
     
+    if APP_WORKERS > 1 and not DEBUG:
+        # 多进程模式：主进程预加载模型后fork出worker，权重写时复制共享
+        print(f"👥 worker进程数: {APP_WORKERS}")
+        from prefork import serve
+        serve(APP_HOST, APP_PORT, APP_WORKERS)
+        sys.exit(0)
+    
     uvicorn.run(
         "main:app",
         host=APP_HOST,
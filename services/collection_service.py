@@ -0,0 +1,67 @@
+import logging
+
+from fastapi import HTTPException
+from sqlalchemy import func
+
+from db import run_in_replica, create_collection, drop_collection
+from executors import run_in_stage
+from local_index import clear_local_index
+from models import Collection, Document, DEFAULT_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+class CollectionService:
+    """集合管理服务"""
+    
+    async def list_collections(self):
+        """获取集合列表及各集合的文档数"""
+        try:
+            return await run_in_replica(self._list_collections)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"获取集合列表失败: {e}")
+            raise HTTPException(status_code=500, detail="获取集合列表失败")
+    
+    def _list_collections(self, session):
+        counts = dict(session.query(Document.collection_id, func.count()).group_by(Document.collection_id).all())
+        collections = session.query(Collection).order_by(Collection.collection_id).all()
+        return {
+            "collections": [
+                {
+                    "collection_id": collection.collection_id,
+                    "description": collection.description,
+                    "document_count": counts.get(collection.collection_id, 0),
+                    "created_at": collection.created_at.isoformat() if collection.created_at else None
+                } for collection in collections
+            ]
+        }
+    
+    async def create_collection(self, collection_id: str, description: str = None):
+        """创建集合及其分区和索引"""
+        try:
+            created = await run_in_stage('db', create_collection, collection_id, description)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"创建集合失败: {e}")
+            raise HTTPException(status_code=500, detail="创建集合失败")
+        if not created:
+            raise HTTPException(status_code=409, detail=f"集合已存在: {collection_id}")
+        return {"message": f"成功创建集合 {collection_id}"}
+    
+    async def drop_collection(self, collection_id: str):
+        """删除集合：整体删除其分区表和本地索引"""
+        if collection_id == DEFAULT_COLLECTION:
+            raise HTTPException(status_code=400, detail="默认集合不能删除")
+        try:
+            deleted = await run_in_stage('db', drop_collection, collection_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"删除集合失败: {e}")
+            raise HTTPException(status_code=500, detail="删除集合失败")
+        if not deleted:
+            raise HTTPException(status_code=404, detail="集合不存在")
+        clear_local_index(collection_id)
+        return {"message": f"成功删除集合 {collection_id}"}
@@ -1,118 +1,178 @@
 import logging
+from datetime import datetime
 
 from fastapi import HTTPException
+from sqlalchemy import tuple_
 
-from db import SessionLocal
-from models import DocumentChunk
+from config import MAX_PAGE_OFFSET
+from db import run_in_session, run_in_replica
+from local_index import update_local_index, clear_local_index
+from models import Document, DocumentChunk, DEFAULT_COLLECTION
+from utils import like_pattern, encode_cursor, decode_cursor
 
 logger = logging.getLogger(__name__)
 
 class DocumentService:
     """文档管理服务"""
     
-    async def list_documents(self, skip: int = 0, limit: int = 100, search: str = None):
-        """获取文档列表，支持搜索"""
-        session = SessionLocal()
+    @staticmethod
+    def _check_offset(skip: int):
+        if skip > MAX_PAGE_OFFSET:
+            raise HTTPException(status_code=400, detail=f"skip不能超过{MAX_PAGE_OFFSET}，深分页请使用next_cursor")
+    
+    async def list_documents(self, skip: int = 0, limit: int = 100, search: str = None, cursor: str = None,
+                             collection_id: str = None):
+        """获取文档列表，支持搜索和按集合过滤；按创建时间倒序，传入上一页的next_cursor翻页"""
+        after = None
+        if cursor:
+            try:
+                values = decode_cursor(cursor)
+                after = (datetime.fromisoformat(values['created_at']), str(values['document_id']))
+            except (ValueError, KeyError, TypeError):
+                raise HTTPException(status_code=400, detail="无效的分页游标")
+        else:
+            self._check_offset(skip)
         try:
-            # 构建查询
-            query = session.query(
-                DocumentChunk.document_id,
-                DocumentChunk.document_name,
-                DocumentChunk.document_path,
-                DocumentChunk.created_at
-            ).distinct(DocumentChunk.document_id)
-            
-            # 添加搜索条件
-            if search:
-                query = query.filter(
-                    DocumentChunk.document_name.ilike(f'%{search}%')
-                )
-            
-            docs = query.offset(skip).limit(limit).all()
-            
-            # 获取每个文档的分块数量
-            result_docs = []
-            for doc in docs:
-                chunk_count = session.query(DocumentChunk).filter(
-                    DocumentChunk.document_id == doc.document_id
-                ).count()
-                
-                result_docs.append({
+            return await run_in_replica(self._list_documents, skip, limit, search, after, collection_id)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"获取文档列表失败: {e}")
+            raise HTTPException(status_code=500, detail="获取文档列表失败")
+    
+    def _list_documents(self, session, skip: int = 0, limit: int = 100, search: str = None, after=None,
+                        collection_id: str = None):
+        # 从文档清单读取，分块数由导入时维护，无需聚合分块表；等待回收的旧版本不列出
+        query = session.query(Document).filter(Document.status != 'retired')
+        if collection_id:
+            query = query.filter(Document.collection_id == collection_id)
+        
+        # 添加搜索条件
+        if search:
+            query = query.filter(
+                Document.document_name.ilike(like_pattern(search), escape='\\')
+            )
+        
+        # (created_at, document_id) 复合索引上的键集分页，翻页代价与页码无关
+        if after:
+            query = query.filter(tuple_(Document.created_at, Document.document_id) < after)
+        else:
+            query = query.offset(skip)
+        docs = query.order_by(Document.created_at.desc(), Document.document_id.desc()).limit(limit + 1).all()
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        
+        return {
+            "documents": [
+                {
+                    "collection_id": doc.collection_id,
                     "document_id": doc.document_id,
                     "document_name": doc.document_name,
                     "document_path": doc.document_path,
                     "created_at": doc.created_at.isoformat(),
-                    "chunk_count": chunk_count
-                })
-            
-            return {"documents": result_docs}
-        except Exception as e:
-            logger.error(f"获取文档列表失败: {e}")
-            raise HTTPException(status_code=500, detail="获取文档列表失败")
-        finally:
-            session.close()
+                    "chunk_count": doc.chunk_count,
+                    "status": doc.status,
+                    "version": doc.version
+                } for doc in docs
+            ],
+            "next_cursor": encode_cursor({
+                "created_at": docs[-1].created_at.isoformat(), "document_id": docs[-1].document_id
+            }) if has_more else None
+        }
+    
+    async def delete_document(self, document_id: str, collection_id: str = DEFAULT_COLLECTION):
+        """删除集合中指定文档的所有分块"""
+        return await run_in_session(self._delete_document, document_id, collection_id)
     
-    async def delete_document(self, document_id: str):
-        """删除指定文档的所有分块"""
-        session = SessionLocal()
+    def _delete_document(self, session, document_id: str, collection_id: str = DEFAULT_COLLECTION):
         try:
-            deleted_count = session.query(DocumentChunk).filter(
+            chunks = session.query(DocumentChunk.id).filter(
+                DocumentChunk.collection_id == collection_id,
                 DocumentChunk.document_id == document_id
+            )
+            chunk_ids = [row.id for row in chunks]
+            deleted_count = chunks.delete()
+            manifest_count = session.query(Document).filter(
+                Document.collection_id == collection_id,
+                Document.document_id == document_id
             ).delete()
             session.commit()
             
-            if deleted_count == 0:
+            if deleted_count == 0 and manifest_count == 0:
                 raise HTTPException(status_code=404, detail="文档不存在")
+            update_local_index(collection_id, removed_ids=chunk_ids)
             
             return {"message": f"成功删除文档，共删除 {deleted_count} 个分块"}
         except Exception as e:
             logger.error(f"删除文档失败: {e}")
             session.rollback()
             raise HTTPException(status_code=500, detail="删除文档失败")
-        finally:
-            session.close()
     
-    async def get_document_chunks(self, document_id: str, skip: int = 0, limit: int = 50):
-        """获取指定文档的所有分块"""
-        session = SessionLocal()
+    async def get_document_chunks(self, document_id: str, skip: int = 0, limit: int = 50, cursor: str = None,
+                                  collection_id: str = DEFAULT_COLLECTION):
+        """获取指定文档的分块，按分块序号排列，传入上一页的next_cursor翻页"""
+        after = None
+        if cursor:
+            try:
+                after = int(decode_cursor(cursor)['chunk_index'])
+            except (ValueError, KeyError, TypeError):
+                raise HTTPException(status_code=400, detail="无效的分页游标")
+        else:
+            self._check_offset(skip)
         try:
-            chunks = session.query(DocumentChunk).filter(
-                DocumentChunk.document_id == document_id
-            ).order_by(DocumentChunk.chunk_index).offset(skip).limit(limit).all()
-            
-            if not chunks:
-                raise HTTPException(status_code=404, detail="文档不存在")
-            
-            return {
-                "document_id": document_id,
-                "chunks": [
-                    {
-                        "id": chunk.id,
-                        "chunk_index": chunk.chunk_index,
-                        "content": chunk.content,
-                        "page_num": chunk.page_num,
-                        "paragraph_num": chunk.paragraph_num,
-                        "created_at": chunk.created_at.isoformat()
-                    } for chunk in chunks
-                ]
-            }
+            return await run_in_replica(self._get_document_chunks, document_id, skip, limit, after, collection_id)
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"获取文档分块失败: {e}")
             raise HTTPException(status_code=500, detail="获取文档分块失败")
-        finally:
-            session.close()
+    
+    def _get_document_chunks(self, session, document_id: str, skip: int = 0, limit: int = 50, after: int = None,
+                             collection_id: str = DEFAULT_COLLECTION):
+        # (document_id, chunk_index) 复合索引上的键集分页，只扫描该集合的分区
+        query = session.query(DocumentChunk).filter(
+            DocumentChunk.collection_id == collection_id,
+            DocumentChunk.document_id == document_id
+        )
+        if after is not None:
+            query = query.filter(DocumentChunk.chunk_index > after)
+        else:
+            query = query.offset(skip)
+        chunks = query.order_by(DocumentChunk.chunk_index).limit(limit + 1).all()
+        has_more = len(chunks) > limit
+        chunks = chunks[:limit]
+        
+        if not chunks and after is None and skip == 0:
+            raise HTTPException(status_code=404, detail="文档不存在")
+        
+        return {
+            "document_id": document_id,
+            "chunks": [
+                {
+                    "id": chunk.id,
+                    "chunk_index": chunk.chunk_index,
+                    "content": chunk.content,
+                    "page_num": chunk.page_num,
+                    "paragraph_num": chunk.paragraph_num,
+                    "created_at": chunk.created_at.isoformat()
+                } for chunk in chunks
+            ],
+            "next_cursor": encode_cursor({"chunk_index": chunks[-1].chunk_index}) if has_more else None
+        }
     
     async def clear_all_documents(self):
         """清空所有文档（危险操作）"""
-        session = SessionLocal()
+        return await run_in_session(self._clear_all_documents)
+    
+    def _clear_all_documents(self, session):
         try:
             deleted_count = session.query(DocumentChunk).delete()
+            session.query(Document).delete()
             session.commit()
+            clear_local_index()
             
             return {"message": f"成功清空所有文档，共删除 {deleted_count} 个分块"}
         except Exception as e:
             logger.error(f"清空文档失败: {e}")
             session.rollback()
             raise HTTPException(status_code=500, detail="清空文档失败")
-        finally:
-            session.close()
\ No newline at end of file
@@ -3,114 +3,171 @@ import os
 
 from fastapi import HTTPException, BackgroundTasks
 
-from config import MAX_FILE_SIZE_MB
-from db import SessionLocal
-from document_loader import parse_directory, parse_document, generate_document_id
-from embedding import get_embedding
-from models import DocumentChunk
+from bulk_writer import ChunkCopyWriter
+from config import MAX_FILE_SIZE_MB, HNSW_DEFER_THRESHOLD
+from db import (
+    SessionLocal, create_collection, validate_collection_id, drop_vector_index, rebuild_vector_index,
+    collect_retired_versions
+)
+from document_loader import parse_directory, parse_document, generate_document_id, file_fingerprint
+from embedding import get_embeddings
+from local_index import rebuild_local_index
+from models import Document, DocumentChunk, DEFAULT_COLLECTION
+from rerank import pretokenize_passages
 
 logger = logging.getLogger(__name__)
 
 class ImportService:
     """文档导入服务"""
     
-    async def import_directory(self, directory: str, background_tasks: BackgroundTasks):
-        """导入目录"""
+    @staticmethod
+    def _check_collection_id(collection_id: str):
+        try:
+            validate_collection_id(collection_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    async def import_directory(self, directory: str, background_tasks: BackgroundTasks, defer_index: bool = None,
+                               collection_id: str = DEFAULT_COLLECTION):
+        """导入目录到指定集合，集合不存在时自动创建"""
         if not os.path.exists(directory):
             raise HTTPException(status_code=400, detail=f"目录不存在: {directory}")
         
         if not os.path.isdir(directory):
             raise HTTPException(status_code=400, detail=f"路径不是目录: {directory}")
         
+        self._check_collection_id(collection_id)
+        
         # 异步处理导入任务
-        background_tasks.add_task(self._process_import, directory)
+        background_tasks.add_task(self._process_import, directory, defer_index, collection_id)
         
         return {
             "success": True,
-            "message": f"开始导入目录: {directory}，处理将在后台进行",
+            "message": f"开始导入目录: {directory} 到集合 {collection_id}，处理将在后台进行",
             "total_chunks": 0,
             "processed_files": 0,
             "failed_files": 0
         }
     
-    async def sync_directory(self, directory: str, background_tasks: BackgroundTasks):
-        """增量同步目录"""
+    async def rebuild_index(self, background_tasks: BackgroundTasks, collection_id: str = None):
+        """按当前HNSW配置在后台重建向量索引（未指定集合时重建全部集合），启用本地索引时一并重建"""
+        background_tasks.add_task(rebuild_vector_index, collection_id)
+        background_tasks.add_task(rebuild_local_index, collection_id)
+        return {
+            "success": True,
+            "message": f"开始重建{f'集合 {collection_id} 的' if collection_id else '全部集合的'}向量索引，"
+                       f"处理将在后台进行，期间相应集合的向量检索退化为顺序扫描"
+        }
+    
+    async def sync_directory(self, directory: str, background_tasks: BackgroundTasks, collection_id: str = DEFAULT_COLLECTION):
+        """增量同步目录到指定集合"""
         if not os.path.exists(directory):
             raise HTTPException(status_code=400, detail=f"目录不存在: {directory}")
         
-        background_tasks.add_task(self._process_sync, directory)
+        self._check_collection_id(collection_id)
+        background_tasks.add_task(self._process_sync, directory, collection_id)
         
         return {
             "success": True,
             "message": f"开始增量同步目录: {directory}，处理将在后台进行"
         }
     
-    def _process_import(self, directory: str):
-        """后台处理导入任务"""
+    @staticmethod
+    def _document_batches(chunks: list, batch_size: int):
+        """按文档分组后把相邻文档合并成向量化批次，每批至少 batch_size 个分块，文档不跨批拆开"""
+        documents = {}
+        for chunk in chunks:
+            documents.setdefault(chunk['meta']['document_id'], []).append(chunk)
+        batch, count = [], 0
+        for document_chunks in documents.values():
+            batch.append(document_chunks)
+            count += len(document_chunks)
+            if count >= batch_size:
+                yield batch
+                batch, count = [], 0
+        if batch:
+            yield batch
+    
+    @staticmethod
+    def _embed_documents(documents: list):
+        """整批向量化多个文档的分块，返回 [(分块列表, 向量数组)]"""
+        texts = [chunk['content'] for document_chunks in documents for chunk in document_chunks]
+        embeddings = get_embeddings(texts)
+        pretokenize_passages(texts)
+        result, start = [], 0
+        for document_chunks in documents:
+            result.append((document_chunks, embeddings[start:start + len(document_chunks)]))
+            start += len(document_chunks)
+        return result
+    
+    def _process_import(self, directory: str, defer_index: bool = None, collection_id: str = DEFAULT_COLLECTION):
+        """后台处理导入任务
+        
+        defer_index 为True（或未指定且分块数超过 HNSW_DEFER_THRESHOLD）时先删除该集合的向量索引，
+        全部写入后再一次性重建，避免逐行维护HNSW图；其他集合的索引和检索不受影响。
+        """
         session = None
+        index_dropped = False
         try:
+            create_collection(collection_id)
             session = SessionLocal()
-            logger.info(f"开始处理目录: {directory}")
+            logger.info(f"开始处理目录: {directory} (集合 {collection_id})")
             chunks = parse_directory(directory)
             
+            if defer_index is None:
+                defer_index = len(chunks) > HNSW_DEFER_THRESHOLD
+            if defer_index and chunks:
+                drop_vector_index(collection_id)
+                index_dropped = True
+            
             # 应用批量大小限制
             from config import MAX_BATCH_SIZE
             from config import CHUNKS_PER_FILE_ESTIMATE
             if len(chunks) > MAX_BATCH_SIZE * CHUNKS_PER_FILE_ESTIMATE:
                 logger.warning(f"分块数量过多 ({len(chunks)})，建议分批处理")
             
-            processed_files = 0
-            failed_files = 0
+            failed_chunks = 0
             
-            for chunk in chunks:
-                try:
-                    # 检查是否已存在相同的文档块
-                    existing = session.query(DocumentChunk).filter(
-                        DocumentChunk.document_id == chunk['meta']['document_id'],
-                        DocumentChunk.chunk_index == chunk['chunk_index']
-                    ).first()
-                    
-                    if existing:
-                        logger.info(f"跳过已存在的文档块: {chunk['meta']['document_name']} - {chunk['chunk_index']}")
-                        continue
-                    
-                    embedding = get_embedding(chunk['content'])
-                    doc = DocumentChunk(
-                        document_id=chunk['meta']['document_id'],
-                        version=1,
-                        document_name=chunk['meta']['document_name'],
-                        document_path=chunk['meta']['document_path'],
-                        page_num=chunk['meta'].get('page_num'),
-                        paragraph_num=chunk['meta'].get('paragraph_num'),
-                        chunk_index=chunk['chunk_index'],
-                        content=chunk['content'],
-                        embedding=embedding,
-                        extra_metadata=chunk['meta']
-                    )
-                    session.add(doc)
-                    processed_files += 1
-                    
-                    # 批量提交，提高性能
-                    from config import BATCH_COMMIT_SIZE
-                    if processed_files % BATCH_COMMIT_SIZE == 0:
-                        session.commit()
-                        logger.info(f"已处理 {processed_files} 个文档块")
-                        
-                except Exception as e:
-                    logger.error(f"处理文档块失败: {e}")
-                    failed_files += 1
+            from config import EMBEDDING_BATCH_SIZE
+            with ChunkCopyWriter(collection_id) as writer:
+                for batch in self._document_batches(chunks, EMBEDDING_BATCH_SIZE):
                     try:
-                        session.rollback()
-                    except Exception as rollback_error:
-                        logger.error(f"回滚失败: {rollback_error}")
+                        # 一次查询取出本批文档已存在的分块，跳过重复导入
+                        existing = set(session.query(DocumentChunk.document_id, DocumentChunk.chunk_index).filter(
+                            DocumentChunk.collection_id == collection_id,
+                            DocumentChunk.document_id.in_([document_chunks[0]['meta']['document_id'] for document_chunks in batch])
+                        ).all())
+                        session.rollback()  # 结束只读事务，向量化期间不占用连接
+                        pending = []
+                        for document_chunks in batch:
+                            new_chunks = [
+                                chunk for chunk in document_chunks
+                                if (chunk['meta']['document_id'], chunk['chunk_index']) not in existing
+                            ]
+                            if len(new_chunks) < len(document_chunks):
+                                logger.info(f"跳过已存在的文档块: {document_chunks[0]['meta']['document_name']} "
+                                            f"({len(document_chunks) - len(new_chunks)} 个)")
+                            if new_chunks:
+                                pending.append(new_chunks)
+                        
+                        if not pending:
+                            continue
+                        
+                        # 多个文档合并向量化，减少逐条前向计算的开销；写入仍以文档为事务单位
+                        for document_chunks, embeddings in self._embed_documents(pending):
+                            writer.add_document(document_chunks, embeddings)
+                        logger.info(f"已向量化 {sum(len(document_chunks) for document_chunks in pending)} 个文档块")
+                    
+                    except Exception as e:
+                        logger.error(f"处理文档块失败: {e}")
+                        failed_chunks += sum(len(document_chunks) for document_chunks in batch)
+                        try:
+                            session.rollback()
+                        except Exception as rollback_error:
+                            logger.error(f"回滚失败: {rollback_error}")
             
-            # 最终提交
-            try:
-                session.commit()
-                logger.info(f"导入完成: 成功 {processed_files} 个，失败 {failed_files} 个")
-            except Exception as commit_error:
-                logger.error(f"最终提交失败: {commit_error}")
-                session.rollback()
+            logger.info(f"导入完成: 成功 {writer.chunks} 个分块（{writer.documents} 个文档），"
+                        f"失败 {failed_chunks} 个分块、{writer.failed_documents} 个文档")
             
         except Exception as e:
             logger.error(f"导入过程出错: {e}")
@@ -125,19 +182,31 @@ class ImportService:
                     session.close()
                 except Exception as close_error:
                     logger.error(f"关闭数据库连接失败: {close_error}")
+            if index_dropped:
+                try:
+                    rebuild_vector_index(collection_id)
+                except Exception as index_error:
+                    logger.error(f"重建向量索引失败: {index_error}")
     
-    def _process_sync(self, directory: str):
+    def _process_sync(self, directory: str, collection_id: str = DEFAULT_COLLECTION):
         """后台处理增量同步"""
         session = None
         try:
+            create_collection(collection_id)
             session = SessionLocal()
-            logger.info(f"开始增量同步目录: {directory}")
+            logger.info(f"开始增量同步目录: {directory} (集合 {collection_id})")
             
-            # 获取现有文档的信息
-            existing_docs = {}
-            docs_in_db = session.query(DocumentChunk.document_path, DocumentChunk.document_id).distinct().all()
-            for doc in docs_in_db:
-                existing_docs[doc.document_path] = doc.document_id
+            # 从文档清单获取现有文档的信息
+            existing_docs = {
+                doc.document_path: doc for doc in
+                session.query(
+                    Document.document_path, Document.document_id, Document.status, Document.version,
+                    Document.content_hash, Document.file_size, Document.mtime
+                ).filter(
+                    Document.collection_id == collection_id, Document.status != 'retired'
+                )
+            }
+            touched = []
             
             # 扫描目录中的文件
             new_files = []
@@ -160,22 +229,41 @@ class ImportService:
                             continue
                         
                         if file_path in existing_docs:
-                            # 检查文件是否被修改
-                            current_id = generate_document_id(file_path)
-                            if current_id != existing_docs[file_path]:
+                            # 按内容摘要判断文件是否被修改，上次写入失败的文档重新处理
+                            existing = existing_docs[file_path]
+                            if existing.status != 'ready':
                                 updated_files.append(file_path)
+                            elif existing.content_hash is None:
+                                # 清单由历史分块回填、没有内容摘要时退回按文档ID比较
+                                if generate_document_id(file_path) != existing.document_id:
+                                    updated_files.append(file_path)
+                            else:
+                                try:
+                                    stat = os.stat(file_path)
+                                    if stat.st_size == existing.file_size and stat.st_mtime == existing.mtime:
+                                        continue
+                                    fingerprint = file_fingerprint(file_path)
+                                except OSError as e:
+                                    logger.error(f"无法读取文件: {file} - {e}")
+                                    continue
+                                if fingerprint['content_hash'] != existing.content_hash:
+                                    updated_files.append(file_path)
+                                else:
+                                    # 只有修改时间变化（touch、保留内容的复制），更新清单即可，不重新向量化
+                                    touched.append({**fingerprint, "document_id": existing.document_id})
                         else:
                             new_files.append(file_path)
             
-            logger.info(f"发现 {len(new_files)} 个新文件，{len(updated_files)} 个更新文件")
+            if touched:
+                session.bulk_update_mappings(Document, [
+                    {"collection_id": collection_id, "document_id": item["document_id"],
+                     "file_size": item["file_size"], "mtime": item["mtime"]}
+                    for item in touched
+                ])
+                session.commit()
             
-            # 处理更新的文件（先删除旧版本）
-            for file_path in updated_files:
-                old_doc_id = existing_docs[file_path]
-                session.query(DocumentChunk).filter(
-                    DocumentChunk.document_id == old_doc_id
-                ).delete()
-                logger.info(f"删除旧版本文档: {file_path}")
+            logger.info(f"发现 {len(new_files)} 个新文件，{len(updated_files)} 个更新文件，"
+                        f"{len(touched)} 个文件仅修改时间变化")
             
             # 处理新文件和更新文件
             all_files_to_process = new_files + updated_files
@@ -185,40 +273,35 @@ class ImportService:
             if len(all_files_to_process) > MAX_BATCH_SIZE:
                 logger.warning(f"文件数量 ({len(all_files_to_process)}) 超过批量限制 ({MAX_BATCH_SIZE})，将只处理前 {MAX_BATCH_SIZE} 个文件")
                 all_files_to_process = all_files_to_process[:MAX_BATCH_SIZE]
+            session.close()
+            session = None
             
             processed = 0
             
-            for file_path in all_files_to_process:
-                try:
-                    chunks = parse_document(file_path)
-                    
-                    for chunk in chunks:
-                        embedding = get_embedding(chunk['content'])
-                        doc = DocumentChunk(
-                            document_id=chunk['meta']['document_id'],
-                            version=1,
-                            document_name=chunk['meta']['document_name'],
-                            document_path=chunk['meta']['document_path'],
-                            page_num=chunk['meta'].get('page_num'),
-                            paragraph_num=chunk['meta'].get('paragraph_num'),
-                            chunk_index=chunk['chunk_index'],
-                            content=chunk['content'],
-                            embedding=embedding,
-                            extra_metadata=chunk['meta']
+            # 新版本写入与旧版本切换在同一事务中提交，解析或写入失败时旧版本保持可见
+            with ChunkCopyWriter(collection_id) as writer:
+                for file_path in all_files_to_process:
+                    try:
+                        chunks = parse_document(file_path)
+                        texts = [chunk['content'] for chunk in chunks]
+                        embeddings = get_embeddings(texts)
+                        pretokenize_passages(texts)
+                        existing = existing_docs.get(file_path)
+                        writer.add_document(
+                            chunks, embeddings,
+                            replace_document_id=existing.document_id if existing else None,
+                            version=existing.version + 1 if existing and existing.status == 'ready' else 1
                         )
-                        session.add(doc)
-                    
-                    processed += 1
-                    from config import BATCH_COMMIT_SIZE
-                    if processed % BATCH_COMMIT_SIZE == 0:
-                        session.commit()
+                        processed += 1
                         logger.info(f"已同步 {processed}/{len(all_files_to_process)} 个文件")
-                        
-                except Exception as e:
-                    logger.error(f"同步文件失败 {file_path}: {e}")
+                    except Exception as e:
+                        logger.error(f"同步文件失败 {file_path}: {e}")
+            
+            logger.info(f"增量同步完成: 处理了 {processed} 个文件，写入 {writer.chunks} 个分块，"
+                        f"写入失败 {writer.failed_documents} 个文件")
             
-            session.commit()
-            logger.info(f"增量同步完成: 处理了 {processed} 个文件")
+            # 切换后回收旧版本分块，分批删除不阻塞检索
+            collect_retired_versions()
             
         except Exception as e:
             logger.error(f"增量同步出错: {e}")
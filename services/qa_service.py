@@ -1,95 +1,226 @@
+import asyncio
+import json
 import logging
+import time
+import uuid
+from decimal import Decimal
 
-from fastapi import HTTPException
+from fastapi import HTTPException, BackgroundTasks
+from pgvector.sqlalchemy import HALFVEC, Vector
+from sqlalchemy import Numeric, and_, cast, func, or_, text, tuple_
+from sqlalchemy.dialects.postgresql import BIT
 
-from config import TOP_K, TOP_N, HISTORY_ROUNDS, CONTENT_PREVIEW_LENGTH, SEARCH_CONTENT_PREVIEW_LENGTH
-from db import SessionLocal
-from embedding import get_embedding
-from llm import generate_answer
-from models import DocumentChunk
-from rerank import rerank
-from utils import timer
+from config import (
+    TOP_K, TOP_N, HISTORY_ROUNDS, CONTENT_PREVIEW_LENGTH, SEARCH_CONTENT_PREVIEW_LENGTH,
+    QA_BATCH_CHUNK_SIZE, QA_BATCH_JOB_RETAIN, RETRIEVAL_MODE, LEXICAL_TOP_K, RRF_K, HNSW_EF_SEARCH,
+    VECTOR_STORAGE_MODE, VECTOR_OVERSAMPLE
+)
+from db import run_in_session, run_in_replica
+from embedding import get_query_embedding, get_query_embeddings
+from executors import run_in_stage, iterate_in_stage
+from lexical import lexical_query
+from local_index import get_local_index, search_local_indexes
+from llm import generate_answer, generate_answers, stream_answer
+from models import BatchJob, DocumentChunk, EMBEDDING_DIM, active_chunks
+from prompts import QA_INSTRUCTION
+from rerank import rerank, rerank_many
+from utils import timer, like_pattern, encode_cursor, decode_cursor
 
 logger = logging.getLogger(__name__)
 
+def _sse(event: str, data: dict) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 class QAService:
     """问答服务"""
     
-    @timer
-    async def answer_question(self, request):
-        """回答单个问题"""
-        session = SessionLocal()
-        try:
-            # 1. 查询向量
-            q_emb = get_embedding(request.question)
-            
-            # 2. 检索Top-K (使用余弦相似度)
-            docs_with_distance = session.query(
-                DocumentChunk,
-                DocumentChunk.embedding.cosine_distance(q_emb).label('distance')
-            ).order_by(
-                DocumentChunk.embedding.cosine_distance(q_emb)
-            ).limit(TOP_K).all()
-            
-            if not docs_with_distance:
-                return {"answer": "未找到相关信息", "sources": []}
-            
-            # 3. 重排序
-            doc_list = [
-                {
-                    'content': doc.content, 
-                    'meta': {
-                        'document_name': doc.document_name,
-                        'page_num': doc.page_num,
-                        'paragraph_num': doc.paragraph_num,
-                        'distance': float(distance)
-                    }
-                } for doc, distance in docs_with_distance
-            ]
-            reranked = rerank(request.question, doc_list)[:TOP_N]
-            
-            # 4. 构造Prompt
-            history_lines = []
-            if request.history:
-                from config import MAX_HISTORY_TOKENS
-                current_tokens = 0
-                
-                # 从最新的对话开始，逐步添加历史对话，直到达到token限制
-                for turn in reversed(request.history[-HISTORY_ROUNDS:]):
-                    if len(turn) >= 2:
-                        user, assistant = turn[0], turn[1]
-                        turn_text = f"用户：{user}\n助手：{assistant}"
-                        
-                        # 简单估算token数（中文约1.5字符/token，英文约4字符/token）
-                        from config import TOKEN_ESTIMATE_RATIO
-                        estimated_tokens = int(len(turn_text) / TOKEN_ESTIMATE_RATIO)
-                        
-                        if current_tokens + estimated_tokens > MAX_HISTORY_TOKENS:
-                            break
-                        
-                        history_lines.insert(0, f"用户：{user}")
-                        history_lines.insert(1, f"助手：{assistant}")
-                        current_tokens += estimated_tokens
-                        
-            history_str = '\n'.join(history_lines)
-            
-            context_str = ''
-            sources = []
-            for idx, doc in enumerate(reranked, 1):
-                meta = doc['meta']
-                context_str += f"{idx}. {doc['content']}\n   出处：{meta.get('document_name','')}，页码：{meta.get('page_num','')}，段落：{meta.get('paragraph_num','')}\n"
-                sources.append({
-                    'document_name': meta.get('document_name', ''),
-                    'page_num': meta.get('page_num'),
-                    'paragraph_num': meta.get('paragraph_num'),
-                    'content': doc['content'][:CONTENT_PREVIEW_LENGTH] + '...' if len(doc['content']) > CONTENT_PREVIEW_LENGTH else doc['content'],
-                    'score': doc.get('score', 0),
-                    'distance': meta.get('distance', 0)
-                })
+    @staticmethod
+    def _quantized_distance(q_emb, storage: str):
+        """量化索引上的距离表达式，需与db.VECTOR_INDEXES中的索引表达式一致才能走索引"""
+        q_vec = cast(q_emb, Vector(EMBEDDING_DIM))
+        if storage == 'halfvec':
+            return cast(DocumentChunk.embedding, HALFVEC(EMBEDDING_DIM)).op('<=>')(cast(q_vec, HALFVEC(EMBEDDING_DIM)))
+        return cast(func.binary_quantize(DocumentChunk.embedding), BIT(EMBEDDING_DIM)).op('<~>')(
+            func.binary_quantize(q_vec)
+        )
+    
+    @staticmethod
+    def _scope(query, collections: list = None):
+        """限定检索范围：排除已被新版本替换的旧版本分块；按分区键限定集合，
+        查询只扫描这些集合的分区及其索引，未指定时检索全部集合"""
+        query = query.filter(active_chunks())
+        if collections:
+            query = query.filter(DocumentChunk.collection_id.in_(collections))
+        return query
+    
+    def _retrieve(self, session, q_emb, ef_search: int = None, storage: str = None, oversample: int = None,
+                  collections: list = None):
+        """检索Top-K (使用余弦相似度)，返回待重排序的文档列表
+        
+        ef_search 为本次查询的HNSW候选列表大小，只在当前事务内生效，且不小于召回数。
+        collections 限定检索的集合，多个分区的HNSW索引扫描结果按距离归并。
+        halfvec/binary 存储模式下先在量化索引上召回 TOP_K*VECTOR_OVERSAMPLE 个候选，
+        再按全精度余弦距离重打分取Top-K。
+        """
+        storage = storage or VECTOR_STORAGE_MODE
+        candidates = TOP_K if storage == 'full' else TOP_K * (oversample or VECTOR_OVERSAMPLE)
+        session.execute(
+            text("SELECT set_config('hnsw.ef_search', :ef, true)"),
+            {"ef": str(max(ef_search or HNSW_EF_SEARCH, candidates))}
+        )
+        distance = DocumentChunk.embedding.cosine_distance(q_emb)
+        query = self._scope(session.query(DocumentChunk, distance.label('distance')), collections)
+        if storage != 'full':
+            candidate_ids = self._scope(
+                session.query(DocumentChunk.collection_id, DocumentChunk.id), collections
+            ).order_by(self._quantized_distance(q_emb, storage)).limit(candidates).subquery()
+            query = query.join(candidate_ids, and_(
+                DocumentChunk.collection_id == candidate_ids.c.collection_id,
+                DocumentChunk.id == candidate_ids.c.id
+            ))
+        docs_with_distance = query.order_by(distance).limit(TOP_K).all()
+        
+        return [
+            {
+                'content': doc.content, 
+                'meta': {
+                    'chunk_id': doc.id,
+                    'collection_id': doc.collection_id,
+                    'document_name': doc.document_name,
+                    'page_num': doc.page_num,
+                    'paragraph_num': doc.paragraph_num,
+                    'distance': float(distance)
+                }
+            } for doc, distance in docs_with_distance
+        ]
+    
+    def _fetch_chunks(self, session, hits: list):
+        """按本地索引命中的 (集合ID, chunk_id, distance) 按主键取回分块，保持索引给出的顺序"""
+        if not hits:
+            return []
+        docs = {
+            doc.id: doc for doc in
+            session.query(DocumentChunk).filter(
+                tuple_(DocumentChunk.collection_id, DocumentChunk.id).in_([(c, chunk_id) for c, chunk_id, _ in hits]),
+                active_chunks()
+            ).all()
+        }
+        return [
+            {
+                'content': docs[chunk_id].content,
+                'meta': {
+                    'chunk_id': chunk_id,
+                    'collection_id': collection_id,
+                    'document_name': docs[chunk_id].document_name,
+                    'page_num': docs[chunk_id].page_num,
+                    'paragraph_num': docs[chunk_id].paragraph_num,
+                    'distance': distance
+                }
+            } for collection_id, chunk_id, distance in hits if chunk_id in docs
+        ]
+    
+    async def _retrieve_vector(self, q_emb, ef_search: int = None, collections: list = None):
+        """向量召回：启用本地索引时在各集合的进程内索引检索后按主键回表，否则走数据库HNSW索引"""
+        if get_local_index() is not None:
+            hits = await run_in_stage('db', search_local_indexes, q_emb, TOP_K, collections)
+            return await run_in_replica(self._fetch_chunks, hits)
+        return await run_in_replica(self._retrieve, q_emb, ef_search, collections=collections)
+    
+    def _retrieve_lexical(self, session, question: str, collections: list = None):
+        """全文检索Top-K：按问题词项在GIN索引上匹配，ts_rank_cd按文档长度归一化排序"""
+        query_str = lexical_query(question)
+        if not query_str:
+            return []
+        ts_query = func.to_tsquery('simple', query_str)
+        rank = func.ts_rank_cd(DocumentChunk.content_tsv, ts_query, 1).label('rank')
+        docs_with_rank = self._scope(session.query(DocumentChunk, rank), collections).filter(
+            DocumentChunk.content_tsv.op('@@')(ts_query)
+        ).order_by(rank.desc()).limit(LEXICAL_TOP_K).all()
+        
+        return [
+            {
+                'content': doc.content,
+                'meta': {
+                    'chunk_id': doc.id,
+                    'collection_id': doc.collection_id,
+                    'document_name': doc.document_name,
+                    'page_num': doc.page_num,
+                    'paragraph_num': doc.paragraph_num,
+                    'lexical_rank': float(rank)
+                }
+            } for doc, rank in docs_with_rank
+        ]
+    
+    @staticmethod
+    def _fuse(ranked_lists: list, limit: int):
+        """RRF融合多路召回结果：得分为各路 1/(RRF_K+名次) 之和"""
+        scores, docs = {}, {}
+        for ranked in ranked_lists:
+            for position, doc in enumerate(ranked, 1):
+                key = doc['meta']['chunk_id']
+                scores[key] = scores.get(key, 0) + 1 / (RRF_K + position)
+                docs.setdefault(key, doc)
+        order = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return [
+            {**docs[key], 'meta': {**docs[key]['meta'], 'rrf_score': round(scores[key], 6)}}
+            for key in order
+        ]
+    
+    async def _search(self, question: str, q_emb, mode: str, ef_search: int = None, collections: list = None):
+        """按检索模式在指定集合中召回候选文档：vector、lexical，或两路并行后RRF融合"""
+        if mode == 'vector':
+            return await self._retrieve_vector(q_emb, ef_search, collections)
+        if mode == 'lexical':
+            return await run_in_replica(self._retrieve_lexical, question, collections)
+        vector_docs, lexical_docs = await asyncio.gather(
+            self._retrieve_vector(q_emb, ef_search, collections),
+            run_in_replica(self._retrieve_lexical, question, collections)
+        )
+        return self._fuse([vector_docs, lexical_docs], TOP_K)
+    
+    def _build_prompt(self, request, reranked):
+        """根据重排序结果和对话历史构造Prompt，返回 (prompt, sources)"""
+        # 4. 构造Prompt
+        history_lines = []
+        if request.history:
+            from config import MAX_HISTORY_TOKENS
+            current_tokens = 0
             
-            prompt = f"""你是企业知识库智能助手，请严格根据下列资料内容回答用户问题。
-如资料中未提及，请回复"未找到相关信息"，不要编造答案。
-如有多条信息请用分点或表格展示，答案后请注明引用的资料出处（如文档名、页码、段落号）。
+            # 从最新的对话开始，逐步添加历史对话，直到达到token限制
+            for turn in reversed(request.history[-HISTORY_ROUNDS:]):
+                if len(turn) >= 2:
+                    user, assistant = turn[0], turn[1]
+                    turn_text = f"用户：{user}\n助手：{assistant}"
+                    
+                    # 简单估算token数（中文约1.5字符/token，英文约4字符/token）
+                    from config import TOKEN_ESTIMATE_RATIO
+                    estimated_tokens = int(len(turn_text) / TOKEN_ESTIMATE_RATIO)
+                    
+                    if current_tokens + estimated_tokens > MAX_HISTORY_TOKENS:
+                        break
+                    
+                    history_lines.insert(0, f"用户：{user}")
+                    history_lines.insert(1, f"助手：{assistant}")
+                    current_tokens += estimated_tokens
+                    
+        history_str = '\n'.join(history_lines)
+        
+        context_str = ''
+        sources = []
+        for idx, doc in enumerate(reranked, 1):
+            meta = doc['meta']
+            context_str += f"{idx}. {doc['content']}\n   出处：{meta.get('document_name','')}，页码：{meta.get('page_num','')}，段落：{meta.get('paragraph_num','')}\n"
+            sources.append({
+                'document_name': meta.get('document_name', ''),
+                'page_num': meta.get('page_num'),
+                'paragraph_num': meta.get('paragraph_num'),
+                'content': doc['content'][:CONTENT_PREVIEW_LENGTH] + '...' if len(doc['content']) > CONTENT_PREVIEW_LENGTH else doc['content'],
+                'score': doc.get('score', 0),
+                'distance': meta.get('distance', 0)
+            })
+        
+        prompt = f"""{QA_INSTRUCTION}
 
 【历史对话】
 {history_str}
@@ -101,66 +232,275 @@ class QAService:
 {request.question}
 
 【你的回答】"""
+        return prompt, sources
+    
+    async def _prepare(self, request):
+        """向量化、检索、重排序并构造Prompt；各阶段在各自的线程池中执行，不阻塞事件循环
+        
+        返回 (prompt, sources)，未检索到内容时prompt为None。
+        """
+        mode = getattr(request, 'retrieval_mode', None) or RETRIEVAL_MODE
+        
+        # 1. 查询向量（仅全文检索时不需要）
+        q_emb = None
+        if mode != 'lexical':
+            q_emb = await run_in_stage('embedding', get_query_embedding, request.question)
+        
+        # 2. 检索Top-K
+        doc_list = await self._search(
+            request.question, q_emb, mode, getattr(request, 'ef_search', None), getattr(request, 'collections', None)
+        )
+        if not doc_list:
+            return None, []
+        
+        # 3. 重排序
+        reranked = (await run_in_stage('rerank', rerank, request.question, doc_list))[:TOP_N]
+        
+        return self._build_prompt(request, reranked)
+    
+    @timer
+    async def answer_question(self, request):
+        """回答单个问题"""
+        try:
+            prompt, sources = await self._prepare(request)
+            if prompt is None:
+                return {"answer": "未找到相关信息", "sources": []}
             
             # 5. LLM生成
-            answer = generate_answer(prompt)
+            answer = await run_in_stage('generation', generate_answer, prompt)
             return {"answer": answer, "sources": sources}
             
         except Exception as e:
             logger.error(f"问答处理失败: {e}")
             raise HTTPException(status_code=500, detail=f"处理问题时出错: {str(e)}")
-        finally:
-            session.close()
     
-    async def batch_answer(self, questions: list):
-        """批量问答"""
+    async def stream_answer(self, request):
+        """流式回答（Server-Sent Events）
+        
+        依次推送 sources（参考来源）、token（增量文本）、done（耗时统计）事件，
+        出错时推送 error 事件。生成过程在generation线程池中消费，受同一并发上限约束。
+        """
+        start_time = time.perf_counter()
+        try:
+            prompt, sources = await self._prepare(request)
+            retrieval_time = time.perf_counter() - start_time
+            yield _sse('sources', {"sources": sources})
+            
+            if prompt is None:
+                yield _sse('token', {"text": "未找到相关信息"})
+                yield _sse('done', {
+                    "retrieval_ms": round(retrieval_time * 1000, 1),
+                    "ttft_ms": None,
+                    "total_ms": round(retrieval_time * 1000, 1),
+                    "chunks": 0
+                })
+                return
+            
+            first_token_time = None
+            chunk_count = 0
+            async for text in iterate_in_stage('generation', stream_answer, prompt):
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - start_time
+                    logger.info(f"首token延迟: {first_token_time:.2f}秒（检索 {retrieval_time:.2f}秒）")
+                chunk_count += 1
+                yield _sse('token', {"text": text})
+            
+            total_time = time.perf_counter() - start_time
+            yield _sse('done', {
+                "retrieval_ms": round(retrieval_time * 1000, 1),
+                "ttft_ms": round(first_token_time * 1000, 1) if first_token_time is not None else None,
+                "total_ms": round(total_time * 1000, 1),
+                "chunks": chunk_count
+            })
+        except Exception as e:
+            logger.error(f"流式问答处理失败: {e}")
+            yield _sse('error', {"detail": f"处理问题时出错: {str(e)}"})
+    
+    async def _answer_batch(self, questions: list, collections: list = None):
+        """批量问答流水线：问题一次性向量化，检索并发执行，
+        所有 (问题, 文档) 对合并重排序，Prompt整批生成"""
+        from api.routes.qa import QARequest
+        results = [{"question": q, "success": False} for q in questions]
+        
+        # 1. 一次前向计算得到全部问题向量
+        q_embs = [None] * len(questions)
+        if RETRIEVAL_MODE != 'lexical':
+            q_embs = await run_in_stage('embedding', get_query_embeddings, questions)
+        
+        # 2. 并发检索，单个问题检索失败不影响其他问题
+        retrieved = await asyncio.gather(
+            *(self._search(q, q_emb, RETRIEVAL_MODE, collections=collections) for q, q_emb in zip(questions, q_embs)),
+            return_exceptions=True
+        )
+        pending = []
+        for i, docs in enumerate(retrieved):
+            if isinstance(docs, Exception):
+                results[i]["error"] = str(docs)
+            elif not docs:
+                results[i].update(answer="未找到相关信息", sources=[], success=True)
+            else:
+                pending.append(i)
+        if not pending:
+            return results
+        
+        # 3. 跨问题共用微批重排序
+        reranked = await run_in_stage(
+            'rerank', rerank_many, [questions[i] for i in pending], [retrieved[i] for i in pending]
+        )
+        
+        # 4. 构造Prompt并批量生成
+        prompts, sources = [], []
+        for i, docs in zip(pending, reranked):
+            prompt, doc_sources = self._build_prompt(QARequest(question=questions[i], history=[]), docs[:TOP_N])
+            prompts.append(prompt)
+            sources.append(doc_sources)
+        answers = await run_in_stage('generation', generate_answers, prompts)
+        for i, answer, doc_sources in zip(pending, answers, sources):
+            results[i].update(answer=answer, sources=doc_sources, success=True)
+        return results
+    
+    async def _run_batch(self, questions: list, on_progress=None, collections: list = None):
+        """按 QA_BATCH_CHUNK_SIZE 分轮执行批量流水线，某一轮失败时该轮问题标记为失败"""
         results = []
-        for question in questions:
+        for start in range(0, len(questions), QA_BATCH_CHUNK_SIZE):
+            chunk = questions[start:start + QA_BATCH_CHUNK_SIZE]
             try:
-                from api.routes.qa import QARequest
-                request = QARequest(question=question, history=[])
-                response = await self.answer_question(request)
-                results.append({
-                    "question": question,
-                    "answer": response["answer"],
-                    "success": True
-                })
+                results.extend(await self._answer_batch(chunk, collections))
             except Exception as e:
-                results.append({
-                    "question": question,
-                    "error": str(e),
-                    "success": False
-                })
+                logger.error(f"批量问答处理失败: {e}")
+                results.extend({"question": q, "error": str(e), "success": False} for q in chunk)
+            if on_progress:
+                await on_progress(len(results))
+        return results
+    
+    @timer
+    async def batch_answer(self, questions: list, collections: list = None):
+        """批量问答"""
+        return {"results": await self._run_batch(questions, collections=collections)}
+    
+    async def submit_batch_job(self, questions: list, background_tasks: BackgroundTasks, collections: list = None):
+        """提交异步批量问答任务，返回任务ID供轮询结果"""
+        job_id = uuid.uuid4().hex
+        await run_in_session(self._create_batch_job, job_id, len(questions))
+        background_tasks.add_task(self._process_batch_job, job_id, questions, collections)
+        return {"job_id": job_id, "status": "pending", "total": len(questions)}
+    
+    def _create_batch_job(self, session, job_id: str, total: int):
+        """登记任务，并按提交顺序只保留最近 QA_BATCH_JOB_RETAIN 个"""
+        session.add(BatchJob(job_id=job_id, status="pending", total=total, completed=0, created_at=time.time()))
+        session.flush()
+        expired = session.query(BatchJob.job_id).order_by(BatchJob.created_at.desc()).offset(QA_BATCH_JOB_RETAIN)
+        session.query(BatchJob).filter(BatchJob.job_id.in_(expired.subquery().select())).delete(synchronize_session=False)
+        session.commit()
+    
+    @staticmethod
+    def _update_batch_job(session, job_id: str, **fields):
+        session.query(BatchJob).filter(BatchJob.job_id == job_id).update(fields, synchronize_session=False)
+        session.commit()
+    
+    async def _process_batch_job(self, job_id: str, questions: list, collections: list = None):
+        """后台执行批量问答任务，进度和结果写入任务表"""
+        async def update(**fields):
+            try:
+                await run_in_session(self._update_batch_job, job_id, **fields)
+            except Exception as e:
+                logger.error(f"更新批量问答任务 {job_id} 状态失败: {e}")
         
-        return {"results": results}
+        await update(status="running")
+        start_time = time.perf_counter()
+        try:
+            results = await self._run_batch(questions, on_progress=lambda n: update(completed=n), collections=collections)
+            await update(status="completed", completed=len(results), results=results, finished_at=time.time())
+            elapsed = time.perf_counter() - start_time
+            logger.info(f"批量问答任务 {job_id} 完成: {len(questions)} 个问题, 耗时 {elapsed:.1f}秒")
+        except Exception as e:
+            logger.error(f"批量问答任务 {job_id} 失败: {e}")
+            await update(status="failed", error=str(e), finished_at=time.time())
+    
+    async def get_batch_job(self, job_id: str):
+        """查询批量问答任务状态，完成后包含全部结果"""
+        job = await run_in_session(self._get_batch_job, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="任务不存在或已过期")
+        return job
     
-    async def search_content(self, query: str, limit: int = 20):
-        """基于内容的文本搜索"""
-        session = SessionLocal()
+    def _get_batch_job(self, session, job_id: str):
+        # 读主库：刚提交的任务可能尚未复制到只读副本
+        job = session.get(BatchJob, job_id)
+        if job is None:
+            return None
+        return {
+            "job_id": job.job_id,
+            "status": job.status,
+            "total": job.total,
+            "completed": job.completed,
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+            "error": job.error,
+            "results": job.results
+        }
+    
+    async def search_content(self, query: str, limit: int = 20, cursor: str = None, collections: list = None):
+        """基于内容的子串搜索，按相似度排序，使用游标翻页；collections 限定搜索的集合"""
+        after = None
+        if cursor:
+            try:
+                values = decode_cursor(cursor)
+                after = (Decimal(values['score']), int(values['id']))
+            except (ValueError, KeyError, TypeError, ArithmeticError):
+                raise HTTPException(status_code=400, detail="无效的分页游标")
         try:
-            chunks = session.query(DocumentChunk).filter(
-                DocumentChunk.content.ilike(f'%{query}%')
-            ).limit(limit).all()
-
-            results = []
-            for chunk in chunks:
-                content = getattr(chunk, 'content', '') or ''
-                preview = content[:SEARCH_CONTENT_PREVIEW_LENGTH] + '...' if len(content) > SEARCH_CONTENT_PREVIEW_LENGTH else content
-                results.append({
-                    "document_id": chunk.document_id,
-                    "document_name": chunk.document_name,
-                    "chunk_index": chunk.chunk_index,
-                    "content": preview,
-                    "page_num": chunk.page_num,
-                    "paragraph_num": chunk.paragraph_num
-                })
-
-            return {
-                "query": query,
-                "results": results
-            }
+            return await run_in_replica(self._search_content, query, limit, after, collections)
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"内容搜索失败: {e}")
             raise HTTPException(status_code=500, detail="内容搜索失败")
-        finally:
-            session.close()
\ No newline at end of file
+    
+    def _search_content(self, session, query: str, limit: int, after=None, collections: list = None):
+        # ILIKE子串匹配由pg_trgm GIN索引加速；word_similarity衡量问题与分块中最相近片段的相似度
+        score = func.round(cast(func.word_similarity(query, DocumentChunk.content), Numeric), 4)
+        preview = func.substr(DocumentChunk.content, 1, SEARCH_CONTENT_PREVIEW_LENGTH + 1)
+        rows_query = self._scope(session.query(
+            DocumentChunk.id,
+            DocumentChunk.collection_id,
+            DocumentChunk.document_id,
+            DocumentChunk.document_name,
+            DocumentChunk.chunk_index,
+            DocumentChunk.page_num,
+            DocumentChunk.paragraph_num,
+            preview.label('preview'),
+            score.label('score')
+        ), collections).filter(
+            DocumentChunk.content.ilike(like_pattern(query), escape='\\')
+        )
+        if after is not None:
+            # 键集分页：从上一页最后一条 (score, id) 之后继续
+            last_score, last_id = after
+            rows_query = rows_query.filter(or_(
+                score < last_score,
+                and_(score == last_score, DocumentChunk.id > last_id)
+            ))
+        rows = rows_query.order_by(score.desc(), DocumentChunk.id).limit(limit + 1).all()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        results = []
+        for row in rows:
+            content = row.preview or ''
+            results.append({
+                "collection_id": row.collection_id,
+                "document_id": row.document_id,
+                "document_name": row.document_name,
+                "chunk_index": row.chunk_index,
+                "content": content[:SEARCH_CONTENT_PREVIEW_LENGTH] + '...' if len(content) > SEARCH_CONTENT_PREVIEW_LENGTH else content,
+                "page_num": row.page_num,
+                "paragraph_num": row.paragraph_num,
+                "score": float(row.score)
+            })
+
+        return {
+            "query": query,
+            "results": results,
+            "next_cursor": encode_cursor({"score": str(rows[-1].score), "id": rows[-1].id}) if has_more else None
+        }
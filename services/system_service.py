@@ -1,33 +1,78 @@
 import logging
+import os
+import threading
+import time
 
 from fastapi import HTTPException
+from sqlalchemy import distinct, func, text
 
-from config import EMBEDDING_MODEL, RERANK_MODEL, LLM_MODEL
-from db import SessionLocal
-from models import DocumentChunk
+from config import EMBEDDING_MODEL, RERANK_MODEL, LLM_MODEL, STATS_MODE, STATS_CACHE_TTL
+from db import run_in_replica
+from models import CorpusStats, DocumentChunk, active_chunks
 
 logger = logging.getLogger(__name__)
 
+# 统计信息缓存：{模式: (过期时间, 结果)}
+_stats_cache = {}
+_stats_cache_lock = threading.Lock()
+
 class SystemService:
     """系统服务"""
     
-    async def get_stats(self):
-        """获取系统统计信息"""
-        session = SessionLocal()
+    async def get_stats(self, exact: bool = False):
+        """获取系统统计信息
+        
+        默认读取触发器维护的计数（STATS_MODE=approximate 时分块数改用pg_class估算行数），
+        三种模式都只统计就绪文档及其分块；
+        结果在进程内缓存 STATS_CACHE_TTL 秒；exact=True 时绕过缓存对分块表做精确计数。
+        """
+        mode = 'exact' if exact else STATS_MODE
+        if mode != 'exact':
+            with _stats_cache_lock:
+                cached = _stats_cache.get(mode)
+                if cached and cached[0] > time.monotonic():
+                    return {**cached[1], "cached": True}
         try:
-            total_chunks = session.query(DocumentChunk).count()
-            total_docs = session.query(DocumentChunk.document_id).distinct().count()
-            
-            return {
-                "total_documents": total_docs,
-                "total_chunks": total_chunks,
-                "avg_chunks_per_doc": round(total_chunks / total_docs, 2) if total_docs > 0 else 0
-            }
+            stats = await run_in_replica(self._get_stats, mode)
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"获取统计信息失败: {e}")
             raise HTTPException(status_code=500, detail="获取统计信息失败")
-        finally:
-            session.close()
+        if mode != 'exact':
+            with _stats_cache_lock:
+                _stats_cache[mode] = (time.monotonic() + STATS_CACHE_TTL, stats)
+        return {**stats, "cached": False}
+    
+    def _get_stats(self, session, mode: str):
+        if mode == 'exact':
+            total_chunks, total_docs = session.query(
+                func.count(DocumentChunk.id), func.count(distinct(DocumentChunk.document_id))
+            ).filter(active_chunks()).one()
+        elif mode == 'approximate':
+            # 文档数取触发器维护的计数：documents 表的估算行数会把 retired/failed 行也算进去，
+            # 与另外两种模式只统计就绪文档不一致；计数只有一行，读取开销与估算相当
+            counter = session.get(CorpusStats, 1)
+            total_docs = counter.total_documents if counter else 0
+            # 分块数按最近一次ANALYZE的估算行数，分区表累加各分区；从未分析过的表reltuples为-1，记为0。
+            # 蓝绿同步切换后、旧版本分块回收前，估算值会暂时包含已退役的分块
+            total_chunks = session.execute(text("""
+                SELECT coalesce(sum(greatest(reltuples, 0)), 0)::bigint FROM pg_class
+                WHERE oid = 'documents_chunk'::regclass
+                   OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'documents_chunk'::regclass)
+            """)).scalar()
+        else:
+            counter = session.get(CorpusStats, 1)
+            total_docs, total_chunks = (counter.total_documents, counter.total_chunks) if counter else (0, 0)
+        
+        return {
+            "total_documents": total_docs,
+            "total_chunks": total_chunks,
+            "avg_chunks_per_doc": round(total_chunks / total_docs, 2) if total_docs > 0 else 0,
+            "mode": mode,
+            # 各字段是否为估算值，便于调用方区分精确计数与pg_class估算
+            "estimated": ["total_chunks", "avg_chunks_per_doc"] if mode == 'approximate' else []
+        }
     
     async def get_system_info(self):
         """获取系统信息"""
@@ -43,7 +88,7 @@ class SystemService:
         try:
             from embedding import _embedding_model
             from rerank import _rerank_model
-            from llm import _llm_model
+            from llm import _llm_model, _generation_scheduler
             
             return {
                 "embedding_model": {
@@ -56,9 +101,66 @@ class SystemService:
                 },
                 "llm_model": {
                     "loaded": _llm_model is not None,
-                    "model_name": LLM_MODEL if _llm_model else None
+                    "model_name": LLM_MODEL if _llm_model else None,
+                    "scheduler": _generation_scheduler.stats() if _generation_scheduler else None,
+                    "prompt_lookup": _llm_model.get_lookup_stats() if _llm_model else None
                 }
             }
         except Exception as e:
             logger.error(f"获取模型状态失败: {e}")
-            raise HTTPException(status_code=500, detail="获取模型状态失败")
\ No newline at end of file
+            raise HTTPException(status_code=500, detail="获取模型状态失败")
+    
+    async def get_cache_stats(self):
+        """获取缓存命中统计"""
+        try:
+            from embedding import _embedding_cache, _query_cache
+            from token_store import _token_stores
+            from local_index import local_indexes
+            indexes = local_indexes()
+            
+            return {
+                "embedding_cache": _embedding_cache.stats() if _embedding_cache else {"enabled": False},
+                "query_cache": _query_cache.stats() if _query_cache else {"enabled": False},
+                "token_stores": {role: store.stats() for role, store in _token_stores.items()},
+                "local_index": {collection_id: index.stats() for collection_id, index in indexes.items()} or {"enabled": False}
+            }
+        except Exception as e:
+            logger.error(f"获取缓存统计失败: {e}")
+            raise HTTPException(status_code=500, detail="获取缓存统计失败")
+    
+    async def get_executor_stats(self):
+        """获取各阶段线程池的并发状态"""
+        try:
+            from executors import executor_stats
+            return executor_stats()
+        except Exception as e:
+            logger.error(f"获取线程池状态失败: {e}")
+            raise HTTPException(status_code=500, detail="获取线程池状态失败")
+    
+    async def get_db_pool_stats(self):
+        """获取数据库连接池状态"""
+        try:
+            from db import pool_stats
+            return pool_stats()
+        except Exception as e:
+            logger.error(f"获取连接池状态失败: {e}")
+            raise HTTPException(status_code=500, detail="获取连接池状态失败")
+    
+    async def get_worker_memory(self):
+        """获取各worker进程的内存占用，PSS合计即多进程部署的实际内存需求"""
+        try:
+            from prefork import models_preloaded, worker_pids, master_pid
+            from utils import get_process_memory
+            
+            workers = [get_process_memory(pid) for pid in worker_pids()]
+            return {
+                "mode": "prefork" if models_preloaded() else "single",
+                "current_pid": os.getpid(),
+                "master": get_process_memory(master_pid()) if models_preloaded() else None,
+                "workers": workers,
+                "total_rss_mb": round(sum(w["rss_mb"] for w in workers), 1),
+                "total_pss_mb": round(sum(w["pss_mb"] for w in workers), 1)
+            }
+        except Exception as e:
+            logger.error(f"获取进程内存失败: {e}")
+            raise HTTPException(status_code=500, detail="获取进程内存失败")
\ No newline at end of file
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows下只做进程内加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TOKEN_STORE_FORMAT = 1  # 存储格式版本，格式变化时递增
+INDEX_DTYPE = np.dtype([('key', 'V32'), ('offset', '<i8'), ('length', '<i4')])
+
+
+class TokenStore:
+    """分块token ID的预存储
+
+    每个模型角色（embedding/rerank）一个目录：tokens.bin 顺序追加uint32的token ID，
+    index.bin 记录 (sha256(分块文本), 偏移, 长度)。meta.json 中记录模型名、格式版本、
+    截断长度和分词器配置摘要，任一变化时整个目录失效重建，避免混用不同分词或截断结果。
+
+    多个进程（prefork worker、后台导入）会同时追加：写入在目录文件锁内按文件实际大小计算偏移，
+    未命中时先读入其他进程追加的索引记录，读取前核对记录是否落在tokens.bin范围内。
+    """
+
+    def __init__(self, store_dir: str, role: str, model_name: str, max_length: int = None, tokenizer_hash: str = None):
+        self.path = os.path.join(store_dir, role)
+        self.role = role
+        self.model_name = model_name
+        self.max_length = max_length
+        self.tokenizer_hash = tokenizer_hash
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._open()
+
+    def _open(self):
+        os.makedirs(self.path, exist_ok=True)
+        meta = {
+            'model': self.model_name, 'format': TOKEN_STORE_FORMAT,
+            'max_length': self.max_length, 'tokenizer': self.tokenizer_hash
+        }
+        meta_path = os.path.join(self.path, 'meta.json')
+        tokens_path = os.path.join(self.path, 'tokens.bin')
+        index_path = os.path.join(self.path, 'index.bin')
+
+        with self._locked():
+            stale = True
+            if os.path.exists(meta_path):
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    stale = json.load(f) != meta
+            if stale:
+                for p in (tokens_path, index_path):
+                    if os.path.exists(p):
+                        os.remove(p)
+                with open(meta_path, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f)
+                logger.info(f"token存储已按当前模型重建: {self.path} ({self.model_name})")
+
+            self._tokens = open(tokens_path, 'a+b')
+            self._index_file = open(index_path, 'a+b')
+            self._index = {}
+            self._index_size = 0
+            self._load_index()
+
+    @contextmanager
+    def _locked(self):
+        """进程内线程锁 + 存储目录上的跨进程文件锁"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.path, 'lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        """读入 index.bin 中尚未加载的完整记录（包括其他进程追加的），需持有锁"""
+        self._index_file.seek(self._index_size)
+        raw = self._index_file.read()
+        # 丢弃进程中断时可能残留的半条索引记录
+        raw = raw[:len(raw) - len(raw) % INDEX_DTYPE.itemsize]
+        records = np.frombuffer(raw, dtype=INDEX_DTYPE)
+        self._index.update({bytes(r['key']): (int(r['offset']), int(r['length'])) for r in records})
+        self._index_size += len(raw)
+
+    @staticmethod
+    def make_key(text: str) -> bytes:
+        return hashlib.sha256(text.encode('utf-8')).digest()
+
+    def get_many(self, texts: list) -> dict:
+        """批量读取token ID，返回 {输入下标: uint32数组}"""
+        found = {}
+        keys = [self.make_key(text) for text in texts]
+        with self._locked():
+            if any(key not in self._index for key in keys):
+                self._load_index()
+            size = os.fstat(self._tokens.fileno()).st_size // 4
+            for i, key in enumerate(keys):
+                location = self._index.get(key)
+                if location is None:
+                    continue
+                offset, length = location
+                if offset < 0 or offset + length > size:
+                    logger.warning(f"token存储索引记录越界，忽略: {self.path} offset={offset} length={length}")
+                    continue
+                self._tokens.seek(offset * 4)
+                found[i] = np.frombuffer(self._tokens.read(length * 4), dtype='<u4')
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, texts: list, token_ids: list):
+        """批量写入token ID，已存在的文本跳过"""
+        with self._locked():
+            self._load_index()
+            records = []
+            # 偏移按文件实际大小计算：O_APPEND写入总在文件末尾，其他进程可能已追加过数据；
+            # 进程中断残留的不完整数据先截掉，保证追加位置按4字节对齐
+            size = os.fstat(self._tokens.fileno()).st_size
+            if size % 4:
+                self._tokens.truncate(size - size % 4)
+            offset = size // 4
+            for text, ids in zip(texts, token_ids):
+                key = self.make_key(text)
+                if key in self._index:
+                    continue
+                ids = np.asarray(ids, dtype='<u4')
+                self._tokens.write(ids.tobytes())
+                self._index[key] = (offset, len(ids))
+                records.append((key, offset, len(ids)))
+                offset += len(ids)
+            if not records:
+                return
+            # 先落盘token数据再写索引，中断时最多丢失未写索引的数据
+            self._tokens.flush()
+            data = np.array(records, dtype=INDEX_DTYPE).tobytes()
+            if os.fstat(self._index_file.fileno()).st_size != self._index_size:
+                self._index_file.truncate(self._index_size)
+            self._index_file.write(data)
+            self._index_file.flush()
+            self._index_size += len(data)
+
+    def lookup_or_tokenize(self, texts: list, tokenize) -> list:
+        """读取已存储的token ID，未命中的调用tokenize批量分词后写入"""
+        found = self.get_many(texts)
+        missing = [i for i in range(len(texts)) if i not in found]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            missing_ids = tokenize(missing_texts)
+            self.put_many(missing_texts, missing_ids)
+            for i, ids in zip(missing, missing_ids):
+                found[i] = np.asarray(ids, dtype='<u4')
+        return [found[i] for i in range(len(texts))]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": True,
+                "model": self.model_name,
+                "entries": len(self._index),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0
+            }
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """分词器中影响token ID的配置摘要：类型、词表大小、特殊token和截断方向"""
+    config = {
+        "class": type(tokenizer).__name__,
+        "vocab_size": len(tokenizer),
+        "special_tokens": tokenizer.special_tokens_map,
+        "special_ids": tokenizer.all_special_ids,
+        "truncation_side": getattr(tokenizer, 'truncation_side', None),
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+# 按角色缓存的全局实例
+_token_stores = {}
+_token_stores_lock = threading.Lock()
+
+def get_token_store(role: str, model_name: str, max_length: int = None, tokenizer=None):
+    """获取指定模型角色的token存储，未启用时返回None
+
+    max_length 为写入时的截断长度，tokenizer 用于计算配置摘要，两者变化都会使已存储的token ID失效。
+    """
+    from config import TOKEN_STORE_ENABLED, TOKEN_STORE_DIR
+    if not TOKEN_STORE_ENABLED:
+        return None
+    with _token_stores_lock:
+        store = _token_stores.get(role)
+        if store is None or store.model_name != model_name or store.max_length != max_length:
+            tokenizer_hash = tokenizer_fingerprint(tokenizer) if tokenizer is not None else None
+            store = TokenStore(TOKEN_STORE_DIR, role, model_name, max_length, tokenizer_hash)
+            _token_stores[role] = store
+        return store
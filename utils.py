@@ -1,3 +1,6 @@
+import base64
+import inspect
+import json
 import logging
 import os
 import time
@@ -19,7 +22,19 @@ def setup_logging():
     )
 
 def timer(func: Callable) -> Callable:
-    """计时装饰器"""
+    """计时装饰器，同时支持同步函数和协程函数"""
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start_time = time.time()
+            result = await func(*args, **kwargs)
+            end_time = time.time()
+            logging.getLogger(func.__module__).info(
+                f"{func.__name__} 执行时间: {end_time - start_time:.2f}秒"
+            )
+            return result
+        return async_wrapper
+    
     @wraps(func)
     def wrapper(*args, **kwargs):
         start_time = time.time()
@@ -94,4 +109,40 @@ def get_system_info():
         "memory_total": format_file_size(psutil.virtual_memory().total),
         "memory_available": format_file_size(psutil.virtual_memory().available),
         "disk_usage": format_file_size(psutil.disk_usage('/').total)
-    }
\ No newline at end of file
+    }
+
+def get_process_memory(pid: int = None) -> dict:
+    """获取进程内存占用(MB)：RSS包含共享页，PSS按共享进程数分摊，USS为进程独占"""
+    import psutil
+    
+    process = psutil.Process(pid or os.getpid())
+    info = process.memory_full_info()
+    to_mb = lambda value: round(value / (1024 * 1024), 1)
+    return {
+        "pid": process.pid,
+        "rss_mb": to_mb(info.rss),
+        "pss_mb": to_mb(getattr(info, 'pss', info.rss)),
+        "uss_mb": to_mb(info.uss),
+        "shared_mb": to_mb(info.rss - info.uss)
+    }
+
+def like_pattern(text: str) -> str:
+    """构造子串匹配的LIKE模式，转义用户输入中的通配符（配合 escape='\\' 使用）"""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+def encode_cursor(values: dict) -> str:
+    """将分页位置编码为不透明的游标字符串"""
+    raw = json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> dict:
+    """解析游标字符串，格式不合法时抛出ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except Exception as e:
+        raise ValueError(f"无效的游标: {cursor}") from e
+    if not isinstance(values, dict):
+        raise ValueError(f"无效的游标: {cursor}")
+    return values
\ No newline at end of file